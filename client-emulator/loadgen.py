@@ -0,0 +1,404 @@
+'''
+    Load generator: simulates thousands of participants in a single process.
+
+    Every simulated participant follows the same protocol as `main.py` (join
+    through the HTTP API, wait for the question, notify READY and send
+    position updates while the session is active), but all of them share a
+    single asyncio event loop: HTTP requests go through one `aiohttp`
+    session and each participant's MQTT connection is driven by the loop
+    through paho's socket callbacks instead of its own network thread.
+
+    End-to-end latency is measured by a monitor connection subscribed to
+    every participant update topic. Update timestamps are relative to the
+    moment each participant saw the session start (as in the real client),
+    and both ends live in this process, so the send time is recovered as
+    `start_time[participant] + timestamp`.
+'''
+import asyncio
+import json
+import threading
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from random import Random
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+import paho.mqtt.client as mqtt
+
+import wire
+from shared import load
+
+LatencyHistogram = load('latency').LatencyHistogram
+
+
+@dataclass
+class LoadConfig:
+    api_url: str = 'http://localhost:5000'
+    mqtt_host: str = 'localhost'
+    mqtt_port: int = 9001
+    session_id: int = 1
+    participants: int = 100
+    ramp: float = 50.0              # Joins per second
+    rate: float = 10.0              # Position updates per second and participant
+    payload_size: Optional[int] = None  # Position values per update (default: number of answers)
+    wire_format: str = 'json'
+    quantize: bool = False
+    seed: int = 0
+    duration: float = 60.0
+    autostart: bool = False
+    username_prefix: str = 'load.user'
+    report_interval: float = 5.0
+    heartbeat_interval: float = 5.0     # 0 disables heartbeats (the server won't time the participants out)
+
+
+class Metrics:
+    def __init__(self):
+        self.started = perf_counter()
+        self.joined = 0
+        self.join_errors = 0
+        self.ready = 0
+        self.sent = 0
+        self.received = 0
+        # Fixed memory and O(1) recording, whatever the length of the run
+        self.join_latencies = LatencyHistogram()
+        self.update_latencies = LatencyHistogram()
+
+        self._last_report = (self.started, 0, 0)
+
+    def report(self, final=False) -> str:
+        now = perf_counter()
+        last_time, last_sent, last_received = self._last_report
+        self._last_report = (now, self.sent, self.received)
+        if final:
+            last_time, last_sent, last_received = self.started, 0, 0
+
+        elapsed = max(now - last_time, 1e-9)
+        join = self.join_latencies.as_dict
+        update = self.update_latencies.as_dict
+        fmt = lambda v: '-' if v is None else f"{v * 1000:.1f}ms"
+        return (
+            f"[{now - self.started:7.1f}s] "
+            f"joined={self.joined} (errors={self.join_errors}) ready={self.ready} | "
+            f"sent={(self.sent - last_sent) / elapsed:.0f} msg/s received={(self.received - last_received) / elapsed:.0f} msg/s | "
+            f"join p50={fmt(join['p50'])} p99={fmt(join['p99'])} | "
+            f"e2e p50={fmt(update['p50'])} p90={fmt(update['p90'])} p99={fmt(update['p99'])} max={fmt(update['max'])}"
+        )
+
+
+class AsyncMQTTClient:
+    '''
+        paho client driven by an asyncio event loop (no network thread).
+
+        Only the blocking connection (TCP connect and websocket handshake)
+        runs in the loop's executor, so participants connect concurrently.
+        The socket callbacks it triggers are forwarded to the loop thread.
+    '''
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client_id=''):
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        self.client = mqtt.Client(client_id=client_id, transport='websockets')
+        self.client.ws_set_options(path='/')
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+        self.connected = loop.create_future()
+        self.client.on_connect = self.on_connect
+        self._misc_task = None
+
+    def on_connect(self, client, obj, flags, rc):
+        if not self.connected.done():
+            self.connected.set_result(rc == mqtt.CONNACK_ACCEPTED)
+
+    def _in_loop(self, callback, *args):
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._in_loop(self._watch, sock)
+
+    def on_socket_close(self, client, userdata, sock):
+        self._in_loop(self._unwatch, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._in_loop(self.loop.remove_writer, sock)
+
+    def _watch(self, sock):
+        self.loop.add_reader(sock, self._read)
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _unwatch(self, sock):
+        self.loop.remove_reader(sock)
+        if self._misc_task:
+            self._misc_task.cancel()
+
+    def _read(self):
+        self.client.loop_read()
+        # The websocket wrapper may have buffered more frames than the packet just read:
+        # the socket won't be readable again for them
+        sock = self.client.socket()
+        while sock is not None and getattr(sock, 'pending', lambda: 0)() > 0:
+            if self.client.loop_read() != mqtt.MQTT_ERR_SUCCESS:
+                break
+            sock = self.client.socket()
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    async def connect(self, host, port) -> bool:
+        await self.loop.run_in_executor(None, self.client.connect, host, port, 60)
+        return await self.connected
+
+    def disconnect(self):
+        self.client.disconnect()
+
+
+class SimulatedParticipant:
+    def __init__(self, index: int, config: LoadConfig, http: aiohttp.ClientSession, metrics: Metrics,
+                 start_times: Dict[int, float]):
+        self.config = config
+        self.http = http
+        self.metrics = metrics
+        self.start_times = start_times
+        self.random = Random(config.seed * 1_000_003 + index)
+        self.username = f"{config.username_prefix}{index}"
+        self.participant_id = None
+        self.question = None
+        self.position: List[float] = []
+        self.mqtt: Optional[AsyncMQTTClient] = None
+        self.update_task: Optional[asyncio.Task] = None
+        self.heartbeat_task: Optional[asyncio.Task] = None
+
+    async def run(self, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await self.join()
+        except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+            self.metrics.join_errors += 1
+            print(f"* ERROR: {self.username} couldn't join: {e!r}")
+            return
+
+        if self.config.autostart:
+            self.start_updates()
+
+    async def join(self):
+        started = perf_counter()
+        session_url = f"{self.config.api_url}/api/session/{self.config.session_id}"
+        async with self.http.post(f"{session_url}/join", json={'user': self.username}) as res:
+            if res.status != 200:
+                raise aiohttp.ClientError(f"[{res.status}] {await res.text()}")
+            joined = await res.json()
+        self.participant_id = joined['participant']['id']
+
+        self.mqtt = AsyncMQTTClient(asyncio.get_running_loop())
+        self.mqtt.client.on_message = self.on_message
+        # If the connection drops, the broker tells the server that this participant left
+        self.mqtt.client.will_set(self.control_topic, json.dumps({'type': 'disconnect'}))
+        if not await self.mqtt.connect(self.config.mqtt_host, self.config.mqtt_port):
+            raise OSError("MQTT connection refused")
+        self.mqtt.client.subscribe([
+            (f'swarm/session/{self.config.session_id}/control', 0),
+            (f'swarm/session/{self.config.session_id}/updates', 0),
+        ])
+        if self.config.heartbeat_interval > 0:
+            self.heartbeat_task = asyncio.get_running_loop().create_task(self.send_heartbeats())
+
+        self.metrics.joined += 1
+        self.metrics.join_latencies.record(perf_counter() - started)
+
+        if joined['question'] is not None:
+            self.load_question(joined['question'])
+
+    async def setup_question(self, question_id):
+        async with self.http.get(f"{self.config.api_url}/api/question/{question_id}") as res:
+            if res.status != 200:
+                return
+            self.load_question(await res.json())
+
+    def load_question(self, question: dict):
+        self.question = question
+        size = self.config.payload_size or len(self.question['answers'])
+        self.position = [self.random.random() for _ in range(size)]
+        self.publish_control({'type': 'ready'})
+        self.metrics.ready += 1
+
+    @property
+    def control_topic(self) -> str:
+        return f'swarm/session/{self.config.session_id}/control/{self.participant_id}'
+
+    def publish_control(self, payload: dict):
+        self.mqtt.client.publish(self.control_topic, json.dumps(payload))
+
+    async def send_heartbeats(self):
+        # Spread the heartbeats of all the participants along the interval
+        await asyncio.sleep(self.random.random() * self.config.heartbeat_interval)
+        while True:
+            self.publish_control({'type': 'heartbeat'})
+            await asyncio.sleep(self.config.heartbeat_interval)
+
+    def on_message(self, client, obj, msg):
+        if not msg.topic.endswith('/control'):
+            return  # Aggregated cue, not used by the simulation
+
+        payload = json.loads(msg.payload)
+        if payload['type'] == 'setup':
+            self.stop_updates()
+            if payload['question_id'] is not None:
+                asyncio.get_running_loop().create_task(self.setup_question(payload['question_id']))
+        elif payload['type'] == 'start':
+            self.start_updates()
+        elif payload['type'] == 'stop':
+            self.stop_updates()
+
+    def start_updates(self):
+        if self.update_task is None or self.update_task.done():
+            if not self.position:
+                self.position = [self.random.random() for _ in range(self.config.payload_size or 1)]
+            self.update_task = asyncio.get_running_loop().create_task(self.send_updates())
+
+    def stop_updates(self):
+        if self.update_task is not None:
+            self.update_task.cancel()
+            self.update_task = None
+
+    async def send_updates(self):
+        loop = asyncio.get_running_loop()
+        start_time = perf_counter()
+        self.start_times[self.participant_id] = start_time
+        topic = f'swarm/session/{self.config.session_id}/updates/{self.participant_id}'
+        encoding = wire.INT16 if self.config.quantize else wire.FLOAT32
+        period = 1 / self.config.rate
+
+        # Spread participants along the period, then keep an absolute schedule to avoid drifting
+        next_time = loop.time() + self.random.random() * period
+        while True:
+            await asyncio.sleep(max(0, next_time - loop.time()))
+            next_time += period
+
+            self.position = [min(1, max(0, v + (self.random.random() - 0.5) * 0.02)) for v in self.position]
+            timestamp = perf_counter() - start_time
+            if self.config.wire_format == 'binary':
+                payload = wire.encode_update(self.participant_id, timestamp, self.position, encoding)
+            else:
+                payload = json.dumps({'data': {'position': self.position}, 'timestamp': timestamp})
+            self.mqtt.client.publish(topic, payload)
+            self.metrics.sent += 1
+
+    def close(self):
+        self.stop_updates()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        if self.mqtt:
+            if self.mqtt.client.is_connected():
+                self.publish_control({'type': 'leave'})
+            self.mqtt.disconnect()
+
+
+class UpdateMonitor:
+    '''
+        Receives every participant update through the broker to measure
+        the end-to-end latency.
+    '''
+
+    def __init__(self, config: LoadConfig, metrics: Metrics, start_times: Dict[int, float]):
+        self.config = config
+        self.metrics = metrics
+        self.start_times = start_times
+        self.mqtt: Optional[AsyncMQTTClient] = None
+
+    async def start(self):
+        self.mqtt = AsyncMQTTClient(asyncio.get_running_loop())
+        self.mqtt.client.on_message = self.on_message
+        if not await self.mqtt.connect(self.config.mqtt_host, self.config.mqtt_port):
+            raise OSError("MQTT connection refused")
+        self.mqtt.client.subscribe(f'swarm/session/{self.config.session_id}/updates/+')
+
+    def on_message(self, client, obj, msg):
+        received = perf_counter()
+        participant_id = int(msg.topic.rsplit('/', 1)[-1])
+        if wire.is_binary(msg.payload):
+            _, timestamp, _ = wire.decode_update(msg.payload)
+        else:
+            _, timestamp, _ = wire.decode_json(msg.payload, participant_id)
+
+        start_time = self.start_times.get(participant_id, None)
+        if start_time is None or timestamp is None:
+            return
+        self.metrics.received += 1
+        self.metrics.update_latencies.record(received - (start_time + timestamp))
+
+    def close(self):
+        if self.mqtt:
+            self.mqtt.disconnect()
+
+
+async def run(config: LoadConfig, on_report: Callable[[str], None] = print) -> Metrics:
+    metrics = Metrics()
+    start_times: Dict[int, float] = {}
+
+    monitor = UpdateMonitor(config, metrics, start_times)
+    await monitor.start()
+
+    connector = aiohttp.TCPConnector(limit=256)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as http:
+        participants = [
+            SimulatedParticipant(i, config, http, metrics, start_times)
+            for i in range(config.participants)
+        ]
+        tasks = [
+            asyncio.create_task(participant.run(i / config.ramp if config.ramp > 0 else 0))
+            for i, participant in enumerate(participants)
+        ]
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(config.report_interval)
+                on_report(metrics.report())
+        reporter_task = asyncio.create_task(reporter())
+
+        try:
+            await asyncio.sleep(config.duration)
+        finally:
+            reporter_task.cancel()
+            for task in tasks:
+                task.cancel()
+            for participant in participants:
+                participant.close()
+            monitor.close()
+
+    on_report("SUMMARY " + metrics.report(final=True))
+    return metrics
+
+
+if __name__ == '__main__':
+    defaults = LoadConfig()
+    parser = ArgumentParser(description="Simulates many participants joining and interacting with a session")
+    parser.add_argument('-s', '--session', dest='session_id', type=int, default=defaults.session_id, help=f"Session ID (default: {defaults.session_id})")
+    parser.add_argument('-n', '--participants', type=int, default=defaults.participants, help=f"Number of simulated participants (default: {defaults.participants})")
+    parser.add_argument('--ramp', type=float, default=defaults.ramp, help=f"Participants joining per second, 0 to join all at once (default: {defaults.ramp})")
+    parser.add_argument('--rate', type=float, default=defaults.rate, help=f"Position updates per second and participant (default: {defaults.rate})")
+    parser.add_argument('--payload-size', dest='payload_size', type=int, default=None, help="Position values per update (default: number of answers)")
+    parser.add_argument('-w', '--wire-format', dest='wire_format', choices=['binary', 'json'], default=defaults.wire_format, help=f"Position updates encoding (default: '{defaults.wire_format}')")
+    parser.add_argument('-q', '--quantize', action='store_true', help="Send binary position updates as quantized 16-bit values")
+    parser.add_argument('--seed', type=int, default=defaults.seed, help=f"Random seed (default: {defaults.seed})")
+    parser.add_argument('-d', '--duration', type=float, default=defaults.duration, help=f"Test duration in seconds (default: {defaults.duration})")
+    parser.add_argument('--autostart', action='store_true', help="Send updates right after joining instead of waiting for the session to start")
+    parser.add_argument('--api-url', dest='api_url', default=defaults.api_url, help=f"HTTP API URL (default: {defaults.api_url})")
+    parser.add_argument('--mqtt-host', dest='mqtt_host', default=defaults.mqtt_host, help=f"MQTT broker host (default: {defaults.mqtt_host})")
+    parser.add_argument('--mqtt-port', dest='mqtt_port', type=int, default=defaults.mqtt_port, help=f"MQTT broker websockets port (default: {defaults.mqtt_port})")
+    parser.add_argument('--report-interval', dest='report_interval', type=float, default=defaults.report_interval, help=f"Seconds between progress reports (default: {defaults.report_interval})")
+    parser.add_argument('--heartbeat-interval', dest='heartbeat_interval', type=float, default=defaults.heartbeat_interval, help=f"Seconds between participant heartbeats, 0 to disable them (default: {defaults.heartbeat_interval})")
+    config = LoadConfig(**vars(parser.parse_args()))
+
+    try:
+        asyncio.run(run(config))
+    except KeyboardInterrupt:
+        print("[Ctrl+C] Exit")
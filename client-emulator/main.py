@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 import json
 from random import random
+from threading import Event, Thread
 from typing import Callable, List
 from time import sleep, time
 from enum import Enum
@@ -9,8 +10,11 @@ from argparse import ArgumentParser
 import paho.mqtt.client as mqtt
 import requests
 
+import wire
+
 API_URL = 'http://localhost:5000'
 MQTT_URL = 'ws://localhost:1883'
+HEARTBEAT_INTERVAL = 5  # Seconds (the server timeout is 15 by default)
 
 @dataclass
 class Action:
@@ -26,47 +30,86 @@ class SessionStatus(Enum):
 
 class State:
     continue_after_stop = False
+    wire_format = 'auto'
+    wire_encoding = wire.FLOAT32
     session_id = None
+    session_version = 0
     session_status = SessionStatus.WAITING
     session_start_time = None
     participant_id = None
+    question_id = None
     question = None
     position = [0.0]
+    central_cue = None
 
 def request_join_session(username, session_id) -> bool:
     print(f"> Trying to join session (user={username}, id={session_id})")
-    res = requests.post(f"{API_URL}/api/session/{session_id}/participants", json={'user': username})
+    # Single round trip: participant, session state and current question
+    res = requests.post(f"{API_URL}/api/session/{session_id}/join", json={'user': username})
     print(f"\t[{res.status_code}] {res.text}")
     if res.status_code != 200:
         return False
 
+    data = res.json()
     State.session_id = session_id
-    State.participant_id = res.json()['id']
-    action_queue.append(Action(get_session_info))
+    State.participant_id = data['participant']['id']
+    action_queue.append(Action(connect_to_broker))
+    action_queue.append(Action(subscribe_to_session_control))
+    on_session_state(data['session'], data['question'])
     return True
 
-def get_session_info() -> bool:
-    print(f"> Retrieving session info (id={State.session_id})")
-    res = requests.get(f"{API_URL}/api/session/{State.session_id}")
-    print(f"\t[{res.status_code}] {res.text}")
-    if res.status_code != 200:
-        return False
+def connect_to_broker() -> bool:
+    print(f"> Connecting to the broker (session={State.session_id}, participant={State.participant_id})")
+    # If the connection drops, the broker tells the server that this participant left
+    mqtt_client.will_set(control_topic(), json.dumps({'type': 'disconnect'}))
+    mqtt_client.connect('localhost', 9001, 60)
+    mqtt_client.loop_start()
+    Thread(target=send_heartbeats, daemon=True).start()
+    return True
 
-    session_info = res.json()
-    action_queue.append(Action(subscribe_to_session_control))
+def control_topic() -> str:
+    return f'swarm/session/{State.session_id}/control/{State.participant_id}'
 
-    if session_info['question_id'] is not None:
-        action_queue.append(Action(get_question_info, (session_info['question_id'],)))
-    return True
+def send_heartbeats():
+    # Participants that stop sending heartbeats are removed from the session
+    while True:
+        mqtt_client.publish(control_topic(), json.dumps({'type': 'heartbeat'}))
+        if heartbeats_stop.wait(HEARTBEAT_INTERVAL):
+            break
 
 def subscribe_to_session_control() -> bool:
-    print(f"> Subscribing to control topic (session={State.session_id})")
+    # The session state is retained by the broker, so its current snapshot
+    # is received right after subscribing (no need to poll the API)
+    print(f"> Subscribing to control and state topics (session={State.session_id})")
     mqtt_client.subscribe([
         (f'swarm/session/{State.session_id}/control', 0),
-        (f'swarm/session/{State.session_id}/updates/+', 0)
+        (f'swarm/session/{State.session_id}/state', 0),
+        (f'swarm/session/{State.session_id}/updates', 0)
     ])
     return True
 
+def on_session_state(state, question=None):
+    if state['version'] <= State.session_version:
+        return
+    State.session_version = state['version']
+
+    if State.wire_format == 'auto':
+        State.wire_format = 'binary' if 'binary' in state.get('wire_formats', []) else 'json'
+        print(f"\tUsing '{State.wire_format}' wire format for position updates")
+
+    if state['question_id'] != State.question_id:
+        if question is not None and question['id'] == state['question_id']:
+            State.question_id = question['id']
+            load_question(question)
+        else:
+            set_question(state['question_id'])
+
+def set_question(question_id):
+    State.question_id = question_id
+    State.question = None
+    if question_id is not None:
+        action_queue.append(Action(get_question_info, (question_id,)))
+
 def on_message(client, obj, msg):
     print(f"[MQTT] {msg.topic}: {msg.payload}")
 
@@ -92,9 +135,8 @@ def on_message(client, obj, msg):
 
         payload = json.loads(msg.payload)
         if payload['type'] == 'setup':
-            State.question = None
-            if payload['question_id'] is not None:
-                action_queue.append(Action(get_question_info, (payload['question_id'],)))
+            # Setting up the same question again also requires a new ready notification
+            set_question(payload['question_id'])
         elif payload['type'] == 'start':
             State.session_status = SessionStatus.ACTIVE
             State.session_start_time = time()
@@ -102,18 +144,21 @@ def on_message(client, obj, msg):
         elif payload['type'] == 'stop':
             State.session_status = SessionStatus.WAITING
             State.question = None
+            State.central_cue = None
+
+    elif topic_data[3] == 'state':
+        if msg.payload:
+            on_session_state(json.loads(msg.payload))
 
     elif topic_data[3] == 'updates':
-        if len(topic_data) != 5:
-            print("* WARNING: An update was received in a non-participant-specific topic")
+        if len(topic_data) != 4:
+            print("* WARNING: Participant-specific updates are aggregated by the server")
             return
 
-        participant_id = int(topic_data[4])
-        if participant_id == State.participant_id:
-            print("\tSelf update discarded")
-            return
-        payload = json.loads(msg.payload)
-        # TODO: Handle other participants updates
+        if wire.is_binary(msg.payload):
+            _, _, State.central_cue = wire.decode_update(msg.payload)
+        else:
+            _, _, State.central_cue = wire.decode_json(msg.payload, 0)
 
 def get_question_info(question_id) -> bool:
     print(f"> Retrieving question details (id={question_id})")
@@ -122,14 +167,17 @@ def get_question_info(question_id) -> bool:
     if res.status_code != 200:
         return False
 
-    State.question = res.json()
+    load_question(res.json())
+    return True
+
+def load_question(question):
+    State.question = question
     State.position = [random() for _ in range(len(State.question['answers']))]
     action_queue.append(Action(notify_client_ready))
-    return True
 
 def notify_client_ready() -> bool:
     print(f"> Notifying participant READY (session={State.session_id}, participant={State.participant_id})")
-    mqtt_client.publish(f'swarm/session/{State.session_id}/control/{State.participant_id}', json.dumps({'type': 'ready'}))
+    mqtt_client.publish(control_topic(), json.dumps({'type': 'ready'}))
     return True
 
 def send_position_update() -> bool:
@@ -139,10 +187,15 @@ def send_position_update() -> bool:
 
     State.position = [min((1, max((0, v + (random() - 0.5) * 0.02)))) for v in State.position]
     print(f"> Sending POSITION UPDATE (session={State.session_id}, participant={State.participant_id}, question={State.question['id'] if State.question else None})")
-    mqtt_client.publish(f'swarm/session/{State.session_id}/updates/{State.participant_id}', json.dumps({
-        'data': {'position': State.position},
-        'timestamp': time() - State.session_start_time
-    }))
+    timestamp = time() - State.session_start_time
+    if State.wire_format == 'binary':
+        payload = wire.encode_update(State.participant_id, timestamp, State.position, State.wire_encoding)
+    else:
+        payload = json.dumps({
+            'data': {'position': State.position},
+            'timestamp': timestamp
+        })
+    mqtt_client.publish(f'swarm/session/{State.session_id}/updates/{State.participant_id}', payload)
     sleep(0.1)
     action_queue.append(Action(send_position_update))
     return True
@@ -152,15 +205,18 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--session', dest='session_id', type=int, help="Session ID (default: 1)", default=1)
     parser.add_argument('-u', '--user', dest='username', help="Username (default: 'test.user1')", default='test.user1')
     parser.add_argument('-c', '--continue', dest='continue_after_stop', action='store_true', help="Continue running after a successful session")
+    parser.add_argument('-w', '--wire-format', dest='wire_format', choices=['auto', 'binary', 'json'], help="Position updates encoding (default: 'auto', negotiated with the server)", default='auto')
+    parser.add_argument('-q', '--quantize', dest='quantize', action='store_true', help="Send binary position updates as quantized 16-bit values")
     args = parser.parse_args()
 
     State.continue_after_stop = args.continue_after_stop
+    State.wire_format = args.wire_format
+    State.wire_encoding = wire.INT16 if args.quantize else wire.FLOAT32
 
     mqtt_client = mqtt.Client(transport='websockets')
     mqtt_client.on_message = on_message
     mqtt_client.ws_set_options(path='/')
-    mqtt_client.connect('localhost', 9001, 60)
-    mqtt_client.loop_start()
+    heartbeats_stop = Event()
 
     action_queue.append(Action(request_join_session, (args.username, args.session_id)))
 
@@ -176,4 +232,8 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         print("[Ctrl+C] Exit")
     finally:
+        heartbeats_stop.set()
+        if mqtt_client.is_connected():
+            mqtt_client.publish(control_topic(), json.dumps({'type': 'leave'})).wait_for_publish(5)
+            mqtt_client.disconnect()
         mqtt_client.loop_stop()
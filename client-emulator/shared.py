@@ -0,0 +1,23 @@
+'''
+    Access to the modules shared with the server.
+
+    The wire codec and the latency histogram are only maintained in the
+    server tree (`server/src/context`). They don't depend on the rest of the
+    server package, so they are loaded straight from their files instead of
+    keeping copies here that could drift from them.
+'''
+import sys
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+from types import ModuleType
+
+SERVER_CONTEXT = Path(__file__).resolve().parent.parent / 'server' / 'src' / 'context'
+
+
+def load(name: str) -> ModuleType:
+    if name not in sys.modules:
+        spec = spec_from_file_location(name, SERVER_CONTEXT / f'{name}.py')
+        module = module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
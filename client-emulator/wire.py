@@ -0,0 +1,11 @@
+'''
+    Binary encoding of position updates, shared with the server (see
+    `server/src/context/wire.py`).
+'''
+import sys
+
+from shared import load
+
+# Replaces this module with the server one
+del sys.modules[__name__]
+sys.modules[__name__] = load(__name__)
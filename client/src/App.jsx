@@ -1,4 +1,4 @@
-import { React } from "react";
+import { React, useState } from "react";
 import { Routes, Route, Navigate, useNavigate } from "react-router-dom";
 
 import Header from './components/Header';
@@ -8,12 +8,15 @@ import DebugBoardView from "./components/DebugBoardView";
 
 function App() {
   const navigate = useNavigate();
+  // Session snapshot and question received when joining (not kept on page reloads)
+  const [joined, setJoined] = useState(null);
 
   const sessionId = sessionStorage.getItem('session_id');
   const participantId = sessionStorage.getItem('participant_id');
   const username = sessionStorage.getItem('username');
 
-  const joinSession = (username, participantId, sessionId) => {
+  const joinSession = (username, participantId, sessionId, joined = null) => {
+    setJoined(joined);
     sessionStorage.setItem('session_id', sessionId);
     sessionStorage.setItem('participant_id', participantId);
     sessionStorage.setItem('username', username);
@@ -21,6 +24,7 @@ function App() {
   }
 
   const leaveSession = () => {
+    setJoined(null);
     sessionStorage.removeItem('session_id');
     sessionStorage.removeItem('participant_id');
     sessionStorage.removeItem('username');
@@ -48,6 +52,7 @@ function App() {
             <SessionView
               sessionId={sessionId}
               participantId={participantId}
+              joined={joined}
               onLeave={leaveSession}
             />
           )
@@ -25,8 +25,9 @@ export default function SessionLogin({ username = null, onJoinSession=()=>{} })
       return;
     }
 
+    // Joins and gets the session state and question in a single round trip
     await fetch(
-      `/api/session/${sessionId}/participants`,
+      `/api/session/${sessionId}/join`,
       {
         method: 'POST',
         headers: {
@@ -38,7 +39,7 @@ export default function SessionLogin({ username = null, onJoinSession=()=>{} })
     ).then(res => {
       if(res.status === 200) {
         res.json().then(data => {
-          onJoinSession(data.username, data.id, sessionId);
+          onJoinSession(data.participant.username, data.participant.id, sessionId, data);
         });
       } else {
         res.text().then(msg =>
@@ -13,6 +13,8 @@ export default function QuestionDetails({ image }) {
     >
       <img
         src={image}
+        srcSet={[480, 960, 1920].map(width => `${image}?size=${width} ${width}w`).join(', ')}
+        sizes="(max-width: 960px) 100vw, 960px"
         alt="question 1"
         width="100%"
       />
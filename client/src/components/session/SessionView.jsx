@@ -14,38 +14,32 @@ import { Session, SessionStatus } from '../../context/Session';
 import { QuestionStatus } from '../../context/Question';
 
 
-export default function SessionView({ sessionId, participantId, onLeave=()=>{} }) {
+const loadedQuestion = (data) => ({
+  status: QuestionStatus.Loaded,
+  id: data.id,
+  prompt: data.prompt,
+  answers: data.answers,
+  image: `/api/question/${data.id}/image`
+});
+
+const stateSessionStatus = (state) => (
+  state.status === 'active' ? SessionStatus.Active : SessionStatus.Waiting
+);
+
+export default function SessionView({ sessionId, participantId, joined=null, onLeave=()=>{} }) {
+  // The join response (if any) already has the session state and question
   const sessionRef = useRef(null);
-  const [sessionStatus, setSessionStatus] = useState(SessionStatus.Joining);
-  const [question, setQuestion] = useState({status: QuestionStatus.Undefined});
+  const stateVersionRef = useRef(joined ? joined.session.version : 0);
+  const [sessionStatus, setSessionStatus] = useState(joined ? stateSessionStatus(joined.session) : SessionStatus.Joining);
+  const [question, setQuestion] = useState(
+    (joined && joined.question) ? loadedQuestion(joined.question) : {status: QuestionStatus.Undefined}
+  );
   const [userMagnetPosition, setUserMagnetPosition] = useState({x: 0, y: 0, norm: []});
-  const [peerMagnetPositions, setPeerMagnetPositions] = useState({});
+  // Mean position of every participant, computed by the server
+  const [serverCuePosition, setServerCuePosition] = useState([]);
   const [centralCuePosition, setCentralCuePosition] = useState([]);
 
   useEffect(() => {
-    fetch(
-      `/api/session/${sessionId}`,
-      {
-        method: 'GET',
-        headers: {
-          'Accept': 'application/json',
-        },
-      }
-    ).then(res => {
-      if(res.status === 200) {
-        res.json().then(data => {
-          setSessionStatus(SessionStatus.Waiting);
-          if(data.question_id) {
-            setQuestion({status: QuestionStatus.Loading, id: data.question_id});
-          }
-        });
-      } else {
-        res.text().then(msg => console.log(msg));
-      }
-    }).catch(error => {
-      console.log(error);
-    });
-
     sessionRef.current = new Session(sessionId, participantId,
       (controlMessage) => {
         switch(controlMessage.type) {
@@ -71,14 +65,30 @@ export default function SessionView({ sessionId, participantId, onLeave=()=>{} }
           default: break;
         }
       },
-      (participantId, updateMessage) => {
-        setPeerMagnetPositions((peerPositions) => {
-          return {
-            ...peerPositions,
-            [participantId]: updateMessage.data.position
+      (cue) => {
+        setServerCuePosition(cue.position);
+      },
+      (state) => {
+        // Snapshots are republished after reconnections: only newer ones matter
+        if(state.version <= stateVersionRef.current) return;
+        stateVersionRef.current = state.version;
+
+        setSessionStatus(stateSessionStatus(state));
+        setQuestion((question) => {
+          if(state.question_id === null) {
+            return (question.status === QuestionStatus.Undefined) ? question : {status: QuestionStatus.Undefined};
           }
+          return (question.id === state.question_id)
+            ? question
+            : {status: QuestionStatus.Loading, id: state.question_id};
         });
       });
+
+    if(joined && joined.question) {
+      sessionRef.current.publishControl({type: 'ready'});
+    }
+    // Only the join response of this session/participant is used
+    // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [sessionId, participantId]);
 
   useEffect(() => {
@@ -96,13 +106,7 @@ export default function SessionView({ sessionId, participantId, onLeave=()=>{} }
         if(res.status === 200) {
           res.json().then(data => {
             if(!ignore) {
-              setQuestion({
-                status: QuestionStatus.Loaded,
-                id: data.id,
-                prompt: data.prompt,
-                answers: data.answers,
-                image: `/api/question/${data.id}/image`
-              });
+              setQuestion(loadedQuestion(data));
               sessionRef.current.publishControl({type: 'ready'});
             }
           });
@@ -117,19 +121,11 @@ export default function SessionView({ sessionId, participantId, onLeave=()=>{} }
   }, [question]);
 
   useEffect(() => {
-    // Update central Cue based on magnet positions
-    const usablePeerPositions = Object.keys(peerMagnetPositions).map(
-      k => peerMagnetPositions[k]
-    ).filter(peerPosition => peerPosition.length === userMagnetPosition.norm.length);
+    // The server cue may still be the one of the previous question: the user position is shown until it matches
     setCentralCuePosition(
-      usablePeerPositions.reduce(
-        (cuePosition, peerPosition) => cuePosition.map(
-          (value, i) => value + peerPosition[i]
-        ),
-        userMagnetPosition.norm
-      ).map(value => value / (1 + usablePeerPositions.length))
+      (serverCuePosition.length === userMagnetPosition.norm.length) ? serverCuePosition : userMagnetPosition.norm
     );
-  }, [userMagnetPosition, peerMagnetPositions])
+  }, [userMagnetPosition, serverCuePosition])
 
   // DEBUG-ONLY
   /*useEffect(() => {
@@ -157,8 +153,7 @@ export default function SessionView({ sessionId, participantId, onLeave=()=>{} }
   const onLeaveSessionClick = () => {
     // TODO: User should double-check the intention to logout (showing a modal when the leave/logout button is pressed)
 
-    // TODO: The server should be notified about the user leaving the session:
-    //sessionRef.current.leave()
+    sessionRef.current.leave();
 
     onLeave();
   }
@@ -233,9 +228,7 @@ export default function SessionView({ sessionId, participantId, onLeave=()=>{} }
           <BoardView
             answers={question.status === QuestionStatus.Loaded ? question.answers : []}
             centralCuePosition={centralCuePosition}
-            peerMagnetPositions={Object.keys(peerMagnetPositions).map(
-              k => peerMagnetPositions[k]
-            )}
+            peerMagnetPositions={[]}
             userMagnetPosition={userMagnetPosition}
             onUserMagnetMove={onUserMagnetMove}
           />
@@ -1,6 +1,45 @@
 
 import mqtt from 'precompiled-mqtt';
 
+// Participants that stop sending heartbeats are removed from the session (server timeout: 15s by default)
+const HEARTBEAT_INTERVAL = 5000;
+
+// Binary update frames (see server/src/context/wire.py): 16-byte little-endian header + packed values
+const WIRE_MAGIC = 0xB5;
+const WIRE_FLOAT32 = 0;
+const WIRE_INT16 = 1;
+const WIRE_HEADER_SIZE = 16;
+const WIRE_QUANTIZATION_SCALE = 16384;
+
+// Decodes a binary or JSON update frame into {timestamp, position}, or null if it is malformed
+function decodeUpdate(message) {
+    if(message.length && message[0] === WIRE_MAGIC) {
+        if(message.length < WIRE_HEADER_SIZE) return null;
+        const view = new DataView(message.buffer, message.byteOffset, message.byteLength);
+        const encoding = view.getUint8(1);
+        const count = view.getUint16(2, true);
+        const valueSize = (encoding === WIRE_FLOAT32) ? 4 : (encoding === WIRE_INT16) ? 2 : 0;
+        if(!valueSize || message.length !== WIRE_HEADER_SIZE + count * valueSize) return null;
+
+        const position = new Array(count);
+        for(let i = 0; i < count; i++) {
+            const offset = WIRE_HEADER_SIZE + i * valueSize;
+            position[i] = (encoding === WIRE_FLOAT32)
+                ? view.getFloat32(offset, true)
+                : view.getInt16(offset, true) / WIRE_QUANTIZATION_SCALE;
+        }
+        return {timestamp: view.getFloat64(8, true), position: position};
+    }
+
+    try {
+        const update = JSON.parse(message);
+        const position = (update.data || {}).position;
+        return Array.isArray(position) ? {timestamp: update.timestamp, position: position} : null;
+    } catch(error) {
+        return null;
+    }
+}
+
 const SessionStatus = Object.freeze({
     Joining: Symbol("joining"), // Getting session info and subscribing to MQTT topics
     Waiting: Symbol("waiting"), // Waiting for the question to be defined and loaded
@@ -8,23 +47,37 @@ const SessionStatus = Object.freeze({
 });
 
 class Session {
-    constructor(sessionId, participantId, controlCallback, updateCallback) {
+    constructor(sessionId, participantId, controlCallback, cueCallback, stateCallback) {
         console.log("SESSION CONSTRUCTOR CALLED");
         this.sessionId = sessionId;
         this.participantId = participantId;
+        this.heartbeatTimer = null;
 
         this.client = mqtt.connect(
         `ws://${window.location.hostname}:9001/`,
         {
             clean: true,
             connectTimeout: 4000,
+            // Published by the broker if the connection drops (e.g. the tab is closed): the server
+            // removes the participant unless it reconnects shortly after
+            will: {
+                topic: `swarm/session/${sessionId}/control/${participantId}`,
+                payload: JSON.stringify({type: 'disconnect'}),
+                qos: 0,
+                retain: false,
+            },
         }
         );
         this.client.on('connect', () => {
         console.log('[MQTT] Client connected to broker');
+        this.publishControl({type: 'heartbeat'});
+        clearInterval(this.heartbeatTimer);
+        this.heartbeatTimer = setInterval(() => this.publishControl({type: 'heartbeat'}), HEARTBEAT_INTERVAL);
         this.client.subscribe([
             `swarm/session/${sessionId}/control`,
-            `swarm/session/${sessionId}/updates/+`,
+            // Central cue aggregated by the server, instead of the updates of every peer
+            `swarm/session/${sessionId}/updates`,
+            `swarm/session/${sessionId}/state`,  // Retained: the latest snapshot is received right away
         ], (err) => {
             if(!err) console.log("[MQTT] Subscribed to /swarm/session/#");
         });
@@ -50,15 +103,22 @@ class Session {
         if(topic_data[3] === 'control') {
             controlCallback(JSON.parse(message));
         }
+        else if(topic_data[3] === 'state') {
+            // An empty message clears the snapshot of a closed session
+            if(message.length) stateCallback(JSON.parse(message));
+        }
         else if(topic_data[3] === 'updates') {
-            if(topic_data.length !== 5) {
-            console.log('[MQTT] An update was received in a non-participant-specific topic');
+            if(topic_data.length !== 4) {
+            console.log('[MQTT] A participant update was received, only the central cue is expected');
             return;
             }
-            const participantId = topic_data[4];
-            if(participantId !== this.participantId) {  // Discard self updates
-            updateCallback(participantId, JSON.parse(message));
+            // Binary frames with the binary cue format (--cue-format)
+            const cue = decodeUpdate(message);
+            if(cue === null) {
+                console.log('[MQTT] Invalid central cue');
+                return;
             }
+            cueCallback(cue);
         }
         });
     }
@@ -74,7 +134,12 @@ class Session {
         JSON.stringify(updateMessage)
         );
     }
+    leave() {
+        this.publishControl({type: 'leave'});
+        this.close();
+    }
     close() {
+        clearInterval(this.heartbeatTimer);
         this.client.end();
     }
 }
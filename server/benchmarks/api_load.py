@@ -0,0 +1,191 @@
+'''
+    Load test of the HTTP API serving modes (see `src.services.http`).
+
+    For every mode, the API is started in a separate process (so the load
+    generator doesn't compete with it for the GIL), with an unconnected MQTT
+    communicator and a single question with a local image. Client threads
+    then hit the join, session GET and question image endpoints, each
+    reusing its connection as long as the server keeps it open. The
+    throughput and latency percentiles of each endpoint are reported, with
+    the number of connections opened (the `threaded` mode closes them after
+    every response, the `pooled` one keeps them alive). Run from the
+    `server` folder:
+
+        python -m benchmarks.api_load -c 64 -d 10 --modes threaded pooled
+'''
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event
+from time import perf_counter, sleep
+
+ENDPOINTS = ('join', 'session', 'image')
+
+
+def write_png(path: Path, width: int, height: int):
+    '''
+        Noisy RGB image, so it doesn't compress to nothing.
+    '''
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    rows = b''.join(b'\x00' + os.urandom(width * 3) for _ in range(height))
+    path.write_bytes(
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(rows, 1))
+        + chunk(b'IEND', b'')
+    )
+
+
+def serve(mode: str, port: int, workers: int):
+    from src.context import AppContext, IMAGE_CACHE_FOLDER
+    from src.context.catalog import QuestionCatalog
+    from src.context.communicator import SharedCommunicator
+    from src.services.api import ServerAPI
+    from src.services.images import QuestionImages
+
+    with tempfile.TemporaryDirectory() as tmp:
+        question_folder = Path(tmp) / 'questions' / '1'
+        question_folder.mkdir(parents=True)
+        (question_folder / 'info.json').write_text(json.dumps({'question': 'Benchmark', 'answers': ['A', 'B', 'C']}))
+        write_png(question_folder / 'img.png', 1600, 1200)
+
+        AppContext.questions = QuestionCatalog(question_folder.parent)
+        AppContext.questions.refresh()
+        AppContext.question_images = QuestionImages(Path(tmp) / IMAGE_CACHE_FOLDER)
+        # Never started: no broker needed
+        AppContext.mqtt_communicator = SharedCommunicator()
+
+        api = ServerAPI(host='127.0.0.1', port=port, server_mode=mode, workers=workers)
+        stop = Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        api.start()
+        print('ready', flush=True)
+        stop.wait()
+        api.shutdown()
+        api.join()
+        AppContext.question_images.shutdown()
+
+
+class Client:
+    def __init__(self, port: int, session_id: int):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        self.session_id = session_id
+        self.connects = 0
+
+    def request(self, method: str, url: str, body: dict = None) -> int:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        if self.connection.sock is None:
+            # Reopened by `request` after the server closed it
+            self.connects += 1
+        try:
+            self.connection.request(method, url, json.dumps(body) if body is not None else None, headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            self.connection.close()
+            return 0
+
+    def call(self, endpoint: str, index: int) -> int:
+        if endpoint == 'join':
+            return self.request('POST', f'/api/session/{self.session_id}/participants', {'user': f'user-{index}'})
+        if endpoint == 'session':
+            return self.request('GET', f'/api/session/{self.session_id}')
+        return self.request('GET', '/api/question/1/image?size=960')
+
+
+def percentile(values, point):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * point / 100))]
+
+
+def run_load(port: int, concurrency: int, duration: float):
+    setup = Client(port, 0)
+    setup.connection.request('POST', '/api/session')
+    session_id = json.loads(setup.connection.getresponse().read())['id']
+    # Warm up (e.g. build the image variant)
+    Client(port, session_id).call('image', 0)
+
+    deadline = perf_counter() + duration
+    counter = iter(range(1 << 62))
+
+    def worker(seed):
+        client = Client(port, session_id)
+        rng = random.Random(seed)
+        latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        errors = 0
+        while perf_counter() < deadline:
+            endpoint = rng.choice(ENDPOINTS)
+            start = perf_counter()
+            status = client.call(endpoint, next(counter))
+            latencies[endpoint].append(perf_counter() - start)
+            errors += status != 200
+        client.connection.close()
+        return latencies, errors, client.connects
+
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    elapsed = perf_counter() - start
+
+    errors = sum(result[1] for result in results)
+    for endpoint in ENDPOINTS:
+        latencies = [latency for result in results for latency in result[0][endpoint]]
+        print(f"  {endpoint:<8} {len(latencies) / elapsed:>8.0f} req/s"
+              f"   p50 {percentile(latencies, 50) * 1000:>7.1f} ms"
+              f"   p99 {percentile(latencies, 99) * 1000:>7.1f} ms")
+    total = sum(len(latencies) for result in results for latencies in result[0].values())
+    connects = sum(result[2] for result in results)
+    print(f"  {'total':<8} {total / elapsed:>8.0f} req/s   errors {errors}"
+          f"   connections {connects} ({total / max(connects, 1):.1f} requests each)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs='+', choices=['threaded', 'pooled'], default=['threaded', 'pooled'])
+    parser.add_argument('-c', '--concurrency', type=int, default=64, help="Client connections. Default: 64")
+    parser.add_argument('-d', '--duration', type=float, default=10, help="Seconds per mode. Default: 10")
+    parser.add_argument('-w', '--workers', type=int, default=32, help="Pooled server workers. Default: 32")
+    parser.add_argument('-p', '--port', type=int, default=5099, help="Default: 5099")
+    parser.add_argument('--serve', metavar='MODE', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.workers)
+        return
+
+    for mode in args.modes:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.api_load', '--serve', mode, '-p', str(args.port), '-w', str(args.workers)],
+            stdout=subprocess.PIPE, text=True
+        )
+        try:
+            if server.stdout.readline().strip() != 'ready':
+                print(f"{mode}: server didn't start")
+                continue
+            print(f"{mode} ({args.concurrency} connections, {args.duration:.0f} s)")
+            run_load(args.port, args.concurrency, args.duration)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+            # Let the port be released
+            sleep(0.5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+    Joins and readies N participants in a session, measuring the cost of
+    the registry (username checks, ready counters) as seen by the HTTP
+    workers and the MQTT thread. Run from the `server` folder:
+
+        python -m benchmarks.participants -n 10000 -t 8
+'''
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from src.context import AppContext, Session
+from src.context.communicator import SharedCommunicator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--participants', type=int, default=10000, help="Default: 10000")
+    parser.add_argument('-t', '--threads', type=int, default=8, help="Concurrent joins. Default: 8")
+    args = parser.parse_args()
+
+    # The communicator is never started: no broker needed, publishes just queue up
+    AppContext.mqtt_communicator = SharedCommunicator()
+    session = Session()
+
+    ready_events = 0
+    def on_ready_changed(ready_count, total_count):
+        nonlocal ready_events
+        ready_events += 1
+    session.on_participants_ready_changed.connect(on_ready_changed)
+
+    usernames = [f'user-{i}' for i in range(args.participants)]
+
+    start = perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        participants = list(executor.map(session.join, usernames))
+    join_time = perf_counter() - start
+
+    duplicates = sum(session.join(username) is None for username in usernames[:1000])
+
+    start = perf_counter()
+    for participant in participants:
+        session.participant_ready_handler(participant.id)
+    ready_time = perf_counter() - start
+
+    assert len(session.participants) == args.participants
+    assert session.ready_participants_count == args.participants
+    assert duplicates == min(1000, args.participants)
+
+    print(f"join:  {args.participants} participants in {join_time * 1000:.1f} ms "
+          f"({join_time / args.participants * 1e6:.2f} us/participant, {args.threads} threads)")
+    print(f"ready: {args.participants} participants in {ready_time * 1000:.1f} ms "
+          f"({ready_time / args.participants * 1e6:.2f} us/participant)")
+    print(f"ready/total events emitted: {ready_events}")
+
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+    Throughput of the client app handler on the SPA fallback path (client
+    side routes such as `/session/3`, served `index.html`) and on a hashed
+    bundle, comparing the per-request filesystem lookup the API used to do
+    (`legacy`) with the precomputed manifest. Runs in-process through the
+    Flask test client, so it measures the handler cost, not the network.
+    Run from the `server` folder:
+
+        python -m benchmarks.static -n 5000 [--build ../client/build]
+'''
+import argparse
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from flask import Flask, request, send_from_directory
+
+from src.services.static import StaticManifest
+
+
+def make_build(folder: Path):
+    '''
+        Synthetic React build, for when the client hasn't been built.
+    '''
+    (folder / 'static' / 'js').mkdir(parents=True)
+    (folder / 'index.html').write_text(
+        '<!doctype html><html lang="en"><head><meta charset="utf-8"/>'
+        + '<meta name="viewport" content="width=device-width,initial-scale=1"/>' * 20
+        + '<script defer="defer" src="/static/js/main.3f2a1b9c.js"></script></head>'
+        + '<body><noscript>You need to enable JavaScript to run this app.</noscript><div id="root"></div></body></html>'
+    )
+    (folder / 'static' / 'js' / 'main.3f2a1b9c.js').write_text(
+        ''.join(f'function f{i}(a,b){{return a*{i}+b}};' for i in range(20000))
+    )
+
+
+def legacy_app(build: Path) -> Flask:
+    app = Flask(__name__, static_folder=str(build))
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def client_handler(path):
+        if path == '' or not (Path(app.static_folder) / path).is_file():
+            return send_from_directory(app.static_folder, 'index.html')
+
+        return send_from_directory(app.static_folder, path)
+
+    return app
+
+
+def manifest_app(build: Path) -> Flask:
+    app = Flask(__name__, static_folder=None)
+    manifest = StaticManifest(build)
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def client_handler(path):
+        return manifest.response(manifest.resolve(path), request)
+
+    return app
+
+
+def bench(app: Flask, path: str, requests: int, headers: dict) -> tuple:
+    client = app.test_client()
+    size = len(client.get(path, headers=headers).data)
+    start = perf_counter()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+        response.close()
+    return requests / (perf_counter() - start), size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests', type=int, default=5000, help="Requests per case. Default: 5000")
+    parser.add_argument('--build', type=Path, default=None, help="React build folder. Default: synthetic build")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build = args.build
+        if build is None:
+            build = Path(tmp)
+            make_build(build)
+        bundle = next(
+            path.relative_to(build).as_posix()
+            for path in sorted(build.glob('static/js/*.js'))
+        )
+
+        cases = [
+            ('SPA fallback', '/session/3', {}),
+            ('SPA fallback, gzip', '/session/3', {'Accept-Encoding': 'gzip, deflate, br'}),
+            ('bundle', f'/{bundle}', {}),
+            ('bundle, gzip', f'/{bundle}', {'Accept-Encoding': 'gzip, deflate, br'}),
+        ]
+        apps = [('legacy', legacy_app(build)), ('manifest', manifest_app(build))]
+
+        print(f"{'case':<20} {'handler':<10} {'req/s':>10} {'bytes':>10}")
+        for name, path, headers in cases:
+            for app_name, app in apps:
+                rate, size = bench(app, path, args.requests, headers)
+                print(f"{name:<20} {app_name:<10} {rate:>10.0f} {size:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,5 +7,8 @@ setup(
     author_email="alberto.velasco@uclm.es",
     packages=find_packages(),
     license="LICENSE.txt",
-    install_requires=[]
+    install_requires=[],
+    extras_require={
+        'gui': ['PyQt5==5.15.7'],
+    }
 )
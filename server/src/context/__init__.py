@@ -2,33 +2,50 @@ from argparse import Namespace
 from pathlib import Path
 from typing import Dict
 
-from .participant import Participant
+from .catalog import QuestionCatalog
+from .participant import Participant, ParticipantRegistry
 from .question import Question
 from .session import Session
 
 QUESTIONS_FOLDER = Path('questions')
 SESSION_LOG_FOLDER = Path('session_log')
+IMAGE_CACHE_FOLDER = Path('image_cache')
+CLIENT_BUILD_FOLDER = (Path(__file__).parent / '../../../client/build').resolve()
 
 class AppContext:
     args = Namespace(
         mqtt_port=9001,
         api_port=5000,
+        api_server='threaded',
+        api_workers=32,
+        cue_interval=100,
+        cue_format='json',
+        state_interval=50,
+        presence_timeout=15.0,
+        presence_grace=3.0,
+        gui_fps=30,
+        log_format='csv',
+        trace_latency=False,
+        log_level='INFO',
+        mosquitto_verbose=False,
+        headless=False,
+        shards=0,
+        questions_poll_interval=2.0,
     )
 
     mqtt_broker = None
+    mqtt_communicator = None
     api_service = None
+    question_images = None
 
     sessions: 'Dict[Session]' = {}
-    questions: 'Dict[Question]' = {}
+    questions = QuestionCatalog(QUESTIONS_FOLDER)
 
     @staticmethod
     def reload_questions():
-        AppContext.questions = {
-        question.id: question for question in filter(
-            lambda question: question is not None,
-            map(
-                lambda question_path: Question.from_folder(question_path),
-                QUESTIONS_FOLDER.iterdir()
-            )
-        )
-    }
+        '''
+            Updates the question catalog with the changes in `QUESTIONS_FOLDER`
+            (only new or modified questions are reloaded, and lazily).
+        '''
+        AppContext.questions.poll_interval = AppContext.args.questions_poll_interval
+        AppContext.questions.refresh()
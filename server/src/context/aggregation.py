@@ -0,0 +1,156 @@
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+class SwarmSnapshot(NamedTuple):
+    version: int
+    positions: np.ndarray
+    '''
+        `(participants, answers)` array, decimated to at most `max_points` rows.
+    '''
+    cue: Optional[np.ndarray]
+    '''
+        Mean of every known position (not only the decimated ones).
+    '''
+    count: int
+
+
+class CueAggregator:
+    '''
+        Keeps the latest position of every participant of a session in a
+        single `(participants, answers)` array and computes the central cue
+        (mean of all known positions) at a fixed rate.
+    '''
+
+    def __init__(self, interval_ms: int = 100, capacity: int = 64):
+        self.interval = interval_ms / 1000
+        self.capacity = capacity
+
+        self.on_cue: Callable[[np.ndarray, int], None] = None
+        '''
+            `on_cue(cue: np.ndarray, participant_count: int)`
+
+            Called from the aggregator thread every `interval_ms` with the
+            current central cue, as long as at least one position is known.
+        '''
+
+        self._lock = Lock()
+        self._rows: Dict[int, int] = {}
+        self._free_rows: List[int] = []     # Rows of removed participants, reused before growing
+        self._positions = np.zeros((capacity, 0), dtype=np.float32)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._dirty = False
+        self._version = 0
+
+        self._stop_event = Event()
+        self._thread: Optional[Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def reset(self, dimensions: int):
+        '''
+            Forget every known position and configure the number of answers
+            (position components) of the next question.
+        '''
+        with self._lock:
+            self._rows.clear()
+            self._free_rows.clear()
+            self._positions = np.zeros((self.capacity, dimensions), dtype=np.float32)
+            self._valid = np.zeros(self.capacity, dtype=bool)
+            self._dirty = False
+            self._version += 1
+
+    @property
+    def version(self) -> int:
+        '''
+            Incremented on every change of the known positions.
+        '''
+        return self._version
+
+    def update(self, participant_id: int, position) -> bool:
+        with self._lock:
+            if len(position) != self._positions.shape[1]:
+                return False
+
+            row = self._rows.get(participant_id, None)
+            if row is None:
+                if self._free_rows:
+                    row = self._free_rows.pop()
+                else:
+                    row = len(self._rows)
+                    if row >= self._positions.shape[0]:
+                        self._grow()
+                self._rows[participant_id] = row
+
+            self._positions[row] = position
+            self._valid[row] = True
+            self._dirty = True
+            self._version += 1
+        return True
+
+    def remove(self, participant_id: int):
+        with self._lock:
+            row = self._rows.pop(participant_id, None)
+            if row is not None:
+                self._valid[row] = False
+                self._free_rows.append(row)
+                self._dirty = True
+                self._version += 1
+
+    def compute(self) -> Tuple[Optional[np.ndarray], int]:
+        with self._lock:
+            count = int(np.count_nonzero(self._valid))
+            if count == 0:
+                return None, 0
+            cue = self._positions[self._valid].mean(axis=0)
+            self._dirty = False
+        return cue, count
+
+    def snapshot(self, max_points: int = None) -> SwarmSnapshot:
+        '''
+            Copy of the known positions, for consumers running at their own
+            rate (e.g. the GUI). Only the copy is done while holding the lock,
+            so it doesn't hold back the updates.
+        '''
+        with self._lock:
+            version = self._version
+            positions = self._positions[self._valid]
+
+        count = positions.shape[0]
+        cue = positions.mean(axis=0) if count else None
+        if max_points and count > max_points:
+            positions = positions[::-(-count // max_points)]
+        return SwarmSnapshot(version, positions, cue, count)
+
+    def _grow(self):
+        capacity = self._positions.shape[0] * 2
+        positions = np.zeros((capacity, self._positions.shape[1]), dtype=np.float32)
+        positions[:self._positions.shape[0]] = self._positions
+        valid = np.zeros(capacity, dtype=bool)
+        valid[:self._valid.shape[0]] = self._valid
+        self._positions, self._valid = positions, valid
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if not self._dirty:
+                continue
+            cue, count = self.compute()
+            if cue is not None and self.on_cue:
+                self.on_cue(cue, count)
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,187 @@
+import os
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .events import Signal
+from .logger import get_logger
+from .question import Question
+
+log = get_logger('questions')
+
+
+class CatalogEntry:
+    def __init__(self, question_id: int, folder: Path, signature: Tuple[int, int, int]):
+        self.id = question_id
+        self.folder = folder
+        self.signature = signature
+        self.question: Optional[Question] = None
+        self.loaded = False
+
+
+class QuestionCatalog:
+    '''
+        In-memory index of the questions folder.
+
+        Scanning only `stat`s every `<folder>/info.json` (and the folder
+        itself, whose mtime changes when images are added or removed):
+        question bodies are parsed on first access and cached until their
+        files change. `refresh` compares those stats against the index, so
+        only added, modified or removed questions are touched.
+
+        Folders named after an integer keep that number as question id, so
+        ids are stable across reloads and restarts. Any other folder gets
+        the next free id the first time it is seen.
+    '''
+
+    on_changed = Signal()
+    '''
+        `on_changed(catalog: QuestionCatalog)`
+
+        Emitted when a refresh found added, modified or removed questions.
+    '''
+
+    def __init__(self, folder: Path, poll_interval: float = 2.0):
+        self.folder = Path(folder)
+        self.poll_interval = poll_interval
+
+        self._entries: Dict[int, CatalogEntry] = {}
+        self._ids: Dict[str, int] = {}
+        self._used_ids = set()
+        self._max_id = 0
+        self._lock = Lock()
+
+        self._stop_event = Event()
+        self._thread: Optional[Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, question_id: int) -> bool:
+        return question_id in self._entries
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids())
+
+    def __getitem__(self, question_id: int) -> Question:
+        question = self.get(question_id, None)
+        if question is None:
+            raise KeyError(question_id)
+        return question
+
+    def ids(self) -> List[int]:
+        return sorted(self._entries)
+
+    def get(self, question_id: int, default=None) -> Optional[Question]:
+        entry = self._entries.get(question_id, None)
+        if entry is None:
+            return default
+        if not entry.loaded:
+            self._load(entry)
+        return entry.question if entry.question is not None else default
+
+    def _load(self, entry: CatalogEntry):
+        try:
+            question = Question.from_folder(entry.folder, entry.id)
+        except (OSError, ValueError) as e:
+            log.warning("Couldn't load question '%s': %s", entry.folder, e)
+            question = None
+        with self._lock:
+            # Don't cache it if the entry was replaced while loading
+            if self._entries.get(entry.id, None) is entry:
+                entry.question = question
+                entry.loaded = True
+
+    @staticmethod
+    def _signature(folder: Path) -> Optional[Tuple[int, int, int]]:
+        try:
+            info_stat = os.stat(folder / 'info.json')
+            folder_stat = os.stat(folder)
+        except OSError:
+            return None
+        return (info_stat.st_mtime_ns, info_stat.st_size, folder_stat.st_mtime_ns)
+
+    def refresh(self) -> Tuple[int, int, int]:
+        '''
+            Updates the index with the changes in the questions folder.
+            Returns the number of `(added, modified, removed)` questions.
+        '''
+        try:
+            folders = sorted(
+                (Path(entry.path) for entry in os.scandir(self.folder) if entry.is_dir()),
+                key=lambda folder: (not folder.name.isdecimal(), int(folder.name) if folder.name.isdecimal() else 0, folder.name)
+            )
+        except OSError as e:
+            log.error("Couldn't scan questions folder '%s': %s", self.folder, e)
+            return 0, 0, 0
+
+        added = modified = 0
+        seen = set()
+        with self._lock:
+            for folder in folders:
+                signature = self._signature(folder)
+                if signature is None:
+                    continue
+
+                question_id = self._ids.get(folder.name, None)
+                if question_id is None:
+                    question_id = self._assign_id(folder.name)
+                    if question_id is None:
+                        continue
+                seen.add(question_id)
+
+                entry = self._entries.get(question_id, None)
+                if entry is None:
+                    added += 1
+                elif entry.signature != signature:
+                    modified += 1
+                else:
+                    continue
+                self._entries[question_id] = CatalogEntry(question_id, folder, signature)
+
+            removed = [question_id for question_id in self._entries if question_id not in seen]
+            for question_id in removed:
+                del self._entries[question_id]
+
+        if added or modified or removed:
+            log.info("Questions reloaded: %d added, %d modified, %d removed", added, modified, len(removed))
+            self.on_changed.emit(self)
+        return added, modified, len(removed)
+
+    def _assign_id(self, name: str) -> Optional[int]:
+        if name.isdecimal():
+            question_id = int(name)
+            if question_id in self._used_ids:
+                log.warning("Question folder '%s' ignored: id %d already in use", name, question_id)
+                return None
+        else:
+            question_id = self._max_id + 1
+        self._ids[name] = question_id
+        self._used_ids.add(question_id)
+        self._max_id = max(self._max_id, question_id)
+        return question_id
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        '''
+            Polls the questions folder for changes every `poll_interval`
+            seconds (if greater than 0).
+        '''
+        if self.is_running or self.poll_interval <= 0:
+            return
+        self._stop_event.clear()
+        self._thread = Thread(target=self._run, name='QuestionCatalog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.refresh()
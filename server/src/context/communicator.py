@@ -0,0 +1,213 @@
+import json
+from enum import Enum
+from threading import Lock
+from time import perf_counter_ns
+from typing import Callable, Dict, Sequence
+
+from . import wire
+from .logger import get_logger
+from .mqtt_utils import MQTTClient
+
+log = get_logger('mqtt')
+
+
+class RoutingStats:
+    def __init__(self):
+        self.messages = 0
+        self.routing_ns = 0
+        self.handler_ns = 0
+
+    @property
+    def as_dict(self):
+        return {
+            'messages': self.messages,
+            'routing_ms': self.routing_ns / 1e6,
+            'handler_ms': self.handler_ns / 1e6,
+            'avg_routing_us': self.routing_ns / self.messages / 1e3 if self.messages else None,
+            'avg_handler_us': self.handler_ns / self.messages / 1e3 if self.messages else None,
+        }
+
+
+class SessionCommunicator:
+    '''
+        MQTT endpoint of a single session. It doesn't hold a connection by
+        itself: messages are received and published through the
+        `SharedCommunicator` it is registered in.
+    '''
+    class Status(Enum):
+        DISCONNECTED = 'disconnected'
+        CONNECTED = 'connected'
+        SUBSCRIBED = 'subscribed'
+
+    def __init__(self, session_id: int, shared: 'SharedCommunicator'):
+        self.session_id: int = session_id
+        self.shared = shared
+        self._status = SessionCommunicator.Status.DISCONNECTED
+        self.routing_stats = RoutingStats()
+
+        self.on_status_changed: Callable[[SessionCommunicator.Status], None] = None
+        self.on_participant_ready: Callable[[int], None] = None
+        self.on_participant_heartbeat: Callable[[int], None] = None
+        self.on_participant_leave: Callable[[int], None] = None
+        self.on_participant_disconnect: Callable[[int], None] = None
+        self.on_participant_update: Callable[[int, float, Sequence[float], float], None] = None
+
+        self.handlers: Dict[str, Callable[[int, bytes, float], None]] = {
+            'control': self.control_message_handler,
+            'updates': self.updates_message_handler,
+        }
+
+    @property
+    def status(self) -> Status:
+        return self._status
+
+    @status.setter
+    def status(self, status: Status):
+        self._status = status
+        if self.on_status_changed:
+            self.on_status_changed(self.status)
+
+    @property
+    def topics(self):
+        # Only participant topics are subscribed (the session-wide topics are only published by the server)
+        return [
+            (f"swarm/session/{self.session_id}/control/+", 0),
+            (f"swarm/session/{self.session_id}/updates/+", 0),
+        ]
+
+    def start(self):
+        self.shared.register(self)
+
+    def shutdown(self):
+        self.shared.unregister(self)
+        self.status = SessionCommunicator.Status.DISCONNECTED
+
+    def publish(self, topic, msg, post_callback=None, coalesce=False, retain=False):
+        self.shared.publish(topic, msg, post_callback, coalesce=coalesce, retain=retain)
+
+    def control_message_handler(self, client_id: int, payload: bytes, received: float):
+        log.debug("[session %d] CONTROL (client=%d): %s", self.session_id, client_id, payload)
+
+        payload = json.loads(payload)
+        msg_type = payload.get('type', '')
+
+        if msg_type == 'ready' and self.on_participant_ready:
+            # TODO: Participants should also notify their configured question_id and duration,
+            #       so the server can check if their ready state matches de current session or
+            #       is older (i.e. the question has changed twice and the participant still has
+            #       the previous question configured)
+            #       Message format: {"type": "ready", "question_id": 1, "duration": 30}
+            self.on_participant_ready(client_id)
+        elif msg_type == 'heartbeat' and self.on_participant_heartbeat:
+            # Message format: {"type": "heartbeat"}, sent periodically (see `PresenceTracker`)
+            self.on_participant_heartbeat(client_id)
+        elif msg_type == 'leave' and self.on_participant_leave:
+            # Message format: {"type": "leave"}, sent when the participant leaves the session
+            self.on_participant_leave(client_id)
+        elif msg_type == 'disconnect' and self.on_participant_disconnect:
+            # Message format: {"type": "disconnect"}, set as the MQTT last will of the participants
+            self.on_participant_disconnect(client_id)
+        else:
+            log.warning("[session %d] Unknown message received in control topic: %s", self.session_id, payload)
+
+    def updates_message_handler(self, topic_client_id: int, payload: bytes, received: float):
+        try:
+            if wire.is_binary(payload):
+                client_id, timestamp, position = wire.decode_update(payload)
+                if client_id != topic_client_id:
+                    raise ValueError(f"Participant id {client_id} doesn't match the topic")
+            else:
+                client_id, timestamp, position = wire.decode_json(payload, topic_client_id)
+        except ValueError as e:
+            log.warning("[session %d] Invalid update received from client %d: %s", self.session_id, topic_client_id, e)
+            return
+        log.debug("[session %d] UPDATE (client=%d): %s %s", self.session_id, client_id, timestamp, position)
+
+        if self.on_participant_update:
+            self.on_participant_update(client_id, timestamp, position, received)
+
+
+class SharedCommunicator(MQTTClient):
+    '''
+        Single MQTT connection shared by all sessions.
+
+        Incoming messages (`swarm/session/<session-id>/<kind>/<participant-id>`)
+        are routed through a dispatch table indexed by session id, and then
+        by message kind, to the registered `SessionCommunicator`.
+    '''
+
+    def __init__(self, host='localhost', port=1883):
+        self.sessions: Dict[int, SessionCommunicator] = {}
+        self._sessions_lock = Lock()
+
+        MQTTClient.__init__(self, host, port)
+        self.client.on_message = self.message_handler
+
+    def connection_handler(self, connected, reason) -> None:
+        with self._sessions_lock:
+            sessions = list(self.sessions.values())
+
+        for session in sessions:
+            session.status = (
+                SessionCommunicator.Status.CONNECTED if connected
+                else SessionCommunicator.Status.DISCONNECTED
+            )
+
+        if connected:
+            for session in sessions:
+                self._subscribe_session(session)
+
+    def _subscribe_session(self, session: SessionCommunicator):
+        def callback(success: bool):
+            if success and session.session_id in self.sessions:
+                session.status = SessionCommunicator.Status.SUBSCRIBED
+        self.subscribe(session.topics, callback)
+
+    def register(self, session: SessionCommunicator):
+        with self._sessions_lock:
+            self.sessions[session.session_id] = session
+
+        if self.connected:
+            session.status = SessionCommunicator.Status.CONNECTED
+            self._subscribe_session(session)
+
+    def unregister(self, session: SessionCommunicator):
+        with self._sessions_lock:
+            if self.sessions.pop(session.session_id, None) is None:
+                return
+
+        if self.connected:
+            self.unsubscribe([topic for topic, _ in session.topics])
+
+    def routing_stats(self, session_id: int) -> dict:
+        session = self.sessions.get(session_id, None)
+        return session.routing_stats.as_dict if session else None
+
+    def message_handler(self, client, obj, msg):
+        start = perf_counter_ns()
+
+        topic = msg.topic.split('/')
+        if len(topic) != 5 or topic[0] != 'swarm' or topic[1] != 'session':
+            return
+        try:
+            session = self.sessions.get(int(topic[2]), None)
+            participant_id = int(topic[4])
+        except ValueError:
+            return
+        if session is None:
+            return
+        handler = session.handlers.get(topic[3], None)
+        if handler is None:
+            return
+
+        routed = perf_counter_ns()
+        try:
+            handler(participant_id, msg.payload, start / 1e9)
+        except Exception:
+            # A malformed message must not break the connection shared by every session
+            log.error("[session %d] Error handling message in '%s'", session.session_id, msg.topic, exc_info=True)
+
+        stats = session.routing_stats
+        stats.messages += 1
+        stats.routing_ns += routed - start
+        stats.handler_ns += perf_counter_ns() - routed
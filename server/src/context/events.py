@@ -0,0 +1,85 @@
+'''
+    Lightweight, Qt-free event bus.
+
+    `Signal` mirrors the subset of the `pyqtSignal` API used by the server
+    (`connect`, `disconnect` and `emit`), so context and service objects can
+    publish events without depending on PyQt5. Slots run synchronously in
+    the emitting thread; subscribers that need to run in a specific thread
+    (e.g. the Qt GUI, see `src.gui.bridge`) must wrap their slots.
+'''
+from threading import Lock
+from time import monotonic
+from typing import Callable, List
+
+from .logger import get_logger
+
+log = get_logger('events')
+
+
+class BoundSignal:
+    def __init__(self, name: str):
+        self.name = name
+        self._slots: List[Callable] = []
+        self._lock = Lock()
+
+    def connect(self, slot: Callable):
+        with self._lock:
+            # Copy-on-write, so `emit` can iterate without holding the lock
+            self._slots = self._slots + [slot]
+
+    def disconnect(self, slot: Callable = None):
+        '''
+            Disconnects `slot`, or every connected slot if not given.
+        '''
+        with self._lock:
+            if slot is None:
+                self._slots = []
+            else:
+                self._slots = [connected for connected in self._slots if connected != slot]
+
+    def emit(self, *args):
+        for slot in self._slots:
+            try:
+                slot(*args)
+            except Exception:
+                log.error("Error in '%s' slot %r", self.name, slot, exc_info=True)
+
+
+class Signal:
+    '''
+        Declared as a class attribute, like `pyqtSignal`. Every instance gets
+        its own `BoundSignal` on first access.
+    '''
+
+    def __init__(self):
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # Stored under the same name: being a non-data descriptor, the instance attribute takes precedence from now on
+        return instance.__dict__.setdefault(self.name, BoundSignal(f'{owner.__name__}.{self.name}'))
+
+
+class ElapsedTimer:
+    '''
+        Monotonic replacement of `QElapsedTimer`.
+    '''
+
+    def __init__(self):
+        self._start = None
+
+    def restart(self):
+        self._start = monotonic()
+
+    def isValid(self) -> bool:
+        return self._start is not None
+
+    def elapsed(self) -> int:
+        '''
+            Milliseconds elapsed since the last `restart()`.
+        '''
+        return int((monotonic() - self._start) * 1000) if self._start is not None else 0
@@ -0,0 +1,173 @@
+from threading import Condition, Thread
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .logger import get_logger
+
+log = get_logger('ingest')
+
+Update = Tuple[Optional[float], Sequence[float], Optional[float]]
+
+
+class UpdateIngest:
+    '''
+        Ingest stage of participant position updates.
+
+        The MQTT thread only stores each update in its participant's slot
+        (`offer`), and a drain thread hands the slots that changed to the
+        consumer (logging, aggregation...) at its own pace. If the consumer
+        falls behind, a participant's pending update is overwritten by the
+        newer one instead of queueing up: only the latest position matters,
+        so the backlog is bounded by the number of participants and latency
+        can't grow without bound.
+
+        Slots are last-writer-wins by the client timestamp: updates older
+        than the latest one received from that participant (reordered or
+        duplicated messages) are dropped, as are the late updates of
+        participants that left (`forget`).
+    '''
+
+    def __init__(self, consumer: Callable[[int, Optional[float], Sequence[float], Optional[float]], None], name: str = 'UpdateIngest'):
+        self.consumer = consumer
+        '''
+            `consumer(participant_id: int, timestamp: float, position: Sequence[float], received: float)`
+
+            Called from the drain thread. Errors are logged, and only drop
+            the update that raised them.
+        '''
+        self.on_forgotten: Callable[[List[int]], None] = None
+        '''
+            `on_forgotten(participant_ids: List[int])`
+
+            Called from the drain thread after `forget`, once the updates
+            being delivered at that time are consumed: no update of these
+            participants reaches the consumer afterwards.
+        '''
+        self.name = name
+
+        self._slots: Dict[int, Update] = {}
+        self._pending: Dict[int, None] = {}     # Participants with an undelivered update (ordered set)
+        self._latest: Dict[int, float] = {}     # Latest timestamp seen per participant
+        self._forgotten: List[int] = []         # Left, not reported to `on_forgotten` yet
+        self._departed: Set[int] = set()        # Left, their late updates are dropped
+        self._condition = Condition()
+        self._running = False
+        self._thread: Optional[Thread] = None
+
+        self.received = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.stale = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        '''
+            Participants whose latest update hasn't been consumed yet.
+        '''
+        return len(self._pending)
+
+    @property
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'received': self.received,
+            'delivered': self.delivered,
+            'coalesced': self.coalesced,
+            'stale': self.stale,
+            'failed': self.failed,
+        }
+
+    def reset(self):
+        '''
+            Forgets the latest timestamps (participants restart them from 0
+            on every session start). Pending updates are kept.
+        '''
+        with self._condition:
+            self._latest.clear()
+
+    def forget(self, participant_ids: Iterable[int]):
+        '''
+            Drops the pending updates and the latest timestamps of
+            participants that left, then reports them to `on_forgotten`.
+        '''
+        with self._condition:
+            for participant_id in participant_ids:
+                self._latest.pop(participant_id, None)
+                if participant_id in self._pending:
+                    del self._pending[participant_id]
+                    del self._slots[participant_id]
+                self._departed.add(participant_id)
+                self._forgotten.append(participant_id)
+            self._condition.notify()
+
+    def offer(self, participant_id: int, timestamp: Optional[float], position: Sequence[float], received: float = None) -> bool:
+        with self._condition:
+            self.received += 1
+            if participant_id in self._departed:
+                self.stale += 1
+                return False
+            if timestamp is not None:
+                latest = self._latest.get(participant_id, None)
+                if latest is not None and timestamp < latest:
+                    self.stale += 1
+                    return False
+                self._latest[participant_id] = timestamp
+
+            if participant_id in self._pending:
+                self.coalesced += 1
+            else:
+                self._pending[participant_id] = None
+                self.max_depth = max(self.max_depth, len(self._pending))
+            self._slots[participant_id] = (timestamp, position, received)
+            self._condition.notify()
+        return True
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+            Stops the drain thread once the pending updates are delivered.
+        '''
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending and not self._forgotten:
+                    self._condition.wait()
+                if not self._pending and not self._forgotten:
+                    return
+                batch = [(participant_id, self._slots.pop(participant_id)) for participant_id in self._pending]
+                self._pending.clear()
+                forgotten, self._forgotten = self._forgotten, []
+
+            failed = 0
+            for participant_id, (timestamp, position, received) in batch:
+                try:
+                    self.consumer(participant_id, timestamp, position, received)
+                except Exception:
+                    # A malformed update must not stop the delivery of the rest
+                    failed += 1
+                    log.error("[%s] Error handling update from participant %d", self.name, participant_id, exc_info=True)
+            with self._condition:
+                self.delivered += len(batch) - failed
+                self.failed += failed
+
+            if forgotten and self.on_forgotten:
+                try:
+                    self.on_forgotten(forgotten)
+                except Exception:
+                    log.error("[%s] Error handling %d departures", self.name, len(forgotten), exc_info=True)
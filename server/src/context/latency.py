@@ -0,0 +1,146 @@
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Iterable, Optional
+
+
+class LatencyHistogram:
+    '''
+        Fixed-bucket latency histogram in the style of HdrHistogram.
+
+        Values are recorded in microseconds: the first `2^sub_bucket_bits`
+        buckets are linear (1 µs wide), then every power of two is split in
+        `2^(sub_bucket_bits - 1)` equal buckets, so the relative error is
+        bounded (~3% with the default 5 bits) whatever the magnitude.
+        Recording is O(1) and memory doesn't depend on the number of samples.
+    '''
+
+    def __init__(self, sub_bucket_bits: int = 5, max_value: float = 60.0):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.max_index = self._index(int(max_value * 1e6))
+        self.counts = [0] * (self.max_index + 1)
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._sum = 0.0
+        self._lock = Lock()
+
+    def _index(self, value_us: int) -> int:
+        if value_us < self.sub_bucket_count:
+            return value_us
+        shift = value_us.bit_length() - self.sub_bucket_bits
+        half = self.sub_bucket_count >> 1
+        return self.sub_bucket_count + (shift - 1) * half + ((value_us >> shift) - half)
+
+    def _value(self, index: int) -> float:
+        '''
+            Middle value (in seconds) of the bucket at `index`.
+        '''
+        if index < self.sub_bucket_count:
+            return index / 1e6
+        half = self.sub_bucket_count >> 1
+        shift, sub_bucket = divmod(index - self.sub_bucket_count, half)
+        shift += 1
+        lower = (sub_bucket + half) << shift
+        return (lower + (1 << shift) / 2) / 1e6
+
+    def record(self, value: float):
+        if value < 0:
+            value = 0.0
+        index = min(self._index(int(value * 1e6)), self.max_index)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            self._sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentiles(self, points: Iterable[float]) -> Dict[float, Optional[float]]:
+        points = sorted(points)
+        result = {point: None for point in points}
+        with self._lock:
+            if self.total == 0:
+                return result
+            counts = list(self.counts)
+            total = self.total
+            maximum = self.max
+
+        seen = 0
+        pending = iter(points)
+        point = next(pending, None)
+        for index, count in enumerate(counts):
+            seen += count
+            while point is not None and seen >= total * point / 100:
+                result[point] = min(self._value(index), maximum)
+                point = next(pending, None)
+            if point is None:
+                break
+        return result
+
+    @property
+    def as_dict(self):
+        p50, p90, p99, p999 = self.percentiles((50, 90, 99, 99.9)).values()
+        return {
+            'count': self.total,
+            'min': self.min,
+            'mean': self._sum / self.total if self.total else None,
+            'p50': p50,
+            'p90': p90,
+            'p99': p99,
+            'p99.9': p999,
+            'max': self.max,
+        }
+
+
+class SessionLatencyTracker:
+    '''
+        Latency histograms of the update path of a session:
+
+        - `network`: participant send time to server reception.
+        - `handler`: server reception to the end of the update handler.
+        - `persist`: server reception to the update being written to the log.
+
+        Participants only send timestamps relative to the moment they saw the
+        session start, so the one-way network latency can't be measured
+        directly: `(received - start) - timestamp` also includes the (unknown)
+        time the start message took to reach that participant. That offset is
+        estimated per participant as the minimum value observed so far (the
+        minimum filter used by NTP), so `network` reports the delay added on
+        top of the fastest path seen for each participant.
+    '''
+    STAGES = ('network', 'handler', 'persist')
+
+    def __init__(self):
+        self.start_time = perf_counter()
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._offsets: Dict[int, float] = {}
+        self.reset()
+
+    def reset(self, start_time: float = None):
+        self.start_time = perf_counter() if start_time is None else start_time
+        self.histograms = {stage: LatencyHistogram() for stage in SessionLatencyTracker.STAGES}
+        self._offsets = {}
+
+    def record_received(self, participant_id: int, timestamp: Optional[float], received: float):
+        if timestamp is None:
+            return
+        delay = (received - self.start_time) - timestamp
+        offset = self._offsets.get(participant_id, None)
+        if offset is None or delay < offset:
+            self._offsets[participant_id] = offset = delay
+        self.histograms['network'].record(delay - offset)
+
+    def record_handled(self, received: float):
+        self.histograms['handler'].record(perf_counter() - received)
+
+    def record_persisted(self, received_stamps: Iterable[float]):
+        now = perf_counter()
+        histogram = self.histograms['persist']
+        for received in received_stamps:
+            histogram.record(now - received)
+
+    @property
+    def as_dict(self):
+        return {stage: histogram.as_dict for stage, histogram in self.histograms.items()}
@@ -0,0 +1,276 @@
+'''
+    Session log storage formats.
+
+    - `csv`: `log.csv`, one `participant_id,timestamp,value_1,...,value_N` line
+      per update.
+    - `binary`: one `log/<participant_id>.bin` file per participant made of a
+      32-byte header followed by fixed-width records:
+
+      | offset | type       | field          |
+      |--------|------------|----------------|
+      | 0      | uint32     | participant id |
+      | 8      | float64    | timestamp      |
+      | 16     | float32[N] | position       |
+
+      Files are preallocated in chunks of `BinaryLogFile.GROW_RECORDS` records
+      and the header `count` field tells how many of them are valid, so they
+      can be memory-mapped while they are still being written.
+'''
+import heapq
+import json
+import math
+from abc import ABC, abstractmethod
+from pathlib import Path
+from struct import Struct
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+Record = Tuple[int, Optional[float], Sequence[float]]
+
+LOG_MAGIC = b'HANSLOG\x00'
+LOG_VERSION = 1
+LOG_HEADER = Struct('<8sHHIQ8x')    # magic, version, values per record, record size, record count
+
+
+def record_dtype(n_values: int) -> np.dtype:
+    return np.dtype({
+        'names': ['participant_id', 'timestamp', 'position'],
+        'formats': ['<u4', '<f8', ('<f4', (n_values,))],
+        'offsets': [0, 8, 16],
+        'itemsize': 16 + 4 * n_values + (-4 * n_values) % 8,
+    })
+
+
+class LogFormat(ABC):
+    name = None
+
+    def __init__(self, folder: Path, n_values: int):
+        self.folder = folder
+        self.n_values = n_values
+
+    @abstractmethod
+    def write_batch(self, batch: List[Record]) -> None: ...
+
+    @abstractmethod
+    def close(self) -> None: ...
+
+
+class CsvLogFormat(LogFormat):
+    name = 'csv'
+
+    def __init__(self, folder: Path, n_values: int):
+        super().__init__(folder, n_values)
+        self.file = open(folder / 'log.csv', 'w')
+
+    def write_batch(self, batch: List[Record]):
+        self.file.write(''.join(
+            f"{participant_id},{timestamp},{','.join(str(e) for e in position)}\n"
+            for participant_id, timestamp, position in batch
+        ))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BinaryLogFile:
+    GROW_RECORDS = 4096
+
+    def __init__(self, path: Path, n_values: int):
+        self.path = path
+        self.dtype = record_dtype(n_values)
+        self.n_values = n_values
+        self.count = 0
+        self.capacity = 0
+
+        self.file = open(path, 'w+b')
+        self._write_header()
+
+    def _write_header(self):
+        self.file.seek(0)
+        self.file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, self.n_values, self.dtype.itemsize, self.count))
+
+    def append(self, records: np.ndarray):
+        required = self.count + len(records)
+        if required > self.capacity:
+            self.capacity = max(required, self.capacity + BinaryLogFile.GROW_RECORDS)
+            self.file.truncate(LOG_HEADER.size + self.capacity * self.dtype.itemsize)
+
+        self.file.seek(LOG_HEADER.size + self.count * self.dtype.itemsize)
+        self.file.write(records.tobytes())
+        self.count = required
+        # The header is updated once the records are in place, so readers never see partial records
+        self._write_header()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.truncate(LOG_HEADER.size + self.count * self.dtype.itemsize)
+        self.file.close()
+
+
+class BinaryLogFormat(LogFormat):
+    name = 'binary'
+
+    def __init__(self, folder: Path, n_values: int):
+        super().__init__(folder, n_values)
+        self.dtype = record_dtype(n_values)
+        self.files: Dict[int, BinaryLogFile] = {}
+        (folder / 'log').mkdir(exist_ok=True)
+
+    def write_batch(self, batch: List[Record]):
+        by_participant: Dict[int, List[Record]] = {}
+        for record in batch:
+            by_participant.setdefault(record[0], []).append(record)
+
+        for participant_id, records in by_participant.items():
+            data = np.zeros(len(records), dtype=self.dtype)
+            data['participant_id'] = participant_id
+            data['timestamp'] = [np.nan if timestamp is None else timestamp for _, timestamp, _ in records]
+            data['position'] = np.nan
+            for i, (_, _, position) in enumerate(records):
+                values = position[:self.n_values]
+                data['position'][i, :len(values)] = values
+
+            log_file = self.files.get(participant_id, None)
+            if log_file is None:
+                log_file = BinaryLogFile(self.folder / 'log' / f'{participant_id}.bin', self.n_values)
+                self.files[participant_id] = log_file
+            log_file.append(data)
+
+        for log_file in self.files.values():
+            log_file.flush()
+
+    def close(self):
+        for log_file in self.files.values():
+            log_file.close()
+
+
+LOG_FORMATS = {
+    CsvLogFormat.name: CsvLogFormat,
+    BinaryLogFormat.name: BinaryLogFormat,
+}
+
+
+class SessionLogReader:
+    '''
+        Reads back a session log folder (`SESSION_LOG_FOLDER/<timestamp>-<session id>/`).
+
+        Binary logs are memory-mapped: `participant()` returns a structured
+        array backed by the log file itself, and its `timestamp`/`position`
+        fields are views of it, so no data is copied until it is used.
+        CSV logs are parsed into in-memory arrays of the same layout.
+
+        `records()` streams every update instead, without loading the log.
+    '''
+    STREAM_CHUNK = 4096
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        with open(self.folder / 'session.json', 'r') as f:
+            self.info: dict = json.load(f)
+
+        if (self.folder / 'log').is_dir():
+            self.format = BinaryLogFormat.name
+        elif (self.folder / 'log.csv').is_file():
+            self.format = CsvLogFormat.name
+        else:
+            raise FileNotFoundError(f"No session log found in '{self.folder}'")
+        self._csv_data: Optional[Dict[int, np.ndarray]] = None
+
+    @property
+    def participant_ids(self) -> List[int]:
+        if self.format == BinaryLogFormat.name:
+            return sorted(int(path.stem) for path in (self.folder / 'log').glob('*.bin'))
+        return sorted(self._load_csv())
+
+    def participant(self, participant_id: int) -> np.ndarray:
+        if self.format == CsvLogFormat.name:
+            return self._load_csv()[participant_id]
+
+        path = self.folder / 'log' / f'{participant_id}.bin'
+        with open(path, 'rb') as f:
+            magic, version, n_values, record_size, count = LOG_HEADER.unpack(f.read(LOG_HEADER.size))
+        dtype = record_dtype(n_values)
+        if magic != LOG_MAGIC or version != LOG_VERSION or record_size != dtype.itemsize:
+            raise ValueError(f"'{path}' is not a valid binary session log")
+
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=LOG_HEADER.size, shape=(count,))
+
+    def timestamps(self, participant_id: int) -> np.ndarray:
+        return self.participant(participant_id)['timestamp']
+
+    def positions(self, participant_id: int) -> np.ndarray:
+        return self.participant(participant_id)['position']
+
+    def __iter__(self) -> Iterable[Tuple[int, np.ndarray]]:
+        for participant_id in self.participant_ids:
+            yield participant_id, self.participant(participant_id)
+
+    def records(self) -> Iterator[Record]:
+        '''
+            Yields every `(participant_id, timestamp, position)` record in
+            timestamp order: CSV logs are read line by line (they are written
+            in arrival order) and the per-participant files of binary logs are
+            merged, reading each of them in chunks of `STREAM_CHUNK` records.
+            Missing timestamps are yielded as `None`.
+        '''
+        if self.format == CsvLogFormat.name:
+            with open(self.folder / 'log.csv', 'r') as f:
+                for line in f:
+                    record = self._parse_csv_line(line)
+                    if record is not None:
+                        yield record
+            return
+
+        def stream(participant_id: int) -> Iterator[Tuple[float, int, Record]]:
+            data = self.participant(participant_id)
+            for start in range(0, len(data), SessionLogReader.STREAM_CHUNK):
+                chunk = data[start:start + SessionLogReader.STREAM_CHUNK]
+                for timestamp, position in zip(chunk['timestamp'].tolist(), chunk['position'].tolist()):
+                    timestamp = None if math.isnan(timestamp) else timestamp
+                    # Records without timestamp keep their place in the participant stream
+                    key = timestamp if timestamp is not None else -math.inf
+                    yield key, participant_id, (participant_id, timestamp, position)
+
+        for _, _, record in heapq.merge(*(stream(participant_id) for participant_id in self.participant_ids)):
+            yield record
+
+    @staticmethod
+    def _parse_csv_line(line: str) -> Optional[Record]:
+        fields = line.rstrip('\n').split(',')
+        if len(fields) < 2:
+            return None
+        timestamp = None if fields[1] == 'None' else float(fields[1])
+        return int(fields[0]), timestamp, [float(e) for e in fields[2:]]
+
+    def _load_csv(self) -> Dict[int, np.ndarray]:
+        if self._csv_data is not None:
+            return self._csv_data
+
+        rows: Dict[int, list] = {}
+        n_values = 0
+        with open(self.folder / 'log.csv', 'r') as f:
+            for line in f:
+                record = self._parse_csv_line(line)
+                if record is None:
+                    continue
+                participant_id, timestamp, values = record
+                n_values = max(n_values, len(values))
+                rows.setdefault(participant_id, []).append((float('nan') if timestamp is None else timestamp, values))
+
+        dtype = record_dtype(n_values)
+        self._csv_data = {}
+        for participant_id, records in rows.items():
+            data = np.zeros(len(records), dtype=dtype)
+            data['participant_id'] = participant_id
+            data['position'] = np.nan
+            for i, (timestamp, values) in enumerate(records):
+                data['timestamp'][i] = timestamp
+                data['position'][i, :len(values)] = values
+            self._csv_data[participant_id] = data
+        return self._csv_data
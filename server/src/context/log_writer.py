@@ -0,0 +1,163 @@
+import json
+from pathlib import Path
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable, List, Sequence
+
+from .log_formats import LOG_FORMATS, LogFormat
+from .logger import get_logger
+
+log = get_logger('log')
+
+
+class SessionLogWriter:
+    '''
+        Persists a session log from a background thread.
+
+        Records are pushed to a bounded in-memory queue (dropped if it is
+        full, so that the MQTT thread never blocks on disk) and written in
+        batches, flushing every `batch_size` records or `flush_interval`
+        seconds, whatever happens first, using the storage format selected
+        by `log_format` (see `log_formats.LOG_FORMATS`).
+
+        `queued` and `dropped` are only updated by the producer thread and
+        `written` and `failed` by the writer thread, so no locking is needed
+        to read them. A batch that can't be written is logged and counted in
+        `failed`, the next ones are still written. If the writer thread stops
+        anyway, the writer is closed: `write()` returns False from then on.
+
+        None of the methods wait on the writer thread (except `join`), so a
+        stalled disk never blocks the caller. The thread is a daemon: records
+        still pending when the process exits are lost.
+    '''
+
+    def __init__(self,
+        folder: Path,
+        session_info: dict,
+        log_format: str = 'csv',
+        n_values: int = 0,
+        max_queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+    ):
+        self.folder = folder
+        self.session_info = session_info
+        self.log_format = LOG_FORMATS[log_format]
+        self.n_values = n_values
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self.on_persisted: Callable[[List[float]], None] = None
+        '''
+            `on_persisted(received_stamps: List[float])`
+
+            Called from the writer thread after every written batch with the
+            reception stamps given to `write()` (records without one are skipped).
+        '''
+
+        self._queue = Queue(max_queue_size)
+        self._closed = False
+        self._closing = Event()
+        self._thread = Thread(target=self._run, name=f"log-writer-{folder.name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'pending': self._queue.qsize(),
+        }
+
+    def write(self, participant_id: int, timestamp: float, position: Sequence[float], received: float = None) -> bool:
+        if self._closed:
+            return False
+
+        try:
+            self._queue.put_nowait((participant_id, timestamp, position, received))
+        except Full:
+            self.dropped += 1
+            return False
+
+        self.queued += 1
+        return True
+
+    def close(self):
+        '''
+            Stops accepting records. Pending records are still written by the
+            background thread before the log file is closed, call `join()` to
+            wait for it.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._closing.set()
+
+    def join(self, timeout: float = None) -> bool:
+        '''
+            Waits for the pending records to be written. Returns whether the
+            log file is closed.
+        '''
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _open(self) -> LogFormat:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with open(self.folder / 'session.json', 'w') as f:
+            json.dump(self.session_info, f, indent=4)
+        return self.log_format(self.folder, self.n_values)
+
+    def _write_batch(self, log_file: LogFormat, batch):
+        try:
+            log_file.write_batch([record[:3] for record in batch])
+        except Exception:
+            # e.g. a malformed record: only its batch is lost
+            self.failed += len(batch)
+            log.error("[%s] Can't write %d records", self.folder.name, len(batch), exc_info=True)
+            return
+        self.written += len(batch)
+        if self.on_persisted:
+            self.on_persisted([record[3] for record in batch if record[3] is not None])
+
+    def _run(self):
+        try:
+            log_file = self._open()
+        except Exception:
+            self._closed = True
+            log.error("[%s] Can't open the session log", self.folder.name, exc_info=True)
+            return
+
+        try:
+            batch = []
+            deadline = monotonic() + self.flush_interval
+            drained = False
+            while not drained:
+                # Once closing, the queue is emptied without waiting for new records
+                closing = self._closing.is_set()
+                try:
+                    if closing:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(self._queue.get(timeout=max(0, deadline - monotonic())))
+                except Empty:
+                    drained = closing
+
+                if batch and (drained or len(batch) >= self.batch_size or monotonic() >= deadline):
+                    self._write_batch(log_file, batch)
+                    batch = []
+                if monotonic() >= deadline:
+                    deadline = monotonic() + self.flush_interval
+        finally:
+            self._closed = True
+            log_file.close()
+
+        log.info("[%s] Closed: %d records written, %d dropped, %d failed",
+                 self.folder.name, self.written, self.dropped, self.failed)
@@ -0,0 +1,128 @@
+'''
+    Console logging.
+
+    Every module logs through a `hans.<category>` logger (see `get_logger`).
+    `setup_logging` installs a single non-blocking queue handler on the
+    `hans` root, so callers never wait on stdout: records are formatted and
+    written by a background listener thread, and dropped (and counted) if
+    the queue is full.
+
+    Before being queued, records go through a per-category rate limiter:
+    each logger/level/message template combination gets a token bucket,
+    and records exceeding it are suppressed. The next record of that kind that gets
+    through notes how many were suppressed.
+'''
+import logging
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from threading import Lock
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+ROOT_LOGGER = 'hans'
+LOG_FORMAT = '%(asctime)s %(levelname)-7s [%(name)s] %(message)s'
+
+# The broker output is relayed line by line through a single template (see `BrokerWrapper`)
+DEFAULT_CATEGORY_RATES = {
+    'broker': 50.0,
+}
+
+
+def get_logger(category: str) -> logging.Logger:
+    return logging.getLogger(f'{ROOT_LOGGER}.{category}')
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+        Token bucket per `(logger, level, message template)`: allows `burst`
+        records at once and `rate` records per second on average, so errors
+        are never suppressed because of routine messages of the same kind.
+        Rates can be overridden per category (logger name, without the
+        `hans.` prefix), `None` disables the limit.
+    '''
+
+    def __init__(self, rate: float = 5.0, burst: int = 20, category_rates: Dict[str, float] = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.category_rates = {
+            f'{ROOT_LOGGER}.{category}': category_rate
+            for category, category_rate in (category_rates or {}).items()
+        }
+        self._buckets: Dict[Tuple[str, int, str], list] = {}
+        self._lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.category_rates.get(record.name, self.rate)
+        if rate is None:
+            return True
+
+        key = (record.name, record.levelno, str(record.msg))
+        now = monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key, None)
+            if bucket is None:
+                # [tokens, last update, suppressed records]
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Records are formatted by the listener thread, not by the caller
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level='INFO', max_queue_size=10000, rate: float = 5.0, burst: int = 20,
+                  category_rates: Dict[str, float] = None):
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    queue = Queue(max_queue_size)
+    queue_handler = NonBlockingQueueHandler(queue)
+    queue_handler.addFilter(RateLimitFilter(rate, burst, {**DEFAULT_CATEGORY_RATES, **(category_rates or {})}))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    root.propagate = False
+
+    _listener = QueueListener(queue, stream_handler)
+    _listener.start()
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,16 +1,46 @@
+import heapq
 from abc import ABC, abstractmethod
-from threading import Thread
-from typing import Callable, Dict
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from itertools import count
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import CONNACK_ACCEPTED, MQTT_ERR_SUCCESS
 
 
+class PublishRequest(NamedTuple):
+    topic: str
+    msg: bytes
+    callback: Optional[Callable[[bool], None]]
+    qos: int
+    coalesce: bool
+    retain: bool
+
+
 class MQTTClient(ABC):
+    '''
+        Base paho client wrapper.
+
+        Outgoing messages are handed to a single long-lived publisher thread
+        through a queue. Each wake-up drains up to `publish_batch_size`
+        queued messages; messages published with `coalesce=True` only keep
+        the latest one per topic within a batch. Delivery callbacks are
+        completed from paho's `on_publish` event, or with `False` if the
+        message can't be queued in the client or isn't delivered within
+        `publish_timeout` seconds.
+
+        Message ids wrap around, so pending deliveries are tracked by
+        `(message id, generation)`: a deadline or an acknowledgement of an
+        older message can't complete a newer one with the same id.
+    '''
+    _STOP = object()
+
     @abstractmethod
     def connection_handler(self, connected: bool, reason: int) -> None: ...
 
-    def __init__(self, host='localhost', port=1883):
+    def __init__(self, host='localhost', port=1883, publish_timeout=5.0, publish_batch_size=64):
         self.host = host
         self.port = port
         self.connected = False
@@ -19,13 +49,28 @@ class MQTTClient(ABC):
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_subscribe = self.on_subscribe
+        self.client.on_publish = self.on_publish
         self.client.ws_set_options(path="/")
 
+        self.publish_timeout = publish_timeout
+        self.publish_batch_size = publish_batch_size
+        self._publish_queue: Queue = Queue()
+        self._publish_lock = Lock()
+        self._pending_publishes: Dict[int, Tuple[int, Callable[[bool], None]]] = {}
+        self._publish_deadlines: List[Tuple[float, int, int]] = []
+        self._early_publishes: Dict[int, float] = {}    # Acknowledged before being registered, with their time
+        self._publish_generation = count()
+        self._publish_worker = Thread(target=self._publish_loop, name="mqtt-publisher", daemon=True)
+
     def start(self):
+        self._publish_worker.start()
         self.client.connect_async(self.host, self.port, 60)
         self.client.loop_start()
 
     def shutdown(self):
+        if self._publish_worker.is_alive():
+            self._publish_queue.put(MQTTClient._STOP)
+            self._publish_worker.join()
         self.client.loop_stop()
 
     def on_connect(self, client, obj, flags, rc):
@@ -39,7 +84,19 @@ class MQTTClient(ABC):
     def on_subscribe(self, client, obj, message_id, granted_qos):
         if message_id not in self.pending_subscriptions:
             return
-        self.pending_subscriptions[message_id](True)
+        self.pending_subscriptions.pop(message_id)(True)
+
+    def on_publish(self, client, obj, message_id):
+        with self._publish_lock:
+            pending = self._pending_publishes.pop(message_id, None)
+            if pending is None:
+                # paho may notify the delivery before `publish()` returns the message id
+                # (or the message already expired: these entries expire too)
+                self._early_publishes[message_id] = monotonic()
+                return
+        _, callback = pending
+        if callback:
+            callback(True)
 
     def subscribe(self, topic, callback: Callable[[bool], None] = None):
         result, message_id = self.client.subscribe(topic)
@@ -49,14 +106,116 @@ class MQTTClient(ABC):
             else:
                 callback(False)
 
-    def publish_sync(self, topic, msg, callback: Callable[[bool], None] = None):
-        msg_handle = self.client.publish(topic, msg)
-        msg_handle.wait_for_publish()
-        if callback: callback(True) # TODO: Send false if message could not be queued
-
-    def publish(self, topic, msg, post_callback=None):
-        Thread(
-            target=self.publish_sync,
-            args=(topic, msg, post_callback),
-            daemon=True
-        ).start()
+    def unsubscribe(self, topic):
+        self.client.unsubscribe(topic)
+
+    def publish_sync(self, topic, msg, callback: Callable[[bool], None] = None, qos=0, timeout: float = None) -> bool:
+        '''
+            Publishes a message and waits until it is delivered (or fails).
+            Returns whether it was delivered.
+        '''
+        done = Event()
+        result = [False]
+
+        def sync_callback(success: bool):
+            result[0] = success
+            done.set()
+            if callback: callback(success)
+
+        self.publish(topic, msg, sync_callback, qos)
+        done.wait(self.publish_timeout if timeout is None else timeout)
+        return result[0]
+
+    def publish(self, topic, msg, post_callback: Callable[[bool], None] = None, qos=0, coalesce=False, retain=False):
+        self._publish_queue.put(PublishRequest(topic, msg, post_callback, qos, coalesce, retain))
+
+    def _next_batch(self) -> Optional[List[PublishRequest]]:
+        with self._publish_lock:
+            timeout = self._publish_deadlines[0][0] - monotonic() if self._publish_deadlines else None
+
+        try:
+            request = self._publish_queue.get(timeout=max(0, timeout) if timeout is not None else None)
+        except Empty:
+            return []
+        if request is MQTTClient._STOP:
+            return None
+
+        batch = [request]
+        while len(batch) < self.publish_batch_size:
+            try:
+                request = self._publish_queue.get_nowait()
+            except Empty:
+                break
+            if request is MQTTClient._STOP:
+                self._publish_queue.put(request)
+                break
+            batch.append(request)
+
+        coalesced = {request.topic: request for request in batch if request.coalesce}
+        if not coalesced:
+            return batch
+
+        kept = []
+        for request in batch:
+            if request.coalesce and coalesced[request.topic] is not request:
+                if request.callback: request.callback(False)
+                continue
+            kept.append(request)
+        return kept
+
+    def _expire_publishes(self):
+        expired = []
+        now = monotonic()
+        with self._publish_lock:
+            while self._publish_deadlines and self._publish_deadlines[0][0] <= now:
+                _, message_id, generation = heapq.heappop(self._publish_deadlines)
+                pending = self._pending_publishes.get(message_id, None)
+                # Otherwise delivered, or the id was reused by a newer message
+                if pending is not None and pending[0] == generation:
+                    del self._pending_publishes[message_id]
+                    if pending[1]:
+                        expired.append(pending[1])
+
+            if self._early_publishes:
+                # Late acknowledgements of expired messages
+                limit = now - self.publish_timeout
+                for message_id in [mid for mid, acked in self._early_publishes.items() if acked < limit]:
+                    del self._early_publishes[message_id]
+        for callback in expired:
+            callback(False)
+
+    def _publish_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+
+            for request in batch:
+                sent = monotonic()
+                msg_info = self.client.publish(request.topic, request.msg, request.qos, request.retain)
+                if msg_info.rc != MQTT_ERR_SUCCESS:
+                    if request.callback: request.callback(False)
+                    continue
+
+                with self._publish_lock:
+                    # Only an acknowledgement received since this publish is for this message
+                    acked = self._early_publishes.pop(msg_info.mid, None)
+                    delivered = acked is not None and acked >= sent
+                    if not delivered:
+                        generation = next(self._publish_generation)
+                        self._pending_publishes[msg_info.mid] = (generation, request.callback)
+                        heapq.heappush(self._publish_deadlines,
+                                       (monotonic() + self.publish_timeout, msg_info.mid, generation))
+                if delivered and request.callback:
+                    request.callback(True)
+
+            self._expire_publishes()
+
+        # Fail whatever is still waiting for delivery
+        with self._publish_lock:
+            callbacks = [callback for _, callback in self._pending_publishes.values() if callback]
+            self._pending_publishes.clear()
+            self._publish_deadlines.clear()
+            self._early_publishes.clear()
+        for callback in callbacks:
+            callback(False)
@@ -1,9 +1,11 @@
 from enum import Enum
+from threading import RLock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 
-from PyQt5.QtCore import QObject, pyqtSignal
+from .events import Signal
 
 
-class Participant(QObject):
+class Participant:
     last_id = 0
 
     class Status(Enum):
@@ -11,10 +13,12 @@ class Participant(QObject):
         READY = 'ready'
         ACTIVE = 'active'
 
-    on_status_changed = pyqtSignal(QObject, Status)
+    on_status_changed = Signal()
+    '''
+        `on_status_changed(participant: Participant, status: Participant.Status)`
+    '''
 
     def __init__(self, username):
-        QObject.__init__(self)
         Participant.last_id += 1
         self.id = Participant.last_id
         self.username = username
@@ -36,4 +40,140 @@ class Participant(QObject):
             'id': self.id,
             'username': self.username,
             'status': self._status.value,
-        }
\ No newline at end of file
+        }
+
+
+class ParticipantRegistry:
+    '''
+        Participants of a session, indexed by id and by username.
+
+        Keeps a counter per `Participant.Status` that is updated on every
+        status transition, so ready/total counts are O(1) instead of a scan
+        over every participant. All mutations go through a lock, as joins
+        come from the HTTP workers and status changes from the MQTT thread.
+    '''
+
+    def __init__(self):
+        self._participants: Dict[int, Participant] = {}
+        self._usernames: Dict[str, Participant] = {}
+        # Last status seen for each participant, to know which counter to decrement
+        self._statuses: Dict[int, Participant.Status] = {}
+        self._status_counts: Dict[Participant.Status, int] = {status: 0 for status in Participant.Status}
+        self._lock = RLock()
+
+        self.on_counts_changed: Callable[[int, int], None] = None
+        '''
+            `on_counts_changed(ready_count: int, total_count: int)`
+        '''
+
+    def __len__(self) -> int:
+        return len(self._participants)
+
+    def __contains__(self, participant_id: int) -> bool:
+        return participant_id in self._participants
+
+    def __getitem__(self, participant_id: int) -> Participant:
+        return self._participants[participant_id]
+
+    def __iter__(self) -> Iterator[Participant]:
+        return iter(self.values())
+
+    def get(self, participant_id: int, default=None) -> Optional[Participant]:
+        return self._participants.get(participant_id, default)
+
+    def get_by_username(self, username: str) -> Optional[Participant]:
+        return self._usernames.get(username, None)
+
+    def values(self) -> List[Participant]:
+        '''
+            Snapshot of the participants, safe to iterate while others join.
+        '''
+        with self._lock:
+            return list(self._participants.values())
+
+    def count(self, status: Participant.Status) -> int:
+        return self._status_counts[status]
+
+    @property
+    def ready_count(self) -> int:
+        return self._status_counts[Participant.Status.READY]
+
+    def join(self, username: str) -> Optional[Participant]:
+        '''
+            Creates and registers a participant for `username`, or returns
+            `None` if that username already joined.
+        '''
+        with self._lock:
+            if username in self._usernames:
+                return None
+            participant = Participant(username)
+            self._add(participant)
+        self._notify_counts()
+        return participant
+
+    def add(self, participant: Participant) -> bool:
+        with self._lock:
+            if participant.username in self._usernames or participant.id in self._participants:
+                return False
+            self._add(participant)
+        self._notify_counts()
+        return True
+
+    def _add(self, participant: Participant):
+        self._participants[participant.id] = participant
+        self._usernames[participant.username] = participant
+        self._statuses[participant.id] = participant.status
+        self._status_counts[participant.status] += 1
+        participant.on_status_changed.connect(self._participant_status_changed)
+
+    def remove(self, participant_id: int) -> Optional[Participant]:
+        removed = self.remove_all([participant_id])
+        return removed[0] if removed else None
+
+    def remove_all(self, participant_ids: Iterable[int]) -> List[Participant]:
+        '''
+            Removes the given participants (unknown ids are ignored),
+            notifying the counts once.
+        '''
+        removed = []
+        with self._lock:
+            for participant_id in participant_ids:
+                participant = self._participants.pop(participant_id, None)
+                if participant is None:
+                    continue
+                del self._usernames[participant.username]
+                self._status_counts[self._statuses.pop(participant_id)] -= 1
+                participant.on_status_changed.disconnect(self._participant_status_changed)
+                removed.append(participant)
+        if removed:
+            self._notify_counts()
+        return removed
+
+    def set_status(self, participant_id: int, status: Participant.Status) -> Optional[Participant]:
+        participant = self._participants.get(participant_id, None)
+        if participant is not None:
+            participant.status = status
+        return participant
+
+    def reset_status(self, status: Participant.Status = Participant.Status.JOINED):
+        '''
+            Moves every participant to `status`, notifying the counts once.
+        '''
+        with self._lock:
+            participants = list(self._participants.values())
+        for participant in participants:
+            participant.status = status
+        self._notify_counts()
+
+    def _participant_status_changed(self, participant: Participant, status: Participant.Status):
+        with self._lock:
+            previous = self._statuses.get(participant.id, None)
+            if previous is None or previous == status:
+                return
+            self._statuses[participant.id] = status
+            self._status_counts[previous] -= 1
+            self._status_counts[status] += 1
+
+    def _notify_counts(self):
+        if self.on_counts_changed:
+            self.on_counts_changed(self.ready_count, len(self._participants))
@@ -0,0 +1,217 @@
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+
+class TimingWheel:
+    '''
+        Hashed timing wheel: a circular array of `slots` buckets, each
+        covering `tick` seconds. A key scheduled at `deadline` goes to the
+        bucket of its tick (modulo the number of slots), so scheduling is
+        O(1), and `advance` only visits the buckets of the ticks elapsed
+        since the last call instead of every scheduled key. Deadlines
+        further than one revolution stay in their bucket until their round
+        comes.
+
+        Rescheduling a key only moves it to the new bucket. Not thread-safe.
+    '''
+
+    def __init__(self, tick: float = 0.5, slots: int = 64, now: float = None):
+        self.tick = tick
+        self.slots: List[Dict[Hashable, float]] = [{} for _ in range(slots)]
+        self._slot_of: Dict[Hashable, int] = {}
+        self._current = self._tick_of(monotonic() if now is None else now)
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slot_of
+
+    def _tick_of(self, time: float) -> int:
+        return int(time // self.tick)
+
+    def schedule(self, key: Hashable, deadline: float):
+        self.cancel(key)
+        # Never behind the current tick, which may already have been processed
+        slot = max(self._tick_of(deadline), self._current) % len(self.slots)
+        self.slots[slot][key] = deadline
+        self._slot_of[key] = slot
+
+    def cancel(self, key: Hashable):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now: float) -> List[Hashable]:
+        '''
+            Removes and returns the keys whose deadline is not after `now`.
+        '''
+        expired = []
+        target = self._tick_of(now)
+        # After a long pause, one revolution already covers every bucket
+        first = max(self._current, target - len(self.slots) + 1)
+        for tick in range(first, target + 1):
+            bucket = self.slots[tick % len(self.slots)]
+            if not bucket:
+                continue
+            due = [key for key, deadline in bucket.items() if deadline <= now]
+            for key in due:
+                del bucket[key]
+                del self._slot_of[key]
+            expired.extend(due)
+        self._current = target
+        return expired
+
+
+class PresenceTracker:
+    '''
+        Tracks which participants are still connected to a session.
+
+        Participants opt in by sending heartbeats (`heartbeat`): from then
+        on, they are considered gone once no message is received from them
+        for `timeout` seconds, or right away if they send a `leave` message.
+        A `disconnect` message (their MQTT last will, published by the broker
+        when the connection drops) only shortens the deadline to `grace`
+        seconds: a participant that reconnects meanwhile (any message counts)
+        stays in the session. Participants that never sent a heartbeat are
+        not tracked.
+
+        Any message (`seen`) just stores its time, and each participant has
+        a single entry in a `TimingWheel` that is only looked at when it
+        expires: if the participant was seen meanwhile, the entry is
+        rescheduled to the new deadline. The cost of a tick thus only
+        depends on the deadlines expiring in it, not on the number of
+        participants. Departures are collected and reported once per tick.
+
+        A `timeout` of `0` disables the tracking (heartbeats and leave
+        messages are ignored).
+    '''
+
+    def __init__(self, timeout: float = 15.0, grace: float = 3.0, tick: float = 0.5, name: str = 'PresenceTracker'):
+        self.timeout = timeout
+        self.grace = min(grace, timeout)
+        self.tick = tick
+        self.name = name
+
+        self.on_left: Callable[[List[int]], None] = None
+        '''
+            `on_left(participant_ids: List[int])`
+
+            Called from the tracker thread, at most once per tick.
+        '''
+
+        self._last_seen: Dict[int, float] = {}
+        self._left: Set[int] = set()
+        # More than a revolution per timeout: a bucket is never visited before its deadlines are due
+        self._wheel = TimingWheel(tick, slots=max(8, int(timeout / tick) + 2))
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._thread: Optional[Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def __contains__(self, participant_id: int) -> bool:
+        return participant_id in self._last_seen
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'tracked': len(self._last_seen),
+            'pending_left': len(self._left),
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.timeout > 0
+
+    def heartbeat(self, participant_id: int):
+        if not self.enabled:
+            return
+        now = monotonic()
+        with self._lock:
+            if participant_id in self._left:
+                return
+            if participant_id not in self._last_seen:
+                self._wheel.schedule(participant_id, now + self.timeout)
+            self._last_seen[participant_id] = now
+
+    def seen(self, participant_id: int):
+        '''
+            Refreshes a tracked participant. Cheap enough to be called for
+            every position update: no wheel operation is involved.
+        '''
+        now = monotonic()
+        # Under the lock: `check` may expire the participant meanwhile, it must not be tracked again
+        with self._lock:
+            if participant_id in self._last_seen:
+                self._last_seen[participant_id] = now
+
+    def leave(self, participant_id: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._left.add(participant_id)
+            self._last_seen.pop(participant_id, None)
+            self._wheel.cancel(participant_id)
+
+    def disconnected(self, participant_id: int):
+        '''
+            The connection of a participant dropped: it is considered gone
+            unless it's seen again within `grace` seconds.
+        '''
+        if not self.enabled:
+            return
+        now = monotonic()
+        with self._lock:
+            if participant_id in self._left:
+                return
+            # Backdated, so that `check` expires it after the grace period unless seen meanwhile
+            self._last_seen[participant_id] = now + self.grace - self.timeout
+            self._wheel.schedule(participant_id, now + self.grace)
+
+    def forget(self, participant_id: int):
+        with self._lock:
+            self._left.discard(participant_id)
+            self._last_seen.pop(participant_id, None)
+            self._wheel.cancel(participant_id)
+
+    def check(self, now: float = None) -> List[int]:
+        '''
+            Advances the wheel to `now` and returns the participants that
+            left since the last check.
+        '''
+        now = monotonic() if now is None else now
+        with self._lock:
+            for participant_id in self._wheel.advance(now):
+                last_seen = self._last_seen.get(participant_id, None)
+                if last_seen is None:
+                    continue
+                if last_seen + self.timeout <= now:
+                    del self._last_seen[participant_id]
+                    self._left.add(participant_id)
+                else:
+                    self._wheel.schedule(participant_id, last_seen + self.timeout)
+
+            left, self._left = list(self._left), set()
+        return left
+
+    def _run(self):
+        while not self._stop_event.wait(self.tick):
+            left = self.check()
+            if left and self.on_left:
+                self.on_left(left)
+
+    def start(self):
+        if self._thread is not None or not self.enabled:
+            return
+        self._stop_event.clear()
+        self._thread = Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
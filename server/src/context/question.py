@@ -5,9 +5,11 @@ from pathlib import Path
 class Question:
     last_id = 0
 
-    def __init__(self, prompt, answers, img_path, img_is_local=True):
-        Question.last_id += 1
-        self.id = Question.last_id
+    def __init__(self, prompt, answers, img_path, img_is_local=True, id: int = None):
+        if id is None:
+            Question.last_id += 1
+            id = Question.last_id
+        self.id = id
         self.prompt = prompt
         self.answers = answers
         self.img_path = img_path
@@ -22,7 +24,7 @@ class Question:
         }
 
     @staticmethod
-    def from_folder(question_folder: Path):
+    def from_folder(question_folder: Path, question_id: int = None):
         info_path = question_folder / 'info.json'
         if not info_path.is_file():
             return None
@@ -45,5 +47,6 @@ class Question:
             prompt=data.get('question', None),
             answers=data.get('answers', None),
             img_path=img_path,
-            img_is_local='image' not in data
+            img_is_local='image' not in data,
+            id=question_id
         )
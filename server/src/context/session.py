@@ -1,90 +1,35 @@
 import json
 from datetime import datetime
 from enum import Enum
-from io import TextIOBase
-from typing import Callable, Dict, Union
-
-from PyQt5.QtCore import QElapsedTimer, QObject, pyqtSignal
+from threading import Lock, Timer
+from time import monotonic
+from typing import List, Optional, Sequence, Union
 
 import src.context as ctx
-from .mqtt_utils import MQTTClient
-from .participant import Participant
+from . import wire
+from .aggregation import CueAggregator
+from .communicator import SessionCommunicator
+from .events import ElapsedTimer, Signal
+from .ingest import UpdateIngest
+from .latency import SessionLatencyTracker
+from .log_writer import SessionLogWriter
+from .logger import get_logger
+from .participant import Participant, ParticipantRegistry
+from .presence import PresenceTracker
 from .question import Question
 
+log = get_logger('session')
 
-class SessionCommunicator(MQTTClient):
-    class Status(Enum):
-        DISCONNECTED = 'disconnected'
-        CONNECTED = 'connected'
-        SUBSCRIBED = 'subscribed'
-
-    def __init__(self, session_id: int, host='localhost', port=1883):
-        self.session_id: int = session_id
-        self._status = SessionCommunicator.Status.DISCONNECTED
-
-        self.on_status_changed: Callable[[SessionCommunicator.Status], None] = None
-        self.on_participant_ready: Callable[[int], None] = None
-        self.on_participant_update: Callable[[int, float, dict]] = None
-
-        MQTTClient.__init__(self, host, port)
-        self.client.message_callback_add('swarm/session/+/control/+', self.control_message_handler)
-        self.client.message_callback_add('swarm/session/+/updates/+', self.updates_message_handler)
-
-    @property
-    def status(self) -> Status:
-        return self._status
-
-    @status.setter
-    def status(self, status: Status):
-        self._status = status
-        if self.on_status_changed:
-            self.on_status_changed(self.status)
-
-    def connection_handler(self, connected, reason) -> None:
-        if not connected:
-            self.status = SessionCommunicator.Status.DISCONNECTED
-            return
-
-        self.status = SessionCommunicator.Status.CONNECTED
-
-        # Subscribe to session topic
-        def callback(success: bool):
-            if success:
-                self.status = SessionCommunicator.Status.SUBSCRIBED
-        self.subscribe(f"swarm/session/{self.session_id}/#", callback)
-
-    def control_message_handler(self, client, obj, msg):
-        client_id = int(msg.topic.split('/')[-1])
-        print(f"[session {self.session_id}] CONTROL (client={client_id}): {msg.payload}")
-
-        payload = json.loads(msg.payload)
-        msg_type = payload.get('type', '')
-
-        if msg_type == 'ready' and self.on_participant_ready:
-            # TODO: Participants should also notify their configured question_id and duration,
-            #       so the server can check if their ready state matches de current session or
-            #       is older (i.e. the question has changed twice and the participant still has
-            #       the previous question configured)
-            #       Message format: {"type": "ready", "question_id": 1, "duration": 30}
-            self.on_participant_ready(client_id)
-        else:
-            print("Unknown message received in control topic")
-            # TODO: Implement a 'keep-alive' mechanism: participants must send keep-alive messages
-            #       periodically so the server can determine if they have left without notifying
-
-    def updates_message_handler(self, client, obj, msg):
-        client_id = int(msg.topic.split('/')[-1])
-        print(f"[session {self.session_id}] UPDATE (client={client_id}): {msg.payload}")
-        payload = json.loads(msg.payload)
-
-        if self.on_participant_update:
-            self.on_participant_update(client_id, payload.get('timestamp', None), payload.get('data', {}))
-
-class Session(QObject):
+class Session:
     '''
         Contains all attributes, methods and events to handle a SWARM Session.
     '''
     last_id = 0
+    id_step = 1
+    '''
+        Sharded servers interleave session ids, so the id tells which shard
+        owns a session (see `src.services.sharding`).
+    '''
 
     class Status(Enum):
         WAITING = 'waiting' # Waiting for clients to join
@@ -93,20 +38,20 @@ class Session(QObject):
         #       waiting for clients to get ready. This would be useful for the GUI
         #       to check if the session can start or not
 
-    on_status_changed = pyqtSignal(QObject, Status)
+    on_status_changed = Signal()
     '''
         `on_status_changed(session: Session, status: Session.Status)`
 
         Emitted when the session status changes.
     '''
-    on_connection_status_changed = pyqtSignal(QObject, SessionCommunicator.Status)
+    on_connection_status_changed = Signal()
     '''
         `on_connection_status_changed(session: Session, status: SessionCommunicator.Status)`
 
         Emitted when the session MQTT communication changed its state.
     '''
 
-    on_question_notified = pyqtSignal(QObject, bool)
+    on_question_notified = Signal()
     '''
         `on_question_notified(session: Session, success: bool)`
 
@@ -114,21 +59,29 @@ class Session(QObject):
         param indicates whether the event was successfully published or not.
     '''
 
-    on_participant_joined = pyqtSignal(QObject, Participant)
+    on_participant_joined = Signal()
     '''
         `on_participant_joined(session: Session, participant: Participant)`
 
         Emitted when the a new participant joins the session.
     '''
 
-    on_participants_ready_changed = pyqtSignal(int, int)
+    on_participants_left = Signal()
+    '''
+        `on_participants_left(session: Session, participants: List[Participant])`
+
+        Emitted when participants leave the session or stop sending
+        heartbeats, batched (see `PresenceTracker`).
+    '''
+
+    on_participants_ready_changed = Signal()
     '''
         `on_participants_ready_changed(ready_count: int, total_count: int)`
 
         Emitted when the number of ready participants changed.
     '''
 
-    on_start = pyqtSignal(QObject, bool)
+    on_start = Signal()
     '''
         `on_start(session: Session, started: bool)`
 
@@ -136,7 +89,7 @@ class Session(QObject):
         whether the event was successfully published or not.
     '''
 
-    on_stop = pyqtSignal(QObject, bool)
+    on_stop = Signal()
     '''
         `on_stop(session: Session, stopped: bool)`
 
@@ -145,25 +98,52 @@ class Session(QObject):
     '''
 
     def __init__(self):
-        if ctx.AppContext.mqtt_broker is None:
-            raise RuntimeError("MQTT broker not started")
-
-        QObject.__init__(self)
+        if ctx.AppContext.mqtt_communicator is None:
+            raise RuntimeError("MQTT communicator not started")
 
-        Session.last_id += 1
+        Session.last_id += Session.id_step
         self.id = Session.last_id
         self._status = Session.Status.WAITING
         self._question = None
-        self.duration = 30
-        self.participants: Dict[Participant] = {}
-        self.log_file: TextIOBase = None
-        self.timer = QElapsedTimer()
-
-        self.communicator = SessionCommunicator(self.id, port=ctx.AppContext.mqtt_broker.port)
-        self.communicator.on_status_changed = lambda status: self.on_connection_status_changed.emit(self, status)
+        self._duration = 30
+        self.participants = ParticipantRegistry()
+        self.participants.on_counts_changed = self.participants_counts_handler
+        self.log_writer: SessionLogWriter = None
+        self._flushing_logs: List[SessionLogWriter] = []
+        self.timer = ElapsedTimer()
+        self.stop_timer: Timer = None
+
+        self.aggregator = CueAggregator(ctx.AppContext.args.cue_interval)
+        self.aggregator.on_cue = self.cue_handler
+
+        self.latency: SessionLatencyTracker = SessionLatencyTracker() if ctx.AppContext.args.trace_latency else None
+
+        self.presence = PresenceTracker(ctx.AppContext.args.presence_timeout, ctx.AppContext.args.presence_grace,
+                                        name=f'PresenceTracker-{self.id}')
+        self.presence.on_left = self.participants_left_handler
+        self.presence.start()
+
+        # Updates are coalesced per participant before logging and aggregation
+        self.ingest = UpdateIngest(self.process_update, name=f'UpdateIngest-{self.id}')
+        self.ingest.on_forgotten = self.participants_forgotten_handler
+        self.ingest.start()
+
+        # Session state stream (see `state_changed`)
+        self.version = 0
+        self._state_lock = Lock()
+        self._state_timer: Timer = None
+        self._state_published = 0.0
+        self._state_interval = ctx.AppContext.args.state_interval / 1000
+
+        self.communicator = SessionCommunicator(self.id, ctx.AppContext.mqtt_communicator)
+        self.communicator.on_status_changed = self.connection_status_handler
         self.communicator.on_participant_ready = self.participant_ready_handler
+        self.communicator.on_participant_heartbeat = self.participant_heartbeat_handler
+        self.communicator.on_participant_leave = self.participant_leave_handler
+        self.communicator.on_participant_disconnect = self.participant_disconnect_handler
         self.communicator.on_participant_update = self.participant_update_handler
         self.communicator.start()
+        self.state_changed()
 
     def __eq__(self, other):
         return isinstance(other, Session) and self.id == other.id
@@ -175,22 +155,35 @@ class Session(QObject):
     @status.setter
     def status(self, status: Status):
         self._status = status
+        self.state_changed()
         self.on_status_changed.emit(self, status)
 
+    @property
+    def duration(self) -> int:
+        return self._duration
+
+    @duration.setter
+    def duration(self, duration: int):
+        self._duration = duration
+        self.state_changed()
+
     @property
     def active_question(self):
         return self._question
 
     @active_question.setter
     def active_question(self, question: Union[int, Question]):
-        for participant in self.participants.values():
-            participant.status = Participant.Status.JOINED
-        self.on_participants_ready_changed.emit(0, len(self.participants))
+        self.participants.reset_status(Participant.Status.JOINED)
 
         if question is None or isinstance(question, Question):
             self._question = question
         else:
             self._question = ctx.AppContext.questions[question]
+        self.aggregator.reset(len(self._question.answers or []) if self._question else 0)
+        # Participants request the image right after the setup message
+        if ctx.AppContext.question_images:
+            ctx.AppContext.question_images.prepare(self._question)
+        self.state_changed()
 
         self.communicator.publish(
             f'swarm/session/{self.id}/control',
@@ -203,10 +196,7 @@ class Session(QObject):
 
     @property
     def ready_participants_count(self):
-        return sum(
-                participant.status == Participant.Status.READY
-                for participant in self.participants.values()
-            )
+        return self.participants.ready_count
 
     @property
     def as_dict(self):
@@ -214,47 +204,183 @@ class Session(QObject):
             'id': self.id,
             'status': self._status.value,
             'question_id': self._question.id if self._question else None,
-            'duration': self.duration,
+            'duration': self._duration,
+            'wire_formats': wire.FORMATS,
+        }
+
+    @property
+    def state(self):
+        '''
+            Snapshot published in the `swarm/session/<id>/state` topic.
+        '''
+        return {
+            **self.as_dict,
+            'version': self.version,
+            'participants': {
+                'total': len(self.participants),
+                'ready': self.participants.ready_count,
+            },
         }
 
-    def add_participant(self, participant: Participant):
-        self.participants[participant.id] = participant
+    def state_changed(self):
+        '''
+            Bumps the session version and schedules the publication of its
+            state as a retained message, so clients get the latest snapshot
+            as soon as they subscribe and on every change.
+
+            Publications are throttled to one every `state_interval`: the
+            first change is published right away, and changes happening
+            within the interval (e.g. a burst of joins) are coalesced into a
+            single trailing snapshot.
+        '''
+        with self._state_lock:
+            self.version += 1
+            if self._state_timer is not None:
+                return
+            delay = self._state_published + self._state_interval - monotonic()
+            if delay > 0:
+                self._state_timer = Timer(delay, self.publish_state)
+                self._state_timer.daemon = True
+                self._state_timer.start()
+                return
+            self._state_published = monotonic()
+        self.publish_state(timer=False)
+
+    def publish_state(self, timer=True):
+        with self._state_lock:
+            if timer:
+                self._state_timer = None
+                self._state_published = monotonic()
+            state = self.state
+
+        self.communicator.publish(
+            f'swarm/session/{self.id}/state',
+            json.dumps(state),
+            coalesce=True,
+            retain=True
+        )
+
+    def connection_status_handler(self, status: SessionCommunicator.Status):
+        if status == SessionCommunicator.Status.CONNECTED:
+            # Snapshots published while disconnected were dropped, and the broker may have lost the retained one
+            self.publish_state(timer=False)
+        self.on_connection_status_changed.emit(self, status)
+
+    def add_participant(self, participant: Participant) -> bool:
+        if not self.participants.add(participant):
+            return False
         self.on_participant_joined.emit(self, participant)
+        return True
+
+    def join(self, username: str) -> Optional[Participant]:
+        '''
+            Registers a new participant, unless `username` already joined the
+            session (in which case `None` is returned).
+        '''
+        participant = self.participants.join(username)
+        if participant is not None:
+            self.on_participant_joined.emit(self, participant)
+        return participant
+
+    def participants_counts_handler(self, ready_count: int, total_count: int):
+        self.state_changed()
+        self.on_participants_ready_changed.emit(ready_count, total_count)
 
     def participant_ready_handler(self, participant_id: int):
         participant = self.participants.get(participant_id, None)
         if participant is None:
-            print(f"ERROR: Participant [id={participant_id}] not found in Session [id={self.id}]")
+            log.error("Participant [id=%d] not found in Session [id=%d]", participant_id, self.id)
             return
 
-        participant.status = Participant.Status.READY
-        self.on_participants_ready_changed.emit(
-            self.ready_participants_count,
-            len(self.participants)
-        )
+        self.presence.seen(participant_id)
+        if participant.status != Participant.Status.READY:
+            participant.status = Participant.Status.READY
+            self.participants_counts_handler(self.participants.ready_count, len(self.participants))
+
+    def participant_heartbeat_handler(self, participant_id: int):
+        if participant_id in self.participants:
+            self.presence.heartbeat(participant_id)
+
+    def participant_leave_handler(self, participant_id: int):
+        if participant_id in self.participants:
+            self.presence.leave(participant_id)
+
+    def participant_disconnect_handler(self, participant_id: int):
+        if participant_id in self.participants:
+            self.presence.disconnected(participant_id)
+
+    def participants_left_handler(self, participant_ids: List[int]):
+        participants = self.participants.remove_all(participant_ids)
+        if not participants:
+            return
+
+        # The positions are removed by the ingest thread, so an update being handled can't bring them back
+        self.ingest.forget([participant.id for participant in participants])
+        log.info("[session %d] %d participants left", self.id, len(participants))
+        self.on_participants_left.emit(self, participants)
+
+    def participants_forgotten_handler(self, participant_ids: List[int]):
+        for participant_id in participant_ids:
+            self.aggregator.remove(participant_id)
+
+    def close_log(self):
+        '''
+            Stops logging to the current session log. The writer keeps
+            flushing it in the background, see `join_logs`.
+        '''
+        log_writer, self.log_writer = self.log_writer, None
+        if log_writer is None:
+            return
+        log_writer.close()
+        self._flushing_logs = [writer for writer in self._flushing_logs if not writer.join(0)]
+        self._flushing_logs.append(log_writer)
+
+    def join_logs(self, timeout: float = None) -> bool:
+        '''
+            Waits for the closed session logs to be flushed. Returns whether
+            they all are.
+        '''
+        deadline = monotonic() + timeout if timeout is not None else None
+        for log_writer in self._flushing_logs:
+            if not log_writer.join(max(0.0, deadline - monotonic()) if deadline is not None else None):
+                return False
+        return True
 
     def start(self) -> bool:
         if self._question is None:
             self.on_start.emit(self, False)
             return
 
-        # TODO: This should be done asynchronously
         session_time = datetime.now()
         self.timer.restart()
-        log_folder = ctx.SESSION_LOG_FOLDER / session_time.strftime('%Y-%m-%d-%H-%M-%S')
-        log_folder.mkdir(parents=True, exist_ok=True)
-        with open(log_folder / 'session.json', 'w') as f:
-            json.dump({
+        self.close_log()
+        self.log_writer = SessionLogWriter(
+            ctx.SESSION_LOG_FOLDER / f"{session_time.strftime('%Y-%m-%d-%H-%M-%S')}-{self.id}",
+            {
                 'time': session_time.isoformat(),
                 'id': self.id,
                 'question': self._question.id,
                 'duration': self.duration,
+                'answers': len(self._question.answers or []),
+                'log_format': ctx.AppContext.args.log_format,
                 'participants': [participant.as_dict for participant in self.participants.values()]
-            }, f, indent=4)
+            },
+            log_format=ctx.AppContext.args.log_format,
+            n_values=len(self._question.answers or []),
+        )
+        if self.latency:
+            self.log_writer.on_persisted = self.latency.record_persisted
 
         def callback(success):
-            self.log_file = open(log_folder / 'log.csv', 'w')
+            if self.latency:
+                self.latency.reset()
+            self.ingest.reset()
+            self.aggregator.reset(len(self._question.answers or []))
+            self.aggregator.start()
             self.status = Session.Status.ACTIVE
+            self.stop_timer = Timer(max(0, self.duration - self.timer.elapsed() / 1000), self.duration_expired_handler)
+            self.stop_timer.daemon = True
+            self.stop_timer.start()
             self.on_start.emit(self, success)
 
         self.communicator.publish(
@@ -265,7 +391,15 @@ class Session(QObject):
             callback
         )
 
+    def duration_expired_handler(self):
+        if self._status == Session.Status.ACTIVE:
+            self.stop()
+
     def stop(self):
+        if self.stop_timer:
+            self.stop_timer.cancel()
+            self.stop_timer = None
+
         def callback(success):
             self.status = Session.Status.WAITING
             self.on_stop.emit(self, success)
@@ -278,19 +412,67 @@ class Session(QObject):
             callback
         )
 
-        if self.log_file:
-            self.log_file.close()
-            self.log_file = None
-
-    def participant_update_handler(self, participant_id: int, timestamp: float, data: dict):
-        position_data = data.get('position', None)
+        self.aggregator.stop()
+        self.close_log()
+
+    def close(self):
+        '''
+            Releases the session resources: stops any running activity and
+            removes its subscriptions from the shared MQTT connection.
+        '''
+        if self.stop_timer:
+            self.stop_timer.cancel()
+            self.stop_timer = None
+        self.presence.stop()
+        self.ingest.stop()
+        self.aggregator.stop()
+        self.close_log()
+
+        with self._state_lock:
+            if self._state_timer:
+                self._state_timer.cancel()
+                self._state_timer = None
+        # An empty retained message clears the session state from the broker
+        self.communicator.publish(f'swarm/session/{self.id}/state', b'', retain=True)
+        self.communicator.shutdown()
+
+    def participant_update_handler(self, participant_id: int, timestamp: float, position_data: Sequence[float], received: float = None):
         if not position_data:
             return
 
-        if self.log_file:
-            self.log_file.write(f"{participant_id},{timestamp},{','.join(str(e) for e in position_data)}\n")
+        self.presence.seen(participant_id)
+        if self.latency is not None and received is not None:
+            self.latency.record_received(participant_id, timestamp, received)
+
+        self.ingest.offer(participant_id, timestamp, position_data, received)
+
+    def process_update(self, participant_id: int, timestamp: float, position_data: Sequence[float], received: float = None):
+        '''
+            Consumer of `ingest`: handles the latest update of a participant.
+        '''
+        tracing = self.latency is not None and received is not None
+        # Read once: the session may be stopped meanwhile
+        log_writer = self.log_writer
+        if log_writer:
+            log_writer.write(participant_id, timestamp, position_data, received if tracing else None)
 
-        # TODO: Maybe the server should not rely the calculation of the central cue
-        #       position to the clients, but instead calculate it every X milliseconds
-        #       and send it over the topic 'swarm/session/<session-id>/updates' (which
-        #       is currently not used since clients send updates over their own subtopics)
+        self.aggregator.update(participant_id, position_data)
+
+        if tracing:
+            self.latency.record_handled(received)
+
+    def cue_handler(self, cue, participant_count: int):
+        timestamp = self.timer.elapsed() / 1000
+        if ctx.AppContext.args.cue_format == 'binary':
+            payload = wire.encode_update(0, timestamp, cue)
+        else:
+            payload = json.dumps({
+                'data': {
+                    'position': cue.tolist(),
+                    'participants': participant_count,
+                },
+                'timestamp': timestamp
+            })
+
+        # Cue broadcasts are superseded by the next one, so stale ones are coalesced if publishing lags
+        self.communicator.publish(f'swarm/session/{self.id}/updates', payload, coalesce=True)
@@ -0,0 +1,113 @@
+'''
+    Binary encoding of position updates.
+
+    Every binary frame starts with a fixed 16-byte little-endian header
+    followed by the packed position values:
+
+    | offset | type    | field                                      |
+    |--------|---------|--------------------------------------------|
+    | 0      | uint8   | magic (`0xB5`)                             |
+    | 1      | uint8   | encoding (`FLOAT32` or `INT16`)            |
+    | 2      | uint16  | number of position values                  |
+    | 4      | uint32  | participant id (`0` for server broadcasts) |
+    | 8      | float64 | timestamp (seconds since session start)    |
+    | 16     | ...     | position values                            |
+
+    `INT16` values are quantized with a fixed `1/16384` step, covering
+    the `[-2, 2)` range used by normalized board positions.
+
+    JSON frames (`{"data": {"position": [...]}, "timestamp": ...}`) remain
+    valid; both kinds can be told apart by their first byte.
+'''
+import json
+from functools import lru_cache
+from struct import Struct, error as StructError
+from typing import Optional, Sequence, Tuple
+
+MAGIC = 0xB5
+FLOAT32 = 0
+INT16 = 1
+FORMATS = ('binary', 'json')
+
+QUANTIZATION_SCALE = 16384
+
+HEADER = Struct('<BBHId')
+_VALUE_FORMATS = {
+    FLOAT32: 'f',
+    INT16: 'h',
+}
+
+
+@lru_cache(maxsize=256)
+def _values_struct(count: int, encoding: int) -> Struct:
+    return Struct(f'<{count}{_VALUE_FORMATS[encoding]}')
+
+
+def is_binary(payload: bytes) -> bool:
+    return len(payload) > 0 and payload[0] == MAGIC
+
+
+def encode_update(participant_id: int, timestamp: float, position: Sequence[float], encoding=FLOAT32) -> bytes:
+    count = len(position)
+    if encoding == INT16:
+        position = [
+            max(-32768, min(32767, round(value * QUANTIZATION_SCALE)))
+            for value in position
+        ]
+    return (
+        HEADER.pack(MAGIC, encoding, count, participant_id, timestamp)
+        + _values_struct(count, encoding).pack(*position)
+    )
+
+
+def decode_update(payload: bytes) -> Tuple[int, float, Tuple[float, ...]]:
+    '''
+        Decodes a binary frame into `(participant_id, timestamp, position)`.
+
+        Raises `ValueError` if the payload is not a valid binary frame.
+    '''
+    try:
+        magic, encoding, count, participant_id, timestamp = HEADER.unpack_from(payload)
+        if magic != MAGIC or encoding not in _VALUE_FORMATS:
+            raise ValueError("Invalid binary update header")
+
+        values = _values_struct(count, encoding)
+        if len(payload) != HEADER.size + values.size:
+            raise ValueError("Binary update length doesn't match its header")
+
+        position = values.unpack_from(payload, HEADER.size)
+    except StructError as e:
+        raise ValueError(str(e)) from e
+
+    if encoding == INT16:
+        position = tuple(value / QUANTIZATION_SCALE for value in position)
+    return participant_id, timestamp, position
+
+
+def decode_json(payload: bytes, participant_id: int) -> Tuple[int, Optional[float], Optional[Sequence[float]]]:
+    '''
+        Decodes a JSON frame into `(participant_id, timestamp, position)`.
+
+        JSON frames don't carry the participant id, so the one given (usually
+        taken from the topic) is returned as-is.
+
+        Raises `ValueError` if the payload is not a JSON object, or if its
+        timestamp is not a number or its position not a list of numbers
+        (both may be missing).
+    '''
+    data = json.loads(payload)
+    if not isinstance(data, dict) or not isinstance(data.get('data', {}), dict):
+        raise ValueError("JSON update is not an object")
+
+    timestamp = data.get('timestamp', None)
+    if timestamp is not None and not _is_number(timestamp):
+        raise ValueError("JSON update timestamp is not a number")
+    position = data.get('data', {}).get('position', None)
+    if position is not None and (not isinstance(position, list) or not all(_is_number(value) for value in position)):
+        raise ValueError("JSON update position is not a list of numbers")
+    return participant_id, timestamp, position
+
+
+def _is_number(value) -> bool:
+    # bool is an int subclass, but `true` is not a valid coordinate
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
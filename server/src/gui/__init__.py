@@ -1,10 +1,13 @@
+import sys
+
 from PyQt5.QtCore import QTimer, pyqtSlot
-from PyQt5.QtWidgets import (QHBoxLayout, QLabel, QListWidget, QMainWindow,
+from PyQt5.QtWidgets import (QApplication, QHBoxLayout, QLabel, QListWidget, QMainWindow,
                              QPushButton, QStatusBar, QVBoxLayout, QWidget)
 
 from src.context import AppContext, Session
 from src.services import start_services, stop_services
 
+from .bridge import gui_slot
 from .session import SessionListItem, SessionPanelWidget
 
 
@@ -16,10 +19,11 @@ class ServerGUI(QMainWindow):
     def on_services_started(self, service):
         if 'broker' in service.__class__.__name__.lower():
             self.mqtt_status_lbl.setText('🟢 MQTT Broker')
-            AppContext.mqtt_broker.on_stop = lambda: self.mqtt_status_lbl.setText('🔴 MQTT Broker')
+            AppContext.mqtt_broker.on_stop = gui_slot(lambda: self.mqtt_status_lbl.setText('🔴 MQTT Broker'))
         elif 'api' in service.__class__.__name__.lower():
             self.api_status_lbl.setText('🟢 HTTP API')
-            AppContext.api_service.on_session_created = self.on_session_created
+            AppContext.api_service.on_session_created.connect(gui_slot(self.on_session_created))
+            AppContext.api_service.on_session_closed.connect(gui_slot(self.on_session_closed))
             self.session_list_add_btn.setEnabled(True)
 
 
@@ -36,9 +40,25 @@ class ServerGUI(QMainWindow):
         self.session_list.addItem(SessionListItem(session))
 
 
+    ### SESSION :: CLOSED
+
+    @pyqtSlot(Session)
+    def on_session_closed(self, session):
+        for row in range(self.session_list.count()):
+            if self.session_list.item(row).session == session:
+                self.session_list.takeItem(row)
+                break
+
+        if self.session_panel.session == session:
+            self.session_panel.set_session(None)
+            self.session_panel.setHidden(True)
+
+
     ### SESSION :: SELECTED
 
     def on_session_list_item_changed(self, new_item: SessionListItem, old_item: SessionListItem):
+        if new_item is None:
+            return
         self.session_panel.set_session(new_item.session)
         self.session_panel.setHidden(False)
 
@@ -47,7 +67,7 @@ class ServerGUI(QMainWindow):
 
     def showEvent(self, event):
         super().showEvent(event)
-        QTimer.singleShot(100, lambda: start_services(self.on_services_started))
+        QTimer.singleShot(100, lambda: start_services(gui_slot(self.on_services_started)))
 
     def setupUI(self):
         self.setWindowTitle("HANS Platform - Coordinator")
@@ -96,3 +116,21 @@ class ServerGUI(QMainWindow):
 
     def shutdown(self):
         stop_services()
+
+
+def run():
+    '''
+        Runs the server with its GUI until the window is closed.
+    '''
+    app = QApplication(sys.argv)
+
+    gui = ServerGUI()
+    gui.setupUI()
+    gui.show()
+
+    try:
+        app.exec()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gui.shutdown()
@@ -0,0 +1,67 @@
+'''
+    Attaches the Qt GUI to the server event bus (`src.context.events`).
+
+    Server signals are emitted from whatever thread produced the event
+    (MQTT network thread, HTTP workers, timers...), but Qt widgets may only
+    be touched from the GUI thread. `gui_slot` wraps a callable so calling
+    it from any thread queues the call in the GUI thread event loop (or
+    runs it right away if already called from the GUI thread).
+'''
+from typing import Callable
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from src.context.logger import get_logger
+
+log = get_logger('gui')
+
+
+class GuiInvoker(QObject):
+    invoke = pyqtSignal(object, tuple)
+
+    def __init__(self):
+        super().__init__()
+        self.invoke.connect(self.on_invoke)
+
+    def on_invoke(self, slot: Callable, args: tuple):
+        # Unhandled exceptions in Qt slots abort the application
+        try:
+            slot(*args)
+        except Exception:
+            log.error("Error in GUI slot %r", slot, exc_info=True)
+
+
+_invoker: GuiInvoker = None
+
+
+def gui_slot(slot: Callable) -> Callable:
+    '''
+        The first call must be done from the GUI thread, which owns the invoker.
+    '''
+    global _invoker
+    if _invoker is None:
+        _invoker = GuiInvoker()
+
+    invoker = _invoker
+    return lambda *args: invoker.invoke.emit(slot, args)
+
+
+class SignalConnections:
+    '''
+        Keeps track of the slots a widget connected to server signals, so
+        they can be disconnected later on (e.g. when the widget shows a
+        different session or is destroyed).
+    '''
+
+    def __init__(self):
+        self.connections = []
+
+    def connect(self, signal, slot: Callable):
+        wrapper = gui_slot(slot)
+        signal.connect(wrapper)
+        self.connections.append((signal, wrapper))
+
+    def disconnect_all(self):
+        for signal, wrapper in self.connections:
+            signal.disconnect(wrapper)
+        self.connections = []
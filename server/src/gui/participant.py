@@ -1,32 +1,86 @@
-from PyQt5.QtCore import pyqtSlot
-from PyQt5.QtWidgets import QHBoxLayout, QLabel, QWidget
+from typing import List
 
-from src.context import Participant
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
 
+from src.context import Participant, Session
 
-class ParticipantWidget(QWidget):
-    def __init__(self,
-        participant,
-        parent=None
-    ):
+
+class ParticipantTableModel(QAbstractTableModel):
+    '''
+        Participants of a session, as rows of a `QTableView`.
+
+        The model doesn't listen to participant events: `refresh` is meant to
+        be called at a fixed frame rate, and only when the session version
+        changed (any join, departure or status change bumps it) it appends
+        the new participants in a single insertion and signals one
+        `dataChanged` for the whole status column. Bursts of joins and ready
+        messages are thus coalesced into one repaint per frame, and only the
+        visible rows are ever painted. Departures (rare, and already batched
+        by the session) reset the model.
+    '''
+    COLUMNS = ('ID', 'Username', 'Status')
+    STATUS_COLUMN = 2
+
+    def __init__(self, parent=None):
         super().__init__(parent)
-        self.participant = participant
-        self.participant.on_status_changed.connect(self.on_status_changed)
+        self.session: Session = None
+        self._participants: List[Participant] = []
+        self._version = None
+
+    def set_session(self, session: Session):
+        self.beginResetModel()
+        self.session = session
+        self._version = session.version if session is not None else None
+        self._participants = session.participants.values() if session is not None else []
+        self.endResetModel()
+
+    def refresh(self) -> bool:
+        '''
+            Applies the changes since the last call. Returns whether there
+            were any.
+        '''
+        session = self.session
+        if session is None or session.version == self._version:
+            return False
+        # Read before the participants: a change happening meanwhile is picked up on the next call
+        self._version = session.version
+
+        participants = session.participants.values()
+        known = len(self._participants)
+        if len(participants) < known or any(a is not b for a, b in zip(participants, self._participants)):
+            # Some participants left: the rest keep their join order, but rows moved
+            self.beginResetModel()
+            self._participants = participants
+            self.endResetModel()
+            return True
+
+        if len(participants) > known:
+            self.beginInsertRows(QModelIndex(), known, len(participants) - 1)
+            self._participants.extend(participants[known:])
+            self.endInsertRows()
+
+        if self._participants:
+            self.dataChanged.emit(
+                self.index(0, ParticipantTableModel.STATUS_COLUMN),
+                self.index(len(self._participants) - 1, ParticipantTableModel.STATUS_COLUMN),
+                [Qt.DisplayRole]
+            )
+        return True
 
-        main_layout = QHBoxLayout(self)
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._participants)
 
-        id_label = QLabel(self)
-        main_layout.addWidget(id_label)
-        id_label.setText(str(participant.id))
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(ParticipantTableModel.COLUMNS)
 
-        username_label = QLabel(self)
-        main_layout.addWidget(username_label)
-        username_label.setText(participant.username)
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
 
-        self.status_label = QLabel(self)
-        main_layout.addWidget(self.status_label)
-        self.status_label.setText(participant.status.value)
+        participant = self._participants[index.row()]
+        return (participant.id, participant.username, participant.status.value)[index.column()]
 
-    @pyqtSlot(Participant, Participant.Status)
-    def on_status_changed(self, participant, status):
-        self.status_label.setText(status.value)
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return ParticipantTableModel.COLUMNS[section]
+        return None
@@ -1,12 +1,15 @@
-from PyQt5.QtCore import QTime, QTimer, pyqtSlot
-from PyQt5.QtWidgets import (QComboBox, QGridLayout, QGroupBox, QLabel,
-                             QLineEdit, QListWidget, QListWidgetItem,
-                             QPushButton, QStackedWidget, QVBoxLayout, QWidget)
+from PyQt5.QtCore import Qt, QTime, QTimer, pyqtSlot
+from PyQt5.QtWidgets import (QAbstractItemView, QComboBox, QGridLayout,
+                             QGroupBox, QHeaderView, QLabel, QLineEdit,
+                             QListWidgetItem, QPushButton, QStackedWidget,
+                             QTableView, QVBoxLayout, QWidget)
 
-from src.context import AppContext, Participant, Session
+from src.context import AppContext, Session
 from src.context.session import SessionCommunicator
 
-from .participant import ParticipantWidget
+from .bridge import SignalConnections
+from .participant import ParticipantTableModel
+from .swarm import SwarmViewWidget
 
 
 class SessionListItem(QListWidgetItem):
@@ -22,8 +25,19 @@ class SessionPanelWidget(QWidget):
     ):
         super().__init__(parent)
         self.session = None
+        self.session_connections = SignalConnections()
+        self.catalog_connections = SignalConnections()
+        # Single shot, scheduled for the next time the mm:ss countdown changes
         self.duration_timer = QTimer(self)
+        self.duration_timer.setSingleShot(True)
+        self.duration_timer.setTimerType(Qt.PreciseTimer)
         self.duration_timer.timeout.connect(self.on_duration_timer_timeout)
+        # Participant changes are applied at most once per frame
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(int(1000 / AppContext.args.gui_fps))
+        self.refresh_timer.timeout.connect(self.on_refresh_timer_timeout)
+        self.latency_timer = QTimer(self)
+        self.latency_timer.timeout.connect(self.on_latency_timer_timeout)
 
         self.setupUI()
 
@@ -58,11 +72,31 @@ class SessionPanelWidget(QWidget):
         if not self.session: return
 
         remaining_ms = max(0, (self.session.duration * 1000) - self.session.timer.elapsed())
-        self.duration_timer_lbl.setText(QTime.fromMSecsSinceStartOfDay(remaining_ms).toString("mm:ss"))
+        text = QTime.fromMSecsSinceStartOfDay(remaining_ms).toString("mm:ss")
+        if text != self.duration_timer_lbl.text():
+            self.duration_timer_lbl.setText(text)
 
         if remaining_ms == 0:
+            # The session stops by itself once its duration expires
             self.start_btn.setEnabled(False)
-            self.session.stop()
+        else:
+            # Seconds are truncated: wake up right after the next whole second is crossed
+            self.duration_timer.start(remaining_ms % 1000 + 1)
+
+    @pyqtSlot()
+    def on_refresh_timer_timeout(self):
+        if self.participants_model.refresh():
+            self.update_participants_count()
+
+    @pyqtSlot()
+    def on_latency_timer_timeout(self):
+        if not self.session or not self.session.latency: return
+
+        fmt = lambda value: '-' if value is None else f"{value * 1000:.1f}"
+        self.latency_txt.setText(' · '.join(
+            f"{stage} {fmt(histogram['p50'])}/{fmt(histogram['p99'])} ms"
+            for stage, histogram in self.session.latency.as_dict.items()
+        ))
 
     ### SET QUESTION
 
@@ -77,33 +111,28 @@ class SessionPanelWidget(QWidget):
                 self.session.active_question = None
                 self.question_cbbox.setCurrentIndex(0)
 
+    def on_questions_changed(self, catalog):
+        # Repopulate the question list without changing the session question
+        current = self.question_cbbox.currentText()
+        self.question_cbbox.blockSignals(True)
+        self.question_cbbox.clear()
+        self.question_cbbox.addItem('<none>')
+        self.question_cbbox.addItems([str(id) for id in catalog])
+        self.question_cbbox.setCurrentText(current)
+        self.question_cbbox.blockSignals(False)
+
     @pyqtSlot(Session, bool)
     def on_question_notified(self, session, notified):
         self.question_cbbox.setEnabled(True)
 
-    ### ADD PARTICIPANT
-
-    def add_participant_widget(self, participant: Participant):
-        widget = ParticipantWidget(participant)
-        item = QListWidgetItem(self.participants_list)
-        item.setSizeHint(widget.sizeHint())
-        self.participants_list.addItem(item)
-        self.participants_list.setItemWidget(item, widget)
+    ### PARTICIPANTS
 
-    @pyqtSlot(Session, Participant)
-    def on_participant_joined(self, session, participant):
-        if session != self.session:
-            return
-
-        self.add_participant_widget(participant)
-        self.start_btn.setEnabled(False)
-        self.participants_ready_txt.setText(f"{session.ready_participants_count}/{len(session.participants)} participants")
-
-    @pyqtSlot(int, int)
-    def on_participants_ready_changed(self, ready_count, total_count):
+    def update_participants_count(self):
+        ready_count = self.session.ready_participants_count
+        total_count = len(self.session.participants)
+        self.participants_ready_txt.setText(f"{ready_count}/{total_count} participants")
         if self.session.status == Session.Status.WAITING:
-            self.start_btn.setEnabled(ready_count == total_count)
-            self.participants_ready_txt.setText(f"{ready_count}/{total_count} participants")
+            self.start_btn.setEnabled(ready_count == total_count and total_count > 0)
 
     ### START / STOP
 
@@ -119,7 +148,7 @@ class SessionPanelWidget(QWidget):
         self.start_btn.setText('Stop')
         self.start_btn.setEnabled(True)
         self.duration_stack.setCurrentIndex(1)
-        self.duration_timer.start(10)
+        self.on_duration_timer_timeout()
 
     @pyqtSlot(Session, bool)
     def on_stop(self, session, stopped):
@@ -132,17 +161,15 @@ class SessionPanelWidget(QWidget):
     ### UI SETUP
 
     def set_session(self, session: Session):
-        if self.session is not None:
-            self.session.on_connection_status_changed.disconnect()
-            self.session.on_status_changed.disconnect()
-            self.session.on_question_notified.disconnect()
-            self.session.on_participant_joined.disconnect()
-            self.session.on_participants_ready_changed.disconnect()
-            self.session.on_start.disconnect()
-            self.session.on_stop.disconnect()
+        self.session_connections.disconnect_all()
 
         self.session = session
+        self.participants_model.set_session(session)
+        self.swarm_view.set_session(session)
         if session is None:
+            self.latency_timer.stop()
+            self.refresh_timer.stop()
+            self.duration_timer.stop()
             return
 
         self.id_txt.setText(str(session.id))
@@ -153,31 +180,33 @@ class SessionPanelWidget(QWidget):
         self.question_cbbox.setCurrentText(str(session.active_question.id) if session.active_question else '<none>')
         self.question_cbbox.setEnabled(session.status == Session.Status.WAITING)
 
-        # Refresh participants list
-        self.participants_list.clear()
-        for participant in session.participants.values():
-            self.add_participant_widget(participant)
-
-        # Update participants ready count
-        participants_ready_count = session.ready_participants_count
-        participants_total_count = len(session.participants)
-        self.participants_ready_txt.setText(f"{participants_ready_count}/{participants_total_count} participants")
+        # Latency histograms (p50/p99) are only available when tracing is enabled
+        self.latency_lbl.setHidden(session.latency is None)
+        self.latency_txt.setHidden(session.latency is None)
+        if session.latency is None:
+            self.latency_timer.stop()
+        else:
+            self.on_latency_timer_timeout()
+            self.latency_timer.start(1000)
 
-        # Configure Start/Stop button
+        # Configure Start/Stop button and countdown
         if session.status == Session.Status.WAITING:
             self.start_btn.setText('Start')
-            self.start_btn.setEnabled((participants_ready_count == participants_total_count) and (participants_total_count > 0))
+            self.duration_stack.setCurrentIndex(0)
+            self.duration_timer.stop()
         elif session.status == Session.Status.ACTIVE:
             self.start_btn.setText('Stop')
             self.start_btn.setEnabled(True)
+            self.duration_stack.setCurrentIndex(1)
+            self.on_duration_timer_timeout()
+        self.update_participants_count()
+        self.refresh_timer.start()
 
-        session.on_connection_status_changed.connect(self.on_connection_status_changed)
-        session.on_status_changed.connect(self.on_status_changed)
-        session.on_question_notified.connect(self.on_question_notified)
-        session.on_participant_joined.connect(self.on_participant_joined)
-        session.on_participants_ready_changed.connect(self.on_participants_ready_changed)
-        session.on_start.connect(self.on_start)
-        session.on_stop.connect(self.on_stop)
+        self.session_connections.connect(session.on_connection_status_changed, self.on_connection_status_changed)
+        self.session_connections.connect(session.on_status_changed, self.on_status_changed)
+        self.session_connections.connect(session.on_question_notified, self.on_question_notified)
+        self.session_connections.connect(session.on_start, self.on_start)
+        self.session_connections.connect(session.on_stop, self.on_stop)
 
     def setupUI(self):
         main_panel_layout = QVBoxLayout(self)
@@ -240,6 +269,7 @@ class SessionPanelWidget(QWidget):
         self.question_cbbox.addItem('<none>')
         self.question_cbbox.addItems([str(id) for id in AppContext.questions])
         self.question_cbbox.currentTextChanged.connect(self.on_question_changed)
+        self.catalog_connections.connect(AppContext.questions.on_changed, self.on_questions_changed)
 
         ## Participants ready count
         details_row += 1
@@ -250,6 +280,15 @@ class SessionPanelWidget(QWidget):
         self.participants_ready_txt = QLabel(details_panel)
         details_panel_layout.addWidget(self.participants_ready_txt, details_row, 1)
 
+        ## Latency (p50/p99)
+        details_row += 1
+        self.latency_lbl = QLabel(details_panel)
+        details_panel_layout.addWidget(self.latency_lbl, details_row, 0)
+        self.latency_lbl.setText("Latency:")
+
+        self.latency_txt = QLabel(details_panel)
+        details_panel_layout.addWidget(self.latency_txt, details_row, 1)
+
         ## Start button
         self.start_btn = QPushButton(self)
         main_panel_layout.addWidget(self.start_btn)
@@ -257,6 +296,17 @@ class SessionPanelWidget(QWidget):
         self.start_btn.setEnabled(False)
         self.start_btn.clicked.connect(self.on_start_btn_clicked)
 
+        ## Live participant positions
+        self.swarm_view = SwarmViewWidget(self)
+        main_panel_layout.addWidget(self.swarm_view)
+
         ## Participants list
-        self.participants_list = QListWidget(self)
-        main_panel_layout.addWidget(self.participants_list)
+        self.participants_model = ParticipantTableModel(self)
+        self.participants_view = QTableView(self)
+        main_panel_layout.addWidget(self.participants_view)
+        self.participants_view.setModel(self.participants_model)
+        self.participants_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.participants_view.verticalHeader().setVisible(False)
+        # Fixed row heights: the view doesn't need to measure every row
+        self.participants_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.participants_view.horizontalHeader().setStretchLastSection(True)
@@ -0,0 +1,118 @@
+import math
+from typing import List
+
+import numpy as np
+from PyQt5.QtCore import QPointF, QRectF, Qt, QTimer
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygonF
+from PyQt5.QtWidgets import QSizePolicy, QWidget
+
+from src.context import AppContext, Session
+from src.context.aggregation import SwarmSnapshot
+
+
+class SwarmViewWidget(QWidget):
+    '''
+        Live plot of the participant positions of a session, laid out like
+        the board of the client app: answers on a circle (the first one at
+        the top) and every position drawn as the sum of the answer vectors
+        weighted by its components.
+
+        Positions are pulled from the session aggregator at `gui_fps`, and
+        only when they changed, so the plot never adds work to the MQTT
+        thread. Snapshots are decimated to `max_points` positions, and all
+        the participants are drawn with a single `drawPoints` call.
+    '''
+    MARGIN = 40
+
+    def __init__(self, parent: QWidget = None, max_points: int = 2000):
+        super().__init__(parent)
+        self.session: Session = None
+        self.max_points = max_points
+        self.answers: List[str] = []
+        self._answer_vectors = np.zeros((0, 2), dtype=np.float32)
+        # Board coordinates in the unit circle, scaled to the widget when painting
+        self._points = np.zeros((0, 2), dtype=np.float32)
+        self._cue: np.ndarray = None
+        self._count = 0
+        self._version = None
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(int(1000 / AppContext.args.gui_fps))
+        self.refresh_timer.timeout.connect(self.refresh)
+
+        self.setMinimumSize(200, 200)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+    def set_session(self, session: Session):
+        self.session = session
+        self._version = None
+        self._points = np.zeros((0, 2), dtype=np.float32)
+        self._cue = None
+        self._count = 0
+        if session is None:
+            self.refresh_timer.stop()
+        else:
+            self.refresh()
+            self.refresh_timer.start()
+        self.update()
+
+    def set_answers(self, answers: List[str]):
+        self.answers = list(answers)
+        angles = -math.pi / 2 + 2 * math.pi * np.arange(len(answers)) / max(1, len(answers))
+        self._answer_vectors = np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+
+    def refresh(self):
+        if self.session is None or not self.isVisible():
+            return
+
+        question = self.session.active_question
+        answers = (question.answers or []) if question is not None else []
+        if answers != self.answers:
+            self.set_answers(answers)
+            self._version = None
+            self.update()
+
+        aggregator = self.session.aggregator
+        if aggregator.version == self._version:
+            return
+        snapshot = aggregator.snapshot(self.max_points)
+        self._version = snapshot.version
+        self.set_snapshot(snapshot)
+
+    def set_snapshot(self, snapshot: SwarmSnapshot):
+        self._count = snapshot.count
+        if snapshot.cue is None or snapshot.positions.shape[1] != len(self.answers) or len(self.answers) < 2:
+            self._points = np.zeros((0, 2), dtype=np.float32)
+            self._cue = None
+        else:
+            self._points = snapshot.positions @ self._answer_vectors
+            self._cue = snapshot.cue @ self._answer_vectors
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.fillRect(self.rect(), self.palette().base())
+
+        radius = max(1, min(self.width(), self.height()) / 2 - SwarmViewWidget.MARGIN)
+        center = QPointF(self.width() / 2, self.height() / 2)
+
+        painter.setPen(QPen(self.palette().mid().color(), 1))
+        painter.drawEllipse(center, radius, radius)
+
+        painter.setPen(self.palette().text().color())
+        for answer, (x, y) in zip(self.answers, self._answer_vectors.tolist()):
+            anchor = QPointF(center.x() + x * (radius + 18), center.y() + y * (radius + 14))
+            painter.drawText(QRectF(anchor.x() - 50, anchor.y() - 10, 100, 20), Qt.AlignCenter, answer)
+        painter.drawText(QRectF(4, 4, self.width() - 8, 20), Qt.AlignLeft, f"{self._count} participants")
+
+        offset = np.array([center.x(), center.y()], dtype=np.float32)
+        points = self._points * radius + offset
+        painter.setPen(QPen(QColor(30, 120, 220, 160), 6, Qt.SolidLine, Qt.RoundCap))
+        painter.drawPoints(QPolygonF([QPointF(x, y) for x, y in points.tolist()]))
+
+        if self._cue is not None:
+            x, y = (self._cue * radius + offset).tolist()
+            painter.setPen(QPen(QColor(220, 60, 40), 14, Qt.SolidLine, Qt.RoundCap))
+            painter.drawPoint(QPointF(x, y))
+        painter.end()
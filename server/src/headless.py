@@ -0,0 +1,35 @@
+import signal
+from threading import Event
+
+from .context import AppContext
+from .context.logger import get_logger
+from .services import start_services, stop_services
+
+log = get_logger('headless')
+
+
+def run():
+    '''
+        Runs the MQTT broker, the HTTP API and the sessions without GUI
+        until SIGINT/SIGTERM is received. Sessions are managed through the API.
+
+        With `--shards N`, sessions are spread across N worker processes
+        (see `src.services.sharding`).
+    '''
+    if AppContext.args.shards > 0:
+        from .services.sharding import run as run_sharded
+        run_sharded(AppContext.args.shards)
+        return
+
+    stop_event = Event()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(stop_signal, lambda *_: stop_event.set())
+
+    start_services(lambda service: log.info("%s started", service.__class__.__name__))
+    try:
+        # Waiting with a timeout keeps the main thread responsive to signals
+        while not stop_event.wait(1):
+            pass
+    finally:
+        log.info("Shutting down")
+        stop_services()
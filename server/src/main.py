@@ -1,31 +1,82 @@
 import sys
 from argparse import ArgumentParser
 
-from PyQt5.QtWidgets import QApplication
-
 from .context import AppContext
-from .gui import ServerGUI
+from .context.logger import setup_logging, shutdown_logging
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--api-port', dest='api_port', type=int,
                         help=f"HTTP API port. Default: {AppContext.args.api_port}",
                         default=AppContext.args.api_port)
+    parser.add_argument('--api-server', dest='api_server', choices=['threaded', 'pooled'],
+                        help=f"HTTP API server: a thread per connection, or a bounded pool of workers that idle connections don't hold. Default: {AppContext.args.api_server}",
+                        default=AppContext.args.api_server)
+    parser.add_argument('--api-workers', dest='api_workers', type=int,
+                        help=f"Worker threads of the pooled HTTP API server. Default: {AppContext.args.api_workers}",
+                        default=AppContext.args.api_workers)
     parser.add_argument('--mqtt-port', dest='mqtt_port', type=int,
                         help=f"MQTT Broker port. Default: {AppContext.args.mqtt_port}",
                         default=AppContext.args.mqtt_port)
+    parser.add_argument('--cue-interval', dest='cue_interval', type=int,
+                        help=f"Central cue broadcast interval (ms). Default: {AppContext.args.cue_interval}",
+                        default=AppContext.args.cue_interval)
+    parser.add_argument('--cue-format', dest='cue_format', choices=['json', 'binary'],
+                        help=f"Central cue broadcast encoding. Default: {AppContext.args.cue_format}",
+                        default=AppContext.args.cue_format)
+    parser.add_argument('--state-interval', dest='state_interval', type=int,
+                        help=f"Minimum interval between session state snapshots (ms). Default: {AppContext.args.state_interval}",
+                        default=AppContext.args.state_interval)
+    parser.add_argument('--presence-timeout', dest='presence_timeout', type=float,
+                        help="Seconds without messages after which a participant that sends heartbeats is removed "
+                             f"from its session (0 disables it). Default: {AppContext.args.presence_timeout}",
+                        default=AppContext.args.presence_timeout)
+    parser.add_argument('--presence-grace', dest='presence_grace', type=float,
+                        help="Seconds a participant whose connection dropped has to reconnect before it is removed "
+                             f"from its session. Default: {AppContext.args.presence_grace}",
+                        default=AppContext.args.presence_grace)
+    parser.add_argument('--gui-fps', dest='gui_fps', type=int,
+                        help=f"Maximum refresh rate of the live views of the GUI. Default: {AppContext.args.gui_fps}",
+                        default=AppContext.args.gui_fps)
+    parser.add_argument('--log-format', dest='log_format', choices=['csv', 'binary'],
+                        help=f"Session log storage format. Default: {AppContext.args.log_format}",
+                        default=AppContext.args.log_format)
+    parser.add_argument('--trace-latency', dest='trace_latency', action='store_true',
+                        help="Record latency histograms of the participant updates path")
+    parser.add_argument('--log-level', dest='log_level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help=f"Console log level. Default: {AppContext.args.log_level}",
+                        default=AppContext.args.log_level)
+    parser.add_argument('--mosquitto-verbose', dest='mosquitto_verbose', action='store_true',
+                        help="Run the MQTT broker in verbose mode (logs every packet)")
+    parser.add_argument('--headless', action='store_true',
+                        help="Run without GUI (PyQt5, from requirements-gui.txt, is not required). Sessions are managed through the HTTP API")
+    parser.add_argument('--questions-poll', dest='questions_poll_interval', type=float,
+                        help=f"Seconds between checks for changes in the questions folder (0 disables it). Default: {AppContext.args.questions_poll_interval}",
+                        default=AppContext.args.questions_poll_interval)
+    parser.add_argument('--shards', type=int,
+                        help="Spread sessions across this many worker processes (headless mode only). "
+                             f"Default: {AppContext.args.shards} (single process)",
+                        default=AppContext.args.shards)
     AppContext.args = parser.parse_args()
+    if AppContext.args.shards > 0 and not AppContext.args.headless:
+        parser.error("--shards requires --headless")
+    setup_logging(AppContext.args.log_level)
     AppContext.reload_questions()
 
-    app = QApplication(sys.argv)
-
-    gui = ServerGUI()
-    gui.setupUI()
-    gui.show()
+    if AppContext.args.headless:
+        from .headless import run
+        try:
+            run()
+        finally:
+            shutdown_logging()
+        sys.exit(0)
 
     try:
-        app.exec()
-    except KeyboardInterrupt:
-        pass
+        from .gui import run
+    except ImportError as e:
+        shutdown_logging()
+        sys.exit(f"The GUI requires PyQt5 ({e}): install requirements-gui.txt, or run with --headless")
+    try:
+        run()
     finally:
-        gui.shutdown()
+        shutdown_logging()
@@ -1,29 +1,58 @@
 from typing import Callable, Union
 
 import src.context as ctx
+from src.context.communicator import SharedCommunicator
+from src.context.logger import get_logger
 from .api import ServerAPI
+from .images import QuestionImages
 from .mqtt import BrokerWrapper
 
+log = get_logger('services')
 
 def start_services(
     on_start_cb: Callable[[Union[BrokerWrapper, ServerAPI]], None]=None
 ):
-    print("Starting services")
-    ctx.AppContext.mqtt_broker = BrokerWrapper('localhost', ctx.AppContext.args.mqtt_port)
+    log.info("Starting services")
+    ctx.AppContext.questions.start()
+    ctx.AppContext.question_images = QuestionImages(ctx.IMAGE_CACHE_FOLDER)
+
+    ctx.AppContext.mqtt_broker = BrokerWrapper('localhost', ctx.AppContext.args.mqtt_port,
+                                               verbose=ctx.AppContext.args.mosquitto_verbose)
     if on_start_cb:
         ctx.AppContext.mqtt_broker.on_start = lambda: on_start_cb(ctx.AppContext.mqtt_broker)
     ctx.AppContext.mqtt_broker.start()
 
-    ctx.AppContext.api_service = ServerAPI(port=ctx.AppContext.args.api_port)
+    ctx.AppContext.mqtt_communicator = SharedCommunicator(port=ctx.AppContext.mqtt_broker.port)
+    ctx.AppContext.mqtt_communicator.start()
+
+    ctx.AppContext.api_service = ServerAPI(port=ctx.AppContext.args.api_port,
+                                           server_mode=ctx.AppContext.args.api_server,
+                                           workers=ctx.AppContext.args.api_workers)
     if on_start_cb:
         ctx.AppContext.api_service.on_start.connect(lambda: on_start_cb(ctx.AppContext.api_service))
     ctx.AppContext.api_service.start()
 
-    print("Services up and running")
+    log.info("Services up and running")
 
 def stop_services():
+    ctx.AppContext.questions.stop()
+
+    for session in ctx.AppContext.sessions.values():
+        session.close()
+    for session in ctx.AppContext.sessions.values():
+        if not session.join_logs(5):
+            log.warning("[session %d] Session log not flushed on time, pending records are lost", session.id)
+
+    if ctx.AppContext.mqtt_communicator:
+        ctx.AppContext.mqtt_communicator.shutdown()
+
     if ctx.AppContext.mqtt_broker:
         ctx.AppContext.mqtt_broker.stop()
 
     if ctx.AppContext.api_service:
-        ctx.AppContext.api_service.shutdown()
\ No newline at end of file
+        ctx.AppContext.api_service.shutdown()
+        if ctx.AppContext.api_service.is_alive():
+            ctx.AppContext.api_service.join()
+
+    if ctx.AppContext.question_images:
+        ctx.AppContext.question_images.shutdown()
\ No newline at end of file
@@ -1,23 +1,36 @@
-from pathlib import Path
 from threading import Thread
 
-from flask import (Flask, jsonify, redirect, request, send_file,
-                   send_from_directory)
-from PyQt5.QtCore import QObject, pyqtSignal
-from werkzeug.serving import make_server
+from flask import Flask, jsonify, redirect, request
 
-from src.context import AppContext, Participant, Session
+from src.context import CLIENT_BUILD_FOLDER, AppContext, Session
+from src.context.events import Signal
+from .http import create_server
+from .images import QuestionImages
+from .json_cache import JsonCache
+from .static import StaticManifest
 
-QUESTIONS_FOLDER = Path('questions')
 
-class ServerAPI(Thread, QObject):
-    on_start = pyqtSignal()
-    on_session_created = pyqtSignal(Session)
+class ServerAPI(Thread):
+    SESSION_PAGE_SIZE = 100
+    MAX_SESSION_PAGE_SIZE = 1000
+    MAX_BATCH_JOIN = 1000
 
-    def __init__(self, host='0.0.0.0', port=5000):
+    on_start = Signal()
+    on_session_created = Signal()
+    '''
+        `on_session_created(session: Session)`
+    '''
+    on_session_closed = Signal()
+    '''
+        `on_session_closed(session: Session)`
+    '''
+
+    def __init__(self, host='0.0.0.0', port=5000, server_mode='threaded', workers=32, serve_client=True):
         Thread.__init__(self)
-        QObject.__init__(self)
-        self.app = Flask(__name__, static_folder='../../../client/build')
+        self.app = Flask(__name__, static_folder=None)
+        self.json_cache = JsonCache()
+        # Shards leave the client app to the front process
+        self.static_manifest = StaticManifest(CLIENT_BUILD_FOLDER) if serve_client else None
 
         @self.app.route('/api/session/<int:session_id>', methods=['GET'])
         def api_session_handle_get(session_id: int):
@@ -25,11 +38,37 @@ class ServerAPI(Thread, QObject):
             if session is None:
                 return "Session not found", 404
 
-            return jsonify(session.as_dict)
+            return JsonCache.response(
+                self.json_cache.get(('session', session_id), session.version, lambda: session.as_dict),
+                request
+            )
 
         @self.app.route('/api/session', methods=['GET'])
         def api_get_all_sessions():
-            return jsonify([session.as_dict for session in AppContext.sessions.values()])
+            '''
+                Sessions ordered by id, paginated with the `offset` and
+                `limit` query params, and optionally filtered by `status`
+                and by `after` (only sessions with a greater id, for keyset
+                pagination). The number of matching sessions is sent in
+                `X-Total-Count`.
+            '''
+            offset = request.args.get('offset', 0, type=int)
+            limit = request.args.get('limit', ServerAPI.SESSION_PAGE_SIZE, type=int)
+            after = request.args.get('after', 0, type=int)
+            if offset < 0 or after < 0 or not 0 < limit <= ServerAPI.MAX_SESSION_PAGE_SIZE:
+                return f"Requested offset must be positive and limit within 1-{ServerAPI.MAX_SESSION_PAGE_SIZE}", 400
+
+            sessions = [session for session in AppContext.sessions.values() if session.id > after]
+            if 'status' in request.args:
+                try:
+                    status = Session.Status(request.args['status'])
+                except ValueError:
+                    return "Requested status is not valid", 400
+                sessions = [session for session in sessions if session.status == status]
+
+            response = jsonify([session.as_dict for session in sessions[offset:offset + limit]])
+            response.headers['X-Total-Count'] = str(len(sessions))
+            return response
 
         @self.app.route('/api/session', methods=['POST'])
         def api_create_session():
@@ -39,6 +78,43 @@ class ServerAPI(Thread, QObject):
             self.on_session_created.emit(session)
             return jsonify(session.as_dict)
 
+        @self.app.route('/api/session/<int:session_id>', methods=['DELETE'])
+        def api_close_session(session_id: int):
+            session = AppContext.sessions.pop(session_id, None)
+            if session is None:
+                return "Session not found", 404
+
+            session.close()
+            self.json_cache.discard(('session', session_id))
+            self.json_cache.discard(('participants', session_id))
+            self.on_session_closed.emit(session)
+            return jsonify(session.as_dict)
+
+        @self.app.route('/api/session/<int:session_id>/stats', methods=['GET'])
+        def api_session_get_stats(session_id: int):
+            session = AppContext.sessions.get(session_id, None)
+            if session is None:
+                return "Session not found", 404
+
+            log_writer = session.log_writer
+            return jsonify({
+                'routing': session.communicator.routing_stats.as_dict,
+                'ingest': session.ingest.stats,
+                'presence': session.presence.stats,
+                'log': log_writer.stats if log_writer else None,
+            })
+
+        @self.app.route('/api/session/<int:session_id>/latency', methods=['GET'])
+        def api_session_get_latency(session_id: int):
+            session = AppContext.sessions.get(session_id, None)
+            if session is None:
+                return "Session not found", 404
+
+            if session.latency is None:
+                return "Latency tracing is disabled", 404
+
+            return jsonify(session.latency.as_dict)
+
         @self.app.route('/api/session/<int:session_id>', methods=['POST'])
         def api_edit_session(session_id: int):
             session = AppContext.sessions.get(session_id, None)
@@ -52,9 +128,10 @@ class ServerAPI(Thread, QObject):
             ):
                 return "Invalid parameter", 400
 
+            status = None
             if 'status' in session_data:
                 try:
-                    session.status = Session.Status(session_data['status'])
+                    status = Session.Status(session_data['status'])
                 except ValueError:
                     return "Requested status is not valid", 400
 
@@ -63,10 +140,11 @@ class ServerAPI(Thread, QObject):
                 if not isinstance(question_id, int):
                     return "Requested question_id must be an integer", 400
 
-                if not (QUESTIONS_FOLDER / str(question_id)).is_dir():
+                question = AppContext.questions.get(question_id, None)
+                if question is None:
                     return "Requested question_id doesn't exist", 404
 
-                session.active_question = question_id
+                session.active_question = question
 
             if 'duration' in session_data:
                 if not isinstance(session_data['duration'], int):
@@ -74,6 +152,14 @@ class ServerAPI(Thread, QObject):
 
                 session.duration = session_data['duration']
 
+            # Status changes go through start/stop, so participants are notified
+            if status == Session.Status.ACTIVE and session.status == Session.Status.WAITING:
+                if session.active_question is None:
+                    return "A question must be set before starting the session", 400
+                session.start()
+            elif status == Session.Status.WAITING and session.status == Session.Status.ACTIVE:
+                session.stop()
+
             return jsonify(session.as_dict)
 
         @self.app.route('/api/session/<int:session_id>/participants', methods=['GET'])
@@ -82,26 +168,90 @@ class ServerAPI(Thread, QObject):
             if session is None:
                 return "Session not found", 404
 
-            return jsonify([participant.as_dict for participant in session.participants])
+            # Any change in the participants (join, status) bumps the session version
+            return JsonCache.response(
+                self.json_cache.get(
+                    ('participants', session_id),
+                    session.version,
+                    lambda: [participant.as_dict for participant in session.participants.values()]
+                ),
+                request
+            )
 
         @self.app.route('/api/session/<int:session_id>/participants', methods=['POST'])
         def api_session_add_participant(session_id: int):
-            if 'user' not in request.json:
+            data = request.json
+            username = data.get('user', None) if isinstance(data, dict) else None
+            if not isinstance(username, str):
                 return "Invalid request", 400
-            username = request.json['user']
 
             session = AppContext.sessions.get(session_id, None)
             if session is None:
                 return "Session not found", 404
 
-            if any(username == participant.username for participant in session.participants.values()):
+            participant = session.join(username)
+            if participant is None:
                 return "Participant already joined session", 400
 
-            participant = Participant(username)
-            session.add_participant(participant)
-
             return jsonify(participant.as_dict)
 
+        @self.app.route('/api/session/<int:session_id>/participants/batch', methods=['POST'])
+        def api_session_add_participants(session_id: int):
+            '''
+                Joins several participants at once (kiosks, emulators...).
+                Usernames that already joined are returned in `rejected`.
+            '''
+            data = request.json
+            users = data.get('users', None) if isinstance(data, dict) else None
+            if not isinstance(users, list) or not all(isinstance(user, str) for user in users):
+                return "Invalid request", 400
+            if len(users) > ServerAPI.MAX_BATCH_JOIN:
+                return f"Up to {ServerAPI.MAX_BATCH_JOIN} participants can join at once", 400
+
+            session = AppContext.sessions.get(session_id, None)
+            if session is None:
+                return "Session not found", 404
+
+            joined, rejected = [], []
+            for username in users:
+                participant = session.join(username)
+                if participant is None:
+                    rejected.append(username)
+                else:
+                    joined.append(participant.as_dict)
+
+            return jsonify({
+                'participants': joined,
+                'rejected': rejected,
+            })
+
+        @self.app.route('/api/session/<int:session_id>/join', methods=['POST'])
+        def api_session_join(session_id: int):
+            '''
+                Joins the session and returns everything a participant needs
+                to get ready: the participant, the session state snapshot and
+                its current question (if any), in a single round trip.
+            '''
+            data = request.json
+            username = data.get('user', None) if isinstance(data, dict) else None
+            if not isinstance(username, str):
+                return "Invalid request", 400
+
+            session = AppContext.sessions.get(session_id, None)
+            if session is None:
+                return "Session not found", 404
+
+            participant = session.join(username)
+            if participant is None:
+                return "Participant already joined session", 400
+
+            question = session.active_question
+            return jsonify({
+                'participant': participant.as_dict,
+                'session': session.state,
+                'question': question.as_dict if question else None,
+            })
+
         @self.app.route('/api/session/<int:session_id>/participants/<int:participant_id>', methods=['DELETE'])
         def api_session_remove_participant(session_id: int, participant_id: int):
             # TODO: Implement the participant delete endpoint
@@ -113,7 +263,11 @@ class ServerAPI(Thread, QObject):
             if question is None:
                 return "Question not found", 404
 
-            return jsonify(question.as_dict)
+            # Questions are immutable (the catalog replaces them when modified)
+            return JsonCache.response(
+                self.json_cache.get(('question', question_id), question, lambda: question.as_dict),
+                request
+            )
 
         @self.app.route('/api/question/<int:question_id>/image')
         def api_question_image_handle(question_id: int):
@@ -121,18 +275,34 @@ class ServerAPI(Thread, QObject):
             if question is None:
                 return "Question not found", 404
 
-            return send_file(question.img_path) if question.img_is_local else redirect(question.img_path)
+            if not question.img_is_local:
+                return redirect(question.img_path)
+
+            size = request.args.get('size', None)
+            if size is not None and size != 'original' and not size.isdecimal():
+                return "Requested size must be an integer or 'original'", 400
+
+            image = AppContext.question_images.resolve(
+                question,
+                width=int(size) if size and size.isdecimal() else None,
+                original=size == 'original'
+            )
+            if image is None:
+                return "Question image not found", 404
+
+            return QuestionImages.response(image)
 
         # Serve client app
         @self.app.route('/', defaults={'path': ''})
         @self.app.route('/<path:path>')
         def client_handler(path):
-            if path == '' or not (Path(self.app.static_folder) / path).is_file():
-                return send_from_directory(self.app.static_folder, 'index.html')
+            asset = self.static_manifest.resolve(path) if self.static_manifest else None
+            if asset is None:
+                return "Client app not found", 404
 
-            return send_from_directory(self.app.static_folder, path)
+            return self.static_manifest.response(asset, request)
 
-        self.server = make_server(host, port, self.app, threaded=True)
+        self.server = create_server(host, port, self.app, server_mode, workers)
         self.ctx = self.app.app_context()
         self.ctx.push()
 
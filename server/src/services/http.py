@@ -0,0 +1,445 @@
+'''
+    HTTP serving modes of the API.
+
+    - `threaded`: Werkzeug's development server, one new thread per
+      connection, unbounded.
+    - `pooled`: `PooledWSGIServer`, a fixed pool of worker threads, which
+      only serve connections with a request to read. Connections are kept
+      open between requests (HTTP/1.1 keep-alive), and idle ones wait in a
+      selector, so they cost no worker. Connections readable while every
+      worker is busy wait in a bounded queue; past `max_connections` open
+      connections, new ones are closed once accepted. On shutdown, the
+      server stops accepting, closes the idle connections, lets in-flight
+      requests finish and only then closes the socket.
+'''
+import selectors
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Condition, Lock, Thread
+from time import monotonic
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from werkzeug.exceptions import InternalServerError
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, make_server
+from werkzeug.wsgi import LimitedStream
+
+from src.context.logger import get_logger
+
+log = get_logger('http')
+
+SERVER_MODES = ('threaded', 'pooled')
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    '''
+        Serves the requests of a connection while they keep coming. Once the
+        connection is idle, it is left `parked` (streams open) for the
+        server to resume it on its next request.
+
+        Werkzeug's handler closes the connection after every response, as it
+        doesn't know where a request body ends. `run_wsgi` is replaced to
+        keep the connection open when the client allows it (HTTP/1.1, or
+        HTTP/1.0 with `Connection: keep-alive`): the application reads the
+        body through a stream bounded by its length, and the part it left
+        unread is discarded after the response. The connection is closed
+        instead if more than `max_drain` bytes are left when the response
+        starts, or if the body is chunked (its size is unknown).
+    '''
+    protocol_version = 'HTTP/1.1'
+    max_drain = 64 * 1024
+
+    def __init__(self, request, client_address, server):
+        self.parked = False
+        super().__init__(request, client_address, server)
+
+    def setup(self):
+        # Headers and body are separate writes: with Nagle's algorithm, the body of a response on a
+        # reused connection would wait for the delayed ACK of the headers (~40 ms)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+    def run_wsgi(self):
+        if self.server.draining:
+            self.close_connection = True
+        if self.headers.get('Expect', '').lower().strip() == '100-continue':
+            self.wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        self.environ = environ = self.make_environ()
+        body = None
+        if environ.get('wsgi.input_terminated', False):
+            # Chunked
+            self.close_connection = True
+        else:
+            # The body ends after `Content-Length` bytes (none if missing)
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.close_connection = True
+            body = environ['wsgi.input'] = LimitedStream(self.rfile, max(length, 0))
+
+        status_set: Optional[str] = None
+        headers_set: Optional[List[Tuple[str, str]]] = None
+        status_sent: Optional[str] = None
+        chunk_response = False
+
+        def write(data: bytes):
+            nonlocal status_sent, chunk_response
+            if status_sent is None:
+                status_sent = status_set
+                code, _, message = status_sent.partition(' ')
+                code = int(code)
+                self.send_response(code, message)
+                header_keys = set()
+                for key, value in headers_set:
+                    # Hop-by-hop, decided below
+                    if key.lower() == 'connection':
+                        continue
+                    self.send_header(key, value)
+                    header_keys.add(key.lower())
+
+                if not (
+                    'content-length' in header_keys
+                    or environ['REQUEST_METHOD'] == 'HEAD'
+                    or 100 <= code < 200
+                    or code in (204, 304)
+                ):
+                    if self.request_version >= 'HTTP/1.1':
+                        chunk_response = True
+                        self.send_header('Transfer-Encoding', 'chunked')
+                    else:
+                        # The end of the body is the end of the connection
+                        self.close_connection = True
+                if body is not None and body.limit - body.tell() > self.max_drain:
+                    self.close_connection = True
+                self.send_header('Connection', 'close' if self.close_connection else 'keep-alive')
+                self.end_headers()
+
+            if data:
+                if chunk_response:
+                    self.wfile.write(f'{len(data):x}\r\n'.encode())
+                self.wfile.write(data)
+                if chunk_response:
+                    self.wfile.write(b'\r\n')
+            self.wfile.flush()
+
+        def start_response(status, headers, exc_info=None):
+            nonlocal status_set, headers_set
+            if exc_info:
+                try:
+                    if status_sent is not None:
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            elif headers_set:
+                raise AssertionError("Headers already set")
+            status_set = status
+            headers_set = headers
+            return write
+
+        def execute(app):
+            application_iter = app(environ, start_response)
+            try:
+                for data in application_iter:
+                    write(data)
+                if status_sent is None:
+                    write(b'')
+                if chunk_response:
+                    self.wfile.write(b'0\r\n\r\n')
+                    self.wfile.flush()
+            finally:
+                if hasattr(application_iter, 'close'):
+                    application_iter.close()
+
+        try:
+            execute(self.server.app)
+        except (ConnectionError, socket.timeout) as e:
+            self.close_connection = True
+            self.connection_dropped(e, environ)
+            return
+        except Exception:
+            if self.server.passthrough_errors:
+                raise
+            # Whatever was sent of the response, the connection can't be reused
+            self.close_connection = True
+            if status_sent is None:
+                status_set, headers_set = None, None
+                try:
+                    execute(InternalServerError())
+                except Exception:
+                    pass
+            log.error("Error on request %s", self.requestline, exc_info=True)
+            return
+
+        if not self.close_connection and not self._drain(body):
+            # Disconnected client
+            self.close_connection = True
+
+    @staticmethod
+    def _drain(body: LimitedStream) -> bool:
+        '''
+            Discards the rest of the request body. Returns whether it was
+            entirely read.
+        '''
+        try:
+            body.exhaust()
+        except Exception:
+            return False
+        return body.is_exhausted
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if self.server.draining:
+            self.close_connection = True
+        elif not self.close_connection and not self._input_pending():
+            # Ends the request loop without closing the connection
+            self.parked = True
+            self.close_connection = True
+
+    def _input_pending(self) -> bool:
+        '''
+            Whether the next request (pipelined) is already buffered or
+            received, without blocking.
+        '''
+        self.connection.setblocking(False)
+        try:
+            return len(self.rfile.peek(1)) > 0
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def resume(self):
+        self.parked = False
+        try:
+            self.handle()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if not self.parked:
+            super().finish()
+
+    def release(self):
+        '''
+            Closes the streams of a parked connection.
+        '''
+        self.parked = False
+        self.finish()
+
+    def log_request(self, code='-', size='-'):
+        # Access logs are too expensive to be written for every request under load
+        log.debug('%s "%s" %s %s', self.address_string(), self.requestline, code, size)
+
+
+class IdleConnection(NamedTuple):
+    connection: socket.socket
+    client_address: tuple
+    handler: Optional[KeepAliveRequestHandler]    # `None` until its first request
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    '''
+        A worker only holds a connection while one of its requests is
+        readable or being served: accepted connections, and connections
+        left open after a response, wait in a selector (up to
+        `idle_timeout` seconds) until their next request arrives. Browsers
+        open speculative connections, and may keep them idle for a while,
+        so they would otherwise pin the whole pool during a join storm.
+
+        Past `max_connections` open connections, the accept loop waits up to
+        `accept_timeout` seconds for one to close, then closes the new one:
+        it never blocks (and so never delays `shutdown`) for longer.
+    '''
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, workers: int = 32, max_pending: int = 256,
+                 max_connections: int = 1024, idle_timeout: float = 30.0, request_timeout: float = 5.0,
+                 accept_timeout: float = 1.0, shutdown_timeout: float = 10.0):
+        self.workers = workers
+        self.accept_timeout = accept_timeout
+        self.idle_timeout = idle_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.draining = False
+        # Listen backlog, used once `max_connections` connections are already open
+        self.request_queue_size = max_pending
+
+        handler = type('RequestHandler', (KeepAliveRequestHandler,), {
+            # Only applies while a request is being read or answered
+            'timeout': request_timeout,
+        })
+        super().__init__(host, port, app, handler=handler)
+
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='APIWorker')
+        self.max_connections = max_connections
+        self.rejected = 0
+        self._connections = BoundedSemaphore(max_connections)
+        self._slots = BoundedSemaphore(workers + max_pending)
+        self._active = 0
+        self._idle = Condition()
+
+        # Idle connections with their deadline, in parking order (so in deadline order)
+        self._parked: Dict[socket.socket, Tuple[float, IdleConnection]] = {}
+        self._to_park: List[IdleConnection] = []
+        self._park_lock = Lock()
+        self._parking_closed = False
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._parking_thread = Thread(target=self._parking_loop, name='APIIdleConnections', daemon=True)
+        self._parking_thread.start()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'active': self._active,
+            'idle': len(self._parked),
+            'rejected': self.rejected,
+        }
+
+    def process_request(self, request, client_address):
+        if not self._connections.acquire(timeout=self.accept_timeout):
+            # Not counted in `_connections`: closed without releasing it
+            self.rejected += 1
+            log.warning("HTTP server full (%d connections), connection from %s closed",
+                        self.max_connections, client_address[0])
+            super().shutdown_request(request)
+            return
+        if not self._park(IdleConnection(request, client_address, None)):
+            self.shutdown_request(request)
+
+    def shutdown_request(self, request):
+        super().shutdown_request(request)
+        self._connections.release()
+
+    def _submit(self, function, *args) -> bool:
+        self._slots.acquire()
+        with self._idle:
+            self._active += 1
+        try:
+            self._executor.submit(function, *args)
+        except RuntimeError:
+            # Executor already shut down
+            self._release()
+            return False
+        return True
+
+    def _serve(self, idle: IdleConnection):
+        handler = idle.handler
+        try:
+            if handler is None:
+                handler = self.RequestHandlerClass(idle.connection, idle.client_address, self)
+            else:
+                handler.resume()
+        except Exception:
+            self.handle_error(idle.connection, idle.client_address)
+
+        try:
+            if handler is None or not handler.parked or not self._park(idle._replace(handler=handler)):
+                self._close(idle._replace(handler=handler))
+        finally:
+            self._release()
+
+    def _close(self, idle: IdleConnection):
+        if idle.handler is not None and idle.handler.parked:
+            idle.handler.release()
+        self.shutdown_request(idle.connection)
+
+    def _park(self, idle: IdleConnection) -> bool:
+        with self._park_lock:
+            if self._parking_closed or self.draining:
+                return False
+            self._to_park.append(idle)
+        try:
+            self._wakeup_w.send(b'\0')
+        except BlockingIOError:
+            # Already signaled
+            pass
+        return True
+
+    def _parking_loop(self):
+        '''
+            Hands the idle connections to a worker once their next request
+            arrives, and closes them after `idle_timeout` seconds.
+        '''
+        while True:
+            timeout = None
+            if self._parked:
+                timeout = max(0, next(iter(self._parked.values()))[0] - monotonic())
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        self._wakeup_r.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._selector.unregister(key.fileobj)
+                del self._parked[key.fileobj]
+                if not self._submit(self._serve, key.data):
+                    self._close(key.data)
+
+            with self._park_lock:
+                to_park, self._to_park = self._to_park, []
+                closing = self._parking_closed
+            deadline = monotonic() + self.idle_timeout
+            for idle in to_park:
+                self._parked[idle.connection] = (deadline, idle)
+                self._selector.register(idle.connection, selectors.EVENT_READ, idle)
+
+            now = monotonic()
+            for connection, (deadline, idle) in list(self._parked.items()):
+                if deadline > now and not closing:
+                    break
+                self._selector.unregister(connection)
+                del self._parked[connection]
+                self._close(idle)
+
+            if closing:
+                break
+
+    def _release(self):
+        self._slots.release()
+        with self._idle:
+            self._active -= 1
+            if self._active == 0:
+                self._idle.notify_all()
+
+    def shutdown(self):
+        '''
+            Stops accepting connections, closes the idle ones and waits (up
+            to `shutdown_timeout`) for in-flight requests to complete.
+        '''
+        self.draining = True
+        super().shutdown()
+
+        with self._park_lock:
+            self._parking_closed = True
+        try:
+            self._wakeup_w.send(b'\0')
+        except BlockingIOError:
+            pass
+        self._parking_thread.join()
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+        deadline = monotonic() + self.shutdown_timeout
+        with self._idle:
+            while self._active > 0:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    log.warning("HTTP server shutdown: %d connections still open", self._active)
+                    break
+                self._idle.wait(remaining)
+        self._executor.shutdown(wait=False)
+
+
+def create_server(host: str, port: int, app, mode: str = 'threaded', workers: int = 32) -> BaseWSGIServer:
+    if mode == 'pooled':
+        return PooledWSGIServer(host, port, app, workers=workers)
+    if mode == 'threaded':
+        return make_server(host, port, app, threaded=True)
+    raise ValueError(f"Unknown HTTP server mode '{mode}'")
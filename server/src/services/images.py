@@ -0,0 +1,199 @@
+'''
+    Question image delivery.
+
+    Source images (often multi-megabyte `.tif` files) are converted into
+    web-optimized variants at a few widths, built once in a background
+    worker pool and cached on disk under their source content hash, so a
+    variant never has to be invalidated and survives restarts. Every
+    response carries a content-hash ETag, so revalidations are answered with
+    `304 Not Modified`, and `Range` requests are supported.
+'''
+import hashlib
+import mimetypes
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from threading import Lock
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+from flask import send_file
+from PIL import Image
+
+from src.context.logger import get_logger
+from src.context.question import Question
+
+log = get_logger('images')
+
+
+class ImageAsset(NamedTuple):
+    path: Path
+    etag: str
+    mimetype: str
+
+
+class QuestionImages:
+    '''
+        Resolves (and builds, when needed) the file to serve for a question
+        image at a given width.
+
+        `prepare` schedules every variant of a question in the worker pool,
+        and is called as soon as a question is set up in a session, so they
+        are usually ready by the time participants request them. Requests
+        for a variant still being built wait for that same build (at most
+        `wait_timeout` seconds, then the source image is served) instead of
+        building it again.
+    '''
+    SIZES = (480, 960, 1920)
+    JPEG_QUALITY = 85
+
+    def __init__(self, cache_folder: Path, sizes: Sequence[int] = SIZES, workers: int = 2, wait_timeout: float = 10.0):
+        self.cache_folder = Path(cache_folder).absolute()
+        self.sizes = tuple(sorted(sizes))
+        self.wait_timeout = wait_timeout
+
+        self._lock = Lock()
+        # Source path -> ((mtime, size), content hash, being computed or already computed)
+        self._hashes: Dict[str, Tuple[Tuple[int, int], Future]] = {}
+        # (content hash, width) -> variant being built or already built
+        self._variants: Dict[Tuple[str, int], Future] = {}
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='QuestionImages')
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def source(self, question: Question) -> Optional[ImageAsset]:
+        if not question.img_is_local or question.img_path is None:
+            return None
+        path = Path(question.img_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._hashes.get(str(path), None)
+            owner = cached is None or cached[0] != signature
+            if owner:
+                # Concurrent requests of a cold image wait for this hash instead of computing it again
+                cached = self._hashes[str(path)] = (signature, Future())
+        future = cached[1]
+
+        if owner:
+            try:
+                future.set_result(self._hash_file(path))
+            except Exception as e:
+                with self._lock:
+                    if self._hashes.get(str(path), None) is cached:
+                        del self._hashes[str(path)]
+                future.set_exception(e)
+        try:
+            content_hash = future.result()
+        except OSError:
+            return None
+
+        return ImageAsset(path, content_hash, mimetypes.guess_type(path.name)[0] or 'application/octet-stream')
+
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def variant_width(self, requested: Optional[int]) -> int:
+        '''
+            Smallest configured width covering `requested` (the largest one
+            if not given or larger than all of them).
+        '''
+        if requested is not None:
+            for width in self.sizes:
+                if width >= requested:
+                    return width
+        return self.sizes[-1]
+
+    def prepare(self, question: Optional[Question]):
+        '''
+            Schedules the build of every variant of the question image.
+        '''
+        if question is None:
+            return
+        self._executor.submit(self._prepare, question)
+
+    def _prepare(self, question: Question):
+        try:
+            source = self.source(question)
+            if source is not None:
+                for width in self.sizes:
+                    self._schedule(source, width)
+        except Exception:
+            log.error("Couldn't prepare image of question [id=%d]", question.id, exc_info=True)
+
+    def _schedule(self, source: ImageAsset, width: int) -> Future:
+        key = (source.etag, width)
+        with self._lock:
+            future = self._variants.get(key, None)
+            if future is None:
+                future = self._variants[key] = self._executor.submit(self._build, source, width)
+        return future
+
+    def _build(self, source: ImageAsset, width: int) -> ImageAsset:
+        etag = f'{source.etag}-{width}'
+        for extension, mimetype in (('jpg', 'image/jpeg'), ('png', 'image/png')):
+            path = self.cache_folder / f'{etag}.{extension}'
+            if path.is_file():
+                return ImageAsset(path, etag, mimetype)
+
+        with Image.open(source.path) as image:
+            image.load()
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+            extension, mimetype = ('png', 'image/png') if has_alpha else ('jpg', 'image/jpeg')
+            path = self.cache_folder / f'{etag}.{extension}'
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            # Written under a temporary name, so a partial file is never served
+            tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+            if has_alpha:
+                image.save(tmp_path, 'PNG', optimize=True)
+            else:
+                image.save(tmp_path, 'JPEG', quality=QuestionImages.JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+
+        log.debug("Built %dpx variant of '%s'", width, source.path)
+        return ImageAsset(path, etag, mimetype)
+
+    def resolve(self, question: Question, width: Optional[int] = None, original: bool = False) -> Optional[ImageAsset]:
+        source = self.source(question)
+        if source is None or original:
+            return source
+
+        width = self.variant_width(width)
+        future = self._schedule(source, width)
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except FutureTimeoutError:
+            log.warning("Image variant of question [id=%d] not ready, serving the source image", question.id)
+        except Exception as e:
+            log.error("Couldn't build image variant of question [id=%d]: %s", question.id, e)
+            # Forget the failed build, so it is retried on the next request
+            with self._lock:
+                if self._variants.get((source.etag, width), None) is future:
+                    del self._variants[(source.etag, width)]
+        return source
+
+    @staticmethod
+    def response(asset: ImageAsset):
+        '''
+            `send_file` takes care of `If-None-Match` (304) and `Range` (206)
+            requests. Clients always revalidate, as a question folder may be
+            edited while keeping its id.
+        '''
+        response = send_file(asset.path, mimetype=asset.mimetype, conditional=True, etag=asset.etag)
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        return response
@@ -0,0 +1,71 @@
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, NamedTuple
+
+from flask import Request, Response
+
+
+class SerializedJson(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class JsonCache:
+    '''
+        Serialized JSON responses, cached per resource version.
+
+        Each resource (e.g. `('session', 1)`) keeps the body serialized for
+        the last version requested, so repeated GETs of an unchanged
+        resource don't rebuild and re-encode it. Versions are compared by
+        equality: sessions use their `version` counter, immutable objects
+        can be used as their own version. The ETag is a hash of the body,
+        so it stays valid across server restarts.
+    '''
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, version: Any, build: Callable[[], Any]) -> SerializedJson:
+        '''
+            Returns the cached serialization of `key` if it matches
+            `version`, or serializes `build()` otherwise. The version must be
+            read *before* building the content, so a concurrent change is
+            never cached under a newer version than the content it built.
+        '''
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        body = json.dumps(build(), separators=(',', ':')).encode()
+        serialized = SerializedJson(body, hashlib.blake2b(body, digest_size=12).hexdigest())
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (version, serialized)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return serialized
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    @staticmethod
+    def response(serialized: SerializedJson, request: Request) -> Response:
+        '''
+            `If-None-Match` requests matching the ETag get a `304`. Clients
+            must always revalidate, as the resource may change at any time.
+        '''
+        response = Response(serialized.body, mimetype='application/json')
+        response.set_etag(serialized.etag)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
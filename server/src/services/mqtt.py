@@ -1,13 +1,19 @@
+import logging
 import subprocess
 from pathlib import Path
 from threading import Thread
 
+from src.context.logger import get_logger
+
 MOSQUITTO_PATH = "mosquitto"
 
+log = get_logger('broker')
+
 
 class BrokerWrapper:
-    def __init__(self, host, port=9001):
+    def __init__(self, host, port=9001, verbose=False):
         self.port = port
+        self.verbose = verbose
         self.thread = None
         self.process = None
 
@@ -18,10 +24,21 @@ class BrokerWrapper:
     def is_running(self):
         return self.process is not None and self.process.poll() is None
 
+    @staticmethod
+    def _line_level(line: str) -> int:
+        # e.g. "1700000000: Error: Address already in use" (or without the timestamp)
+        if 'Error' in line:
+            return logging.ERROR
+        if 'Warning' in line:
+            return logging.WARNING
+        return logging.INFO
+
     def _monitor(self, stream, header="[mosquitto]"):
         for line in iter(stream.readline, b''):
-            print(header, line.decode('utf-8', errors='replace'), end='', flush=True)
-        print(f"{header} Stream '{stream.name}' closed")
+            line = line.decode('utf-8', errors='replace').rstrip()
+            # Logged at the level of the line: broker errors are rate-limited apart from the routine output
+            log.log(self._line_level(line), "%s %s", header, line)
+        log.info("%s Stream '%s' closed", header, stream.name)
         if callable(self.on_stop): self.on_stop()
 
     def start(self):
@@ -35,7 +52,7 @@ class BrokerWrapper:
             f.write("protocol websockets\n")
             f.write("allow_anonymous true\n")
 
-        self.process = subprocess.Popen([MOSQUITTO_PATH, '-v', '-c', tmp_file],
+        self.process = subprocess.Popen([MOSQUITTO_PATH, *(['-v'] if self.verbose else []), '-c', tmp_file],
                                         stdout=subprocess.PIPE,
                                         stderr=subprocess.PIPE)
         self.stdout_monitor = Thread(target=self._monitor, args=(self.process.stdout, "[mosquitto-stdout]"), daemon=True)
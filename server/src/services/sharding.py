@@ -0,0 +1,303 @@
+'''
+    Sharded (multi-process) headless server.
+
+    Sessions are spread across `n` worker processes (shards), so their MQTT
+    handling, aggregation and logging run on different cores instead of
+    sharing one GIL. Each shard is a regular headless server without
+    broker: its own MQTT connection to the broker of the front process, its
+    own sessions and its own HTTP API, listening on an internal port
+    (`api_port + 1 + shard`).
+
+    Session ids are interleaved (shard `k` creates sessions `k+1`, `k+1+n`,
+    `k+1+2n`...), so the owner of a session is `(session_id - 1) % n`. The
+    front process runs the broker and the public HTTP API: it serves the
+    client app and forwards every API call to the owning shard. New
+    sessions are created round-robin, question requests are spread by
+    question id and session listings are merged from every shard.
+
+    If a shard process dies, the whole server shuts down: its sessions
+    can't be recovered, and a half-working server would hide it.
+'''
+import heapq
+import http.client
+import json
+import multiprocessing
+import signal
+from argparse import Namespace
+from itertools import count, islice
+from queue import Empty
+from threading import Event, Lock, Thread, local
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import urlencode
+
+from flask import Flask, Response, request
+
+import src.context as ctx
+from src.context.communicator import SharedCommunicator
+from src.context.events import Signal
+from src.context.logger import get_logger, setup_logging, shutdown_logging
+from .api import ServerAPI
+from .http import create_server
+from .images import QuestionImages
+from .mqtt import BrokerWrapper
+from .static import StaticManifest
+
+log = get_logger('shards')
+
+# Hop-by-hop headers (and the ones recomputed by the front server) aren't forwarded
+SKIPPED_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'server', 'date'}
+
+
+def shard_port(args: Namespace, shard: int) -> int:
+    return args.api_port + 1 + shard
+
+
+def run_shard(shard: int, shards: int, args: Namespace, ready, stop_event):
+    '''
+        Entry point of a shard process.
+    '''
+    ctx.AppContext.args = args
+    setup_logging(args.log_level)
+    # SIGINT is also delivered to every process of the group: let the front process coordinate the shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    ctx.Session.last_id = shard + 1 - shards
+    ctx.Session.id_step = shards
+
+    ctx.AppContext.reload_questions()
+    ctx.AppContext.questions.start()
+    ctx.AppContext.question_images = QuestionImages(ctx.IMAGE_CACHE_FOLDER)
+    ctx.AppContext.mqtt_communicator = SharedCommunicator(port=args.mqtt_port)
+    ctx.AppContext.mqtt_communicator.start()
+    ctx.AppContext.api_service = ServerAPI(host='127.0.0.1', port=shard_port(args, shard),
+                                           server_mode=args.api_server, workers=args.api_workers,
+                                           serve_client=False)
+    ctx.AppContext.api_service.start()
+    log.info("Shard %d/%d up (API on port %d)", shard + 1, shards, shard_port(args, shard))
+    ready.put(shard)
+
+    try:
+        while not stop_event.wait(1):
+            pass
+    finally:
+        from . import stop_services
+        stop_services()
+        shutdown_logging()
+
+
+class ShardClient:
+    '''
+        Keep-alive HTTP connections to a shard API, one per calling thread.
+    '''
+
+    def __init__(self, port: int, timeout: float = 30):
+        self.port = port
+        self.timeout = timeout
+        self._local = local()
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        for retry in (False, True):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+            try:
+                connection.request(method, path, body, headers or {})
+                response = connection.getresponse()
+                return response.status, response.getheaders(), response.read()
+            except (OSError, http.client.HTTPException):
+                # The shard may have closed an idle keep-alive connection: retry once on a new one
+                connection.close()
+                self._local.connection = None
+                if retry:
+                    raise
+
+
+class ShardError(Exception):
+    def __init__(self, status: int, body: bytes):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+
+
+class ShardRouter(Thread):
+    '''
+        Public HTTP API of a sharded server: forwards every call to the
+        shard that owns the session (or question).
+    '''
+    on_start = Signal()
+    FORWARDED_HEADERS = ('Content-Type', 'Accept', 'Accept-Encoding', 'If-None-Match', 'Range')
+
+    def __init__(self, shard_ports: List[int], host='0.0.0.0', port=5000, server_mode='threaded', workers=32):
+        Thread.__init__(self)
+        self.shards = [ShardClient(shard_port) for shard_port in shard_ports]
+        self._next_shard = count()
+        self._next_shard_lock = Lock()
+
+        self.app = Flask(__name__, static_folder=None)
+        self.static_manifest = StaticManifest(ctx.CLIENT_BUILD_FOLDER)
+
+        @self.app.route('/api/session', methods=['POST'])
+        def api_create_session():
+            with self._next_shard_lock:
+                shard = next(self._next_shard) % len(self.shards)
+            return self.forward(shard)
+
+        @self.app.route('/api/session', methods=['GET'])
+        def api_get_all_sessions():
+            '''
+                Merge by id of the session listings of every shard (see
+                `ServerAPI`), each one read page by page after the last id
+                seen, so the cost of a page only depends on its offset.
+            '''
+            offset = request.args.get('offset', 0, type=int)
+            limit = request.args.get('limit', ServerAPI.SESSION_PAGE_SIZE, type=int)
+            after = request.args.get('after', 0, type=int)
+            if offset < 0 or after < 0 or not 0 < limit <= ServerAPI.MAX_SESSION_PAGE_SIZE:
+                return f"Requested offset must be positive and limit within 1-{ServerAPI.MAX_SESSION_PAGE_SIZE}", 400
+
+            filters = {key: value for key, value in request.args.items() if key not in ('offset', 'limit', 'after')}
+            totals: Dict[int, int] = {}
+            listings = [self._shard_sessions(shard, filters, after, totals) for shard in range(len(self.shards))]
+            try:
+                # The merge starts by reading the first page of every shard, so every total is known
+                merged = heapq.merge(*listings, key=lambda session: session['id'])
+                sessions = list(islice(merged, offset, offset + limit))
+            except ShardError as e:
+                return Response(e.body, e.status)
+            except (OSError, http.client.HTTPException) as e:
+                log.error("Shard unreachable: %s", e)
+                return "Shard unavailable", 502
+
+            response = Response(json.dumps(sessions), mimetype='application/json')
+            response.headers['X-Total-Count'] = str(sum(totals.values()))
+            return response
+
+        @self.app.route('/api/session/<int:session_id>', methods=['GET', 'PATCH', 'PUT', 'POST', 'DELETE'])
+        @self.app.route('/api/session/<int:session_id>/<path:path>', methods=['GET', 'PATCH', 'PUT', 'POST', 'DELETE'])
+        def api_session_handle(session_id: int, path: str = None):
+            return self.forward((session_id - 1) % len(self.shards))
+
+        @self.app.route('/api/question/<int:question_id>', methods=['GET'])
+        @self.app.route('/api/question/<int:question_id>/<path:path>', methods=['GET'])
+        def api_question_handle(question_id: int, path: str = None):
+            # Keeps each question (and its cached image variants) in a single shard
+            return self.forward(question_id % len(self.shards))
+
+        @self.app.route('/', defaults={'path': ''})
+        @self.app.route('/<path:path>')
+        def client_handler(path):
+            if path.startswith('api/'):
+                return "Not found", 404
+            asset = self.static_manifest.resolve(path)
+            if asset is None:
+                return "Client app not found", 404
+
+            return self.static_manifest.response(asset, request)
+
+        self.server = create_server(host, port, self.app, server_mode, workers)
+
+    def _shard_sessions(self, shard: int, filters: dict, after: int, totals: Dict[int, int]) -> Iterator[dict]:
+        '''
+            Sessions of a shard in id order, requested lazily page by page.
+            Its total is stored in `totals` once the first page is received.
+        '''
+        while True:
+            query = urlencode({**filters, 'after': after, 'limit': ServerAPI.MAX_SESSION_PAGE_SIZE})
+            status, headers, body = self.shards[shard].request('GET', f'/api/session?{query}')
+            if status != 200:
+                raise ShardError(status, body)
+            if shard not in totals:
+                totals[shard] = int(dict(headers).get('X-Total-Count', 0))
+
+            sessions = json.loads(body)
+            yield from sessions
+            if len(sessions) < ServerAPI.MAX_SESSION_PAGE_SIZE:
+                return
+            after = sessions[-1]['id']
+
+    def forward(self, shard: int) -> Response:
+        headers = {
+            header: request.headers[header]
+            for header in ShardRouter.FORWARDED_HEADERS
+            if header in request.headers
+        }
+        try:
+            status, response_headers, body = self.shards[shard].request(
+                request.method, request.full_path.rstrip('?'), request.get_data() or None, headers
+            )
+        except (OSError, http.client.HTTPException) as e:
+            log.error("Shard %d unreachable: %s", shard, e)
+            return "Shard unavailable", 502
+
+        return Response(body, status, [
+            (header, value)
+            for header, value in response_headers
+            if header.lower() not in SKIPPED_HEADERS
+        ])
+
+    def run(self):
+        self.on_start.emit()
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+def run(shards: int):
+    '''
+        Runs a sharded headless server until SIGINT/SIGTERM is received.
+    '''
+    args = ctx.AppContext.args
+    stop_event = Event()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(stop_signal, lambda *_: stop_event.set())
+
+    broker = BrokerWrapper('localhost', args.mqtt_port, verbose=args.mosquitto_verbose)
+    broker.start()
+
+    # Spawned (not forked): shards must not inherit the threads of this process
+    mp = multiprocessing.get_context('spawn')
+    shard_stop = mp.Event()
+    ready = mp.Queue()
+    processes = [
+        mp.Process(target=run_shard, args=(shard, shards, args, ready, shard_stop), name=f'Shard-{shard}')
+        for shard in range(shards)
+    ]
+    for process in processes:
+        process.start()
+
+    router = None
+    try:
+        started = 0
+        while started < shards and not stop_event.is_set():
+            try:
+                ready.get(timeout=1)
+                started += 1
+            except Empty:
+                if any(not process.is_alive() for process in processes):
+                    log.error("A shard process exited during startup")
+                    return
+
+        if started == shards:
+            router = ShardRouter([shard_port(args, shard) for shard in range(shards)],
+                                 port=args.api_port, server_mode=args.api_server, workers=args.api_workers)
+            router.start()
+            log.info("Sharded server up: %d shards behind port %d", shards, args.api_port)
+
+        while not stop_event.wait(1):
+            dead = [shard for shard, process in enumerate(processes) if not process.is_alive()]
+            if dead:
+                for shard in dead:
+                    log.error("Shard %d exited (exit code %s), shutting down", shard, processes[shard].exitcode)
+                break
+    finally:
+        log.info("Shutting down")
+        if router is not None:
+            router.shutdown()
+            router.join()
+        shard_stop.set()
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        broker.stop()
@@ -0,0 +1,157 @@
+'''
+    Client app (React build) delivery.
+
+    The build folder is scanned once, when the API starts, into an immutable
+    manifest, so requests never touch the filesystem to find out whether a
+    path is a file or has to fall back to `index.html`. Compressible assets
+    are precompressed (gzip, and brotli if the `brotli` package is
+    installed) at that point, unless the build already ships `.gz`/`.br`
+    files next to them, and the best encoding accepted by the client is
+    served. Assets with a content hash in their name are served with
+    long-lived immutable cache headers; the rest (`index.html`, manifest...)
+    are revalidated through their ETag.
+'''
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Mapping, NamedTuple, Optional
+
+from flask import Request, Response, send_file
+
+from src.context.logger import get_logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = get_logger('static')
+
+
+class StaticAsset(NamedTuple):
+    path: Path
+    mimetype: str
+    etag: str
+    immutable: bool
+    data: Optional[bytes]
+    '''
+        File contents, `None` for files too large to be kept in memory.
+    '''
+    encoded: Mapping[str, bytes]
+    '''
+        Precompressed contents by content coding (`br`, `gzip`).
+    '''
+
+
+class StaticManifest:
+    COMPRESSIBLE_TYPES = re.compile(r'^(text/.*|application/(javascript|json|manifest\+json|xml|wasm)|image/svg\+xml)$')
+    # Create React App style content hashes: `main.3f2a1b9c.js`, `787.2e1ba5f4.chunk.js`...
+    HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.')
+    MIN_COMPRESS_SIZE = 1024
+    MAX_MEMORY_SIZE = 4 << 20
+    IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+    ENCODINGS = ('br', 'gzip')
+
+    def __init__(self, root: Path, fallback: str = 'index.html'):
+        self.root = Path(root).absolute()
+        self.fallback = fallback
+
+        assets: Dict[str, StaticAsset] = {}
+        total_size = 0
+        if self.root.is_dir():
+            for folder, _, files in os.walk(self.root):
+                for name in files:
+                    path = Path(folder) / name
+                    if path.suffix in ('.gz', '.br') and path.with_suffix('').is_file():
+                        continue
+                    asset = self._load(path)
+                    assets[path.relative_to(self.root).as_posix()] = asset
+                    total_size += sum(len(data) for data in asset.encoded.values())
+        else:
+            log.warning("Client app not found at '%s'", self.root)
+
+        self.assets: Mapping[str, StaticAsset] = MappingProxyType(assets)
+        log.info("Client app: %d files (%.1f kB precompressed)", len(assets), total_size / 1024)
+
+    def _load(self, path: Path) -> StaticAsset:
+        relative_path = path.relative_to(self.root).as_posix()
+        mimetype = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        stat = path.stat()
+        size = stat.st_size
+
+        if size > StaticManifest.MAX_MEMORY_SIZE:
+            # Served from disk as-is (e.g. large source maps)
+            etag = f'{stat.st_mtime_ns:x}-{size:x}'
+            return StaticAsset(path, mimetype, etag, self._is_immutable(relative_path), None, MappingProxyType({}))
+
+        data = path.read_bytes()
+        encoded = {}
+        if StaticManifest.COMPRESSIBLE_TYPES.match(mimetype) and size >= StaticManifest.MIN_COMPRESS_SIZE:
+            for encoding in StaticManifest.ENCODINGS:
+                compressed = self._compress(path, data, encoding)
+                # Not worth it if it doesn't save at least a 10%
+                if compressed is not None and len(compressed) < size * 0.9:
+                    encoded[encoding] = compressed
+
+        return StaticAsset(
+            path=path,
+            mimetype=mimetype,
+            etag=hashlib.blake2b(data, digest_size=16).hexdigest(),
+            immutable=self._is_immutable(relative_path),
+            data=data,
+            encoded=MappingProxyType(encoded),
+        )
+
+    @staticmethod
+    def _compress(path: Path, data: bytes, encoding: str) -> Optional[bytes]:
+        precompressed = path.with_name(f"{path.name}.{'gz' if encoding == 'gzip' else 'br'}")
+        if precompressed.is_file():
+            return precompressed.read_bytes()
+        if encoding == 'gzip':
+            return gzip.compress(data, compresslevel=9, mtime=0)
+        if encoding == 'br' and brotli is not None:
+            return brotli.compress(data, quality=11)
+        return None
+
+    def _is_immutable(self, relative_path: str) -> bool:
+        return StaticManifest.HASHED_NAME.search(relative_path.rsplit('/', 1)[-1]) is not None
+
+    def resolve(self, path: str) -> Optional[StaticAsset]:
+        '''
+            Asset at `path`, or the SPA fallback (`index.html`) for any path
+            that isn't a file of the build (client side routes).
+        '''
+        asset = self.assets.get(path, None)
+        return asset if asset is not None else self.assets.get(self.fallback, None)
+
+    def response(self, asset: StaticAsset, request: Request) -> Response:
+        if asset.data is None:
+            response = send_file(asset.path, mimetype=asset.mimetype, conditional=True, etag=asset.etag)
+        else:
+            encoding = next((
+                    encoding
+                    for encoding in StaticManifest.ENCODINGS
+                    if encoding in asset.encoded and request.accept_encodings[encoding]
+                ), None)
+
+            body = asset.encoded[encoding] if encoding else asset.data
+            response = Response(body, mimetype=asset.mimetype)
+            if encoding:
+                response.content_encoding = encoding
+            if asset.encoded:
+                response.vary.add('Accept-Encoding')
+            # Each representation needs its own (strong) ETag
+            response.set_etag(f'{asset.etag}-{encoding}' if encoding else asset.etag)
+            response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
+        if asset.immutable:
+            response.cache_control.public = True
+            response.cache_control.max_age = StaticManifest.IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
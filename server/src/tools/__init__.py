@@ -0,0 +1,4 @@
+'''
+    Offline tools working on session logs (`SESSION_LOG_FOLDER`). Run them
+    from the `server` folder with `python -m src.tools.<tool> --help`.
+'''
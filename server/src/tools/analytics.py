@@ -0,0 +1,297 @@
+'''
+    Offline analytics of the recorded sessions.
+
+    Every session log folder in `SESSION_LOG_FOLDER` is analyzed in a
+    process pool, and its results are summarized in one row of a CSV table
+    (`summary.csv` by default):
+
+    - `final_answer`/`final_support`: answer with the highest weight in the
+      final central cue (mean of the last position of every participant),
+      and that weight.
+    - `convergence_time`: seconds from the first update until the cue
+      settled on the final answer, i.e. the answer leads the cue with at
+      least `--threshold` weight from then on. Empty if it never settled.
+    - `travel_mean`/`travel_max`: distance covered by the participants in
+      the position space (sum of the distances between their consecutive
+      positions).
+
+    A manifest (`analytics.json`) keeps the results and a signature of the
+    log files of every session, so only new or changed sessions are
+    analyzed on the next run. The manifest is saved every few completed
+    chunks of sessions, so an interrupted run keeps most of its work.
+    Sessions that can't be analyzed are reported in the `error` column, and
+    only retried once their logs change (or with `--force`):
+
+        python -m src.tools.analytics --workers 8
+'''
+import csv
+import json
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List
+
+import numpy as np
+
+from src.context import SESSION_LOG_FOLDER, AppContext
+from src.context.log_formats import SessionLogReader
+from src.context.logger import get_logger, setup_logging, shutdown_logging
+
+log = get_logger('analytics')
+
+MANIFEST_VERSION = 1
+SUMMARY_COLUMNS = (
+    'folder', 'session', 'time', 'question', 'duration', 'answers', 'participants', 'updates',
+    'final_answer', 'final_support', 'convergence_time', 'travel_mean', 'travel_max', 'error',
+)
+
+
+def log_signature(folder: Path) -> List[int]:
+    '''
+        `[files, total size, latest mtime]` of the files of a session log.
+    '''
+    paths = [folder / 'session.json', folder / 'log.csv']
+    if (folder / 'log').is_dir():
+        paths.extend(entry.path for entry in os.scandir(folder / 'log') if entry.is_file())
+
+    files, size, mtime = 0, 0, 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files += 1
+        size += stat.st_size
+        mtime = max(mtime, stat.st_mtime_ns)
+    return [files, size, mtime]
+
+
+def analyze_session(folder: Path, step: float = 0.1, threshold: float = 0.5) -> dict:
+    '''
+        Results of a session log (see the module documentation). The central
+        cue is rebuilt on a grid of `step` seconds: each participant holds
+        its last known position until its next update.
+    '''
+    reader = SessionLogReader(folder)
+    info = reader.info
+    result = {
+        'session': info.get('id', None),
+        'time': info.get('time', None),
+        'question': info.get('question', None),
+        'duration': info.get('duration', None),
+    }
+
+    participants = []
+    for _, data in reader:
+        timestamps = np.asarray(data['timestamp'], dtype=np.float64)
+        positions = np.asarray(data['position'], dtype=np.float64)
+        valid = ~np.isnan(timestamps)
+        if np.any(valid):
+            participants.append((timestamps[valid], np.nan_to_num(positions[valid])))
+
+    answers = info.get('answers', None) or (participants[0][1].shape[1] if participants else 0)
+    result.update({
+        'answers': answers,
+        'participants': len(participants),
+        'updates': sum(len(timestamps) for timestamps, _ in participants),
+    })
+    if not participants or answers == 0:
+        return result
+
+    end = max(timestamps[-1] for timestamps, _ in participants)
+    start = min(timestamps[0] for timestamps, _ in participants)
+    grid = np.arange(start, end + step, step)
+    sums = np.zeros((len(grid), answers))
+    counts = np.zeros(len(grid))
+    travel = np.zeros(len(participants))
+
+    for i, (timestamps, positions) in enumerate(participants):
+        # Updates may arrive out of order
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, positions = timestamps[order], positions[order, :answers]
+
+        rows = np.searchsorted(timestamps, grid, side='right') - 1
+        known = rows >= 0
+        sums[known] += positions[rows[known]]
+        counts[known] += 1
+        travel[i] = np.linalg.norm(np.diff(positions, axis=0), axis=1).sum()
+
+    cue = sums / np.maximum(counts, 1)[:, None]
+    final_answer = int(np.argmax(cue[-1]))
+    leading = (np.argmax(cue, axis=1) == final_answer) & (cue[:, final_answer] >= threshold) & (counts > 0)
+    convergence_time = None
+    if leading[-1]:
+        # First step of the final run of steps where the answer leads
+        not_leading = np.flatnonzero(~leading)
+        first = not_leading[-1] + 1 if len(not_leading) else 0
+        convergence_time = float(grid[first] - start)
+
+    result.update({
+        'final_answer': final_answer,
+        'final_support': float(cue[-1, final_answer]),
+        'convergence_time': convergence_time,
+        'travel_mean': float(travel.mean()),
+        'travel_max': float(travel.max()),
+    })
+    return result
+
+
+def _analyze(task) -> dict:
+    folder, step, threshold = task
+    try:
+        return analyze_session(folder, step, threshold)
+    except Exception as e:
+        # Reported in the summary, the rest of the sessions are still analyzed
+        return {'error': f"{type(e).__name__}: {e}"}
+
+
+def _analyze_chunk(tasks) -> List[dict]:
+    # Several sessions per task: thousands of small sessions would be dominated by the IPC otherwise
+    return [_analyze(task) for task in tasks]
+
+
+class SessionAnalytics:
+    '''
+        Incremental analysis of a session log folder. `run()` analyzes the
+        sessions whose logs changed since the last run (according to the
+        manifest) and rewrites the manifest and the summary table.
+    '''
+
+    def __init__(self,
+        log_folder: Path = SESSION_LOG_FOLDER,
+        manifest_path: Path = None,
+        summary_path: Path = None,
+        workers: int = None,
+        step: float = 0.1,
+        threshold: float = 0.5,
+        save_interval: int = 100,
+    ):
+        self.log_folder = Path(log_folder)
+        self.manifest_path = manifest_path or self.log_folder / 'analytics.json'
+        self.summary_path = summary_path or self.log_folder / 'summary.csv'
+        self.workers = workers
+        self.step = step
+        self.threshold = threshold
+        self.save_interval = save_interval    # Sessions analyzed between manifest saves
+
+    def load_manifest(self) -> Dict[str, dict]:
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log.warning("Invalid manifest '%s', every session will be analyzed", self.manifest_path)
+            return {}
+
+        # Results computed with other settings are stale
+        settings = {'version': MANIFEST_VERSION, 'step': self.step, 'threshold': self.threshold}
+        if any(manifest.get(key, None) != value for key, value in settings.items()):
+            return {}
+        return manifest.get('sessions', {})
+
+    def scan(self) -> Dict[str, List[int]]:
+        if not self.log_folder.is_dir():
+            return {}
+        return {
+            entry.name: log_signature(Path(entry.path))
+            for entry in os.scandir(self.log_folder)
+            if entry.is_dir() and os.path.isfile(os.path.join(entry.path, 'session.json'))
+        }
+
+    def run(self, force: bool = False) -> Dict[str, dict]:
+        start = perf_counter()
+        sessions = self.load_manifest() if not force else {}
+        signatures = self.scan()
+
+        pending = [
+            name for name, signature in signatures.items()
+            if name not in sessions or sessions[name]['signature'] != signature
+        ]
+        # Sessions whose logs were removed
+        sessions = {name: entry for name, entry in sessions.items() if name in signatures}
+        log.info("%d sessions, %d to analyze", len(signatures), len(pending))
+
+        if pending:
+            workers = self.workers or os.cpu_count() or 1
+            chunksize = max(1, min(len(pending) // (4 * workers), self.save_interval))
+            chunks = [pending[i:i + chunksize] for i in range(0, len(pending), chunksize)]
+            done, saved = 0, 0
+            with ProcessPoolExecutor(workers) as executor:
+                futures = {
+                    executor.submit(_analyze_chunk, [(self.log_folder / name, self.step, self.threshold) for name in chunk]): chunk
+                    for chunk in chunks
+                }
+                for future in as_completed(futures):
+                    for name, result in zip(futures[future], future.result()):
+                        if 'error' in result:
+                            log.warning("[%s] %s", name, result['error'])
+                        sessions[name] = {'signature': signatures[name], 'result': result}
+                    done += len(futures[future])
+                    if done - saved >= self.save_interval:
+                        self.write_manifest(sessions)
+                        saved = done
+                        log.info("%d/%d sessions analyzed", done, len(pending))
+
+        self.write_manifest(sessions)
+        self.write_summary(sessions)
+        log.info("%d sessions analyzed in %.1f s, summary written to '%s'",
+                 len(pending), perf_counter() - start, self.summary_path)
+        return sessions
+
+    def write_manifest(self, sessions: Dict[str, dict]):
+        self._replace(self.manifest_path, lambda f: json.dump({
+            'version': MANIFEST_VERSION,
+            'step': self.step,
+            'threshold': self.threshold,
+            'sessions': sessions,
+        }, f))
+
+    def write_summary(self, sessions: Dict[str, dict]):
+        def write(f):
+            writer = csv.DictWriter(f, SUMMARY_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            for name in sorted(sessions):
+                writer.writerow({'folder': name, **sessions[name]['result']})
+        self._replace(self.summary_path, write)
+
+    @staticmethod
+    def _replace(path: Path, write):
+        '''
+            Writes a file through a temporary one, so an interrupted run
+            never leaves it truncated.
+        '''
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        with open(tmp_path, 'w', newline='') as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+
+def main():
+    parser = ArgumentParser(description="Summarizes the recorded session logs")
+    parser.add_argument('--logs', type=Path, default=SESSION_LOG_FOLDER,
+                        help=f"Session log folder. Default: {SESSION_LOG_FOLDER}")
+    parser.add_argument('--summary', type=Path, help="Summary CSV file. Default: <logs>/summary.csv")
+    parser.add_argument('--manifest', type=Path, help="Manifest file. Default: <logs>/analytics.json")
+    parser.add_argument('--workers', type=int, help="Worker processes. Default: one per CPU")
+    parser.add_argument('--step', type=float, default=0.1,
+                        help="Time step (s) of the rebuilt central cue. Default: 0.1")
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help="Minimum cue weight of the final answer to consider the session converged. Default: 0.5")
+    parser.add_argument('--save-interval', dest='save_interval', type=int, default=100,
+                        help="Sessions analyzed between manifest saves. Default: 100")
+    parser.add_argument('--force', action='store_true', help="Analyze every session, ignoring the manifest")
+    args = parser.parse_args()
+
+    setup_logging(AppContext.args.log_level)
+    try:
+        SessionAnalytics(args.logs, args.manifest, args.summary, args.workers, args.step, args.threshold,
+                         args.save_interval).run(args.force)
+    finally:
+        shutdown_logging()
+
+
+if __name__ == '__main__':
+    main()
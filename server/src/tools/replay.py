@@ -0,0 +1,196 @@
+'''
+    Replays a recorded session log to the MQTT broker.
+
+    Every update of the log is published again on
+    `swarm/session/<session id>/updates/<participant id>`, as the original
+    participants did, at the recorded pace (`--speed 1`), N times faster
+    (`--speed N`) or as fast as possible (`--speed 0`). The log is streamed
+    (see `SessionLogReader.records`), so sessions of any size can be
+    replayed. The achieved rate and the lag behind the schedule are
+    reported periodically and at the end:
+
+        python -m src.tools.replay session_log/2024-01-01-12-00-00-1 --speed 10
+
+    Updates go to the original session id unless `--session` is given. The
+    receiving session only aggregates positions matching its question, so
+    set the same question (or one with the same number of answers) to
+    review a replayed session in the GUI.
+'''
+import json
+import signal
+from argparse import ArgumentParser
+from pathlib import Path
+from threading import Event
+from time import perf_counter
+
+import paho.mqtt.client as mqtt
+
+from src.context import AppContext
+from src.context import wire
+from src.context.latency import LatencyHistogram
+from src.context.log_formats import SessionLogReader
+from src.context.logger import get_logger, setup_logging, shutdown_logging
+
+log = get_logger('replay')
+
+
+class SessionReplay:
+    '''
+        Publishes the records of a session log following their timestamps.
+
+        Publishing is paced against the wall clock: record `i` is due
+        `(timestamp_i - timestamp_0) / speed` seconds after the replay
+        started. `lag` tracks how late every record was actually published
+        (not recorded when `speed` is `0`, as there is no schedule). paho
+        buffers outgoing messages without bound, so at most two windows of
+        `window` messages are left unsent before publishing blocks.
+    '''
+
+    def __init__(self,
+        folder: Path,
+        host: str = 'localhost',
+        port: int = 9001,
+        session_id: int = None,
+        speed: float = 1.0,
+        wire_format: str = 'json',
+        report_interval: float = 5.0,
+        window: int = 256,
+    ):
+        self.reader = SessionLogReader(folder)
+        self.host = host
+        self.port = port
+        self.session_id = session_id if session_id is not None else self.reader.info['id']
+        self.speed = speed
+        self.wire_format = wire_format
+        self.report_interval = report_interval
+        self.window = window
+
+        self.sent = 0
+        self.lag = LatencyHistogram()
+        self.elapsed = 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'session': self.session_id,
+            'sent': self.sent,
+            'elapsed': self.elapsed,
+            'rate': self.sent / self.elapsed if self.elapsed else None,
+            'lag': self.lag.as_dict if self.speed > 0 else None,
+        }
+
+    def encode(self, participant_id: int, timestamp: float, position) -> bytes:
+        if self.wire_format == 'binary':
+            return wire.encode_update(participant_id, timestamp if timestamp is not None else float('nan'), position)
+        return json.dumps({
+            'data': {'position': position},
+            'timestamp': timestamp,
+        }).encode()
+
+    def connect(self, timeout: float = 10.0) -> mqtt.Client:
+        connected = Event()
+
+        def on_connect(client, userdata, flags, rc):
+            if rc == mqtt.CONNACK_ACCEPTED:
+                connected.set()
+
+        client = mqtt.Client(transport='websockets')
+        client.on_connect = on_connect
+        client.connect(self.host, self.port)
+        client.loop_start()
+        if not connected.wait(timeout):
+            client.loop_stop()
+            raise ConnectionError(f"Can't connect to the MQTT broker at {self.host}:{self.port}")
+        return client
+
+    def run(self, stop_event: Event = None) -> dict:
+        stop_event = stop_event or Event()
+        client = self.connect()
+        log.info("Replaying '%s' into session %d (%s)", self.reader.folder.name, self.session_id,
+                 f"{self.speed:g}x" if self.speed > 0 else 'max speed')
+
+        start = perf_counter()
+        next_report = start + self.report_interval
+        reported_sent, reported_time = 0, start
+        first_timestamp = None
+        due = start
+        pending = None
+        try:
+            for participant_id, timestamp, position in self.reader.records():
+                if stop_event.is_set():
+                    break
+
+                if self.speed > 0:
+                    if timestamp is not None:
+                        if first_timestamp is None:
+                            first_timestamp = timestamp
+                        due = start + (timestamp - first_timestamp) / self.speed
+                    delay = due - perf_counter()
+                    if delay > 0 and stop_event.wait(delay):
+                        break
+                    self.lag.record(perf_counter() - due)
+
+                info = client.publish(f'swarm/session/{self.session_id}/updates/{participant_id}',
+                                      self.encode(participant_id, timestamp, position))
+                self.sent += 1
+
+                if self.sent % self.window == 0:
+                    # Backpressure: the previous window must be on the wire before queueing another one
+                    if pending is not None and pending.rc == mqtt.MQTT_ERR_SUCCESS:
+                        pending.wait_for_publish(timeout=10)
+                    pending = info
+
+                now = perf_counter()
+                if now >= next_report:
+                    self.report(now - reported_time, self.sent - reported_sent)
+                    reported_sent, reported_time = self.sent, now
+                    next_report = now + self.report_interval
+
+            if pending is not None and pending.rc == mqtt.MQTT_ERR_SUCCESS:
+                pending.wait_for_publish(timeout=10)
+        finally:
+            self.elapsed = perf_counter() - start
+            client.disconnect()
+            client.loop_stop()
+
+        log.info("Replay finished: %s", json.dumps(self.stats))
+        return self.stats
+
+    def report(self, interval: float, sent: int):
+        if self.speed > 0:
+            lag = self.lag.as_dict
+            log.info("%d sent, %.0f msg/s, lag p50 %.1f ms, p99 %.1f ms, max %.1f ms",
+                     self.sent, sent / interval, lag['p50'] * 1000, lag['p99'] * 1000, lag['max'] * 1000)
+        else:
+            log.info("%d sent, %.0f msg/s", self.sent, sent / interval)
+
+
+def main():
+    parser = ArgumentParser(description="Replays a recorded session log to the MQTT broker")
+    parser.add_argument('folder', type=Path, help="Session log folder (with session.json)")
+    parser.add_argument('--host', default='localhost', help="MQTT broker host. Default: localhost")
+    parser.add_argument('--mqtt-port', dest='mqtt_port', type=int, default=AppContext.args.mqtt_port,
+                        help=f"MQTT broker port. Default: {AppContext.args.mqtt_port}")
+    parser.add_argument('--session', dest='session_id', type=int,
+                        help="Session to publish the updates to. Default: the recorded one")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Replay speed multiplier, 0 for as fast as possible. Default: 1")
+    parser.add_argument('--wire-format', dest='wire_format', choices=wire.FORMATS, default='json',
+                        help="Encoding of the published updates. Default: json")
+    parser.add_argument('--report-interval', dest='report_interval', type=float, default=5.0,
+                        help="Seconds between progress reports. Default: 5")
+    args = parser.parse_args()
+
+    setup_logging(AppContext.args.log_level)
+    stop_event = Event()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(stop_signal, lambda *_: stop_event.set())
+    try:
+        SessionReplay(args.folder, args.host, args.mqtt_port, args.session_id,
+                      args.speed, args.wire_format, args.report_interval).run(stop_event)
+    finally:
+        shutdown_logging()
+
+
+if __name__ == '__main__':
+    main()